@@ -1,33 +1,27 @@
-from flask import Flask, request, send_file, render_template, session, redirect, url_for
-import pandas as pd
-import os, uuid, re, base64
+from flask import Flask, request, send_file, render_template, session, redirect, url_for, jsonify
+import os, uuid, re, json, glob, hashlib, hmac, threading, functools, gc, time
 import xml.etree.ElementTree as ET
-
-try:
-    import cairosvg
-    HAS_CAIROSVG = True
-except (ImportError, OSError):
-    HAS_CAIROSVG = False
-
-# =================================================
-# SVG NAMESPACE
-# =================================================
-SVG_NS = "http://www.w3.org/2000/svg"
-XLINK_NS = "http://www.w3.org/1999/xlink"
-VISIO_NS = "http://schemas.microsoft.com/visio/2003/SVGExtensions/"
-ET.register_namespace("", SVG_NS)
-
-
-def svg_tag(tag):
-    return f"{{{SVG_NS}}}{tag}"
-
-def get_viewbox(svg_root):
-    vb = svg_root.attrib.get("viewBox")
-    if vb:
-        p = vb.replace(",", " ").split()
-        if len(p) == 4:
-            return float(p[2]), float(p[3])
-    return 800, 600
+from concurrent.futures import ThreadPoolExecutor
+
+from bms_tool.uploads import receive_upload, UploadTooLarge
+from bms_tool import guard
+from bms_tool.guard import ParseLimitExceeded, parse_svg, check_svg
+from bms_tool.lifecycle import ArtifactManager
+from bms_tool.catalog import Catalog
+from bms_tool.blobstore import open_store, file_digest
+from bms_tool import output_size, lazy
+# pandas / openpyxl / cairosvg are heavy: import on first use via these accessors (see bms_tool.lazy)
+from bms_tool.lazy import pandas, cairosvg
+
+# Pipeline (Excel tables -> SVG, merge into drawing) lives in bms_tool so it can run without Flask
+from bms_tool.svg import SVG_NS, svg_tag, get_viewbox
+from bms_tool.tables import read_all_tables, build_table_svg, normalize_table
+from bms_tool.drawing import update_svg, update_svg_delta, table_point_ids
+from bms_tool.compiled import merge_template, precompile
+from bms_tool.template_index import TemplateIndex
+from bms_tool.prune import prune_kinds
+from bms_tool.profiling import ProfileStore
+from bms_tool.rows import RowsError, detect_format, parse_rows, write_table_model, read_table_model
 
 # =================================================
 # APP + PATHS
@@ -47,820 +41,360 @@ EXCEL_DIR = os.path.join(UP, "excel")
 DRAWING_DIR = os.path.join(UP, "drawing")
 TEMP_DIR = os.path.join(UP, "temp")
 SVG_TEMPLATES_DIR = os.path.join(UP, "svg_templates")
+OUTPUT_DIR = os.path.join(UP, "output")
 
-for d in (EXCEL_DIR, DRAWING_DIR, TEMP_DIR, SVG_TEMPLATES_DIR):
+for d in (TEMP_DIR, SVG_TEMPLATES_DIR):
     os.makedirs(d, exist_ok=True)
 
 
-def list_svg_templates():
-    """Return list of (filename, display_name) for saved SVG templates."""
-    if not os.path.isdir(SVG_TEMPLATES_DIR):
-        return []
-    out = []
-    for f in sorted(os.listdir(SVG_TEMPLATES_DIR)):
-        if f.endswith(".svg"):
-            name = os.path.splitext(f)[0].replace("_", " ")
-            out.append((f, name))
-    return out
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, "").strip() or default)
+    except (ValueError, TypeError):
+        return default
 
-# =================================================
-# XML SAFE
-# =================================================
-def xml_escape(val):
-    if val is None:
-        return ""
-    return (
-        str(val)
-        .replace("&", "&amp;")
-        .replace("<", "&lt;")
-        .replace(">", "&gt;")
-        .replace('"', "&quot;")
-        .replace("'", "&apos;")
-    )
 
-# =================================================
-# HEADER DETECTION
-# =================================================
-def is_table_header(row):
-    text = " ".join(str(v).lower() for v in row if pd.notna(v))
-    required = ["software", "system", "object", "description"]
-    return all(k in text for k in required)
+# Upload size caps (bytes). Override with env BMS_MAX_EXCEL_BYTES / BMS_MAX_SVG_BYTES; the other
+# parsing budgets (elements, depth, rows, ...) are in bms_tool.guard.
+MAX_EXCEL_BYTES = guard.LIMITS["excel_bytes"]
+MAX_SVG_BYTES = guard.LIMITS["svg_bytes"]
+# One request may carry an Excel file and a drawing, plus form fields
+app.config["MAX_CONTENT_LENGTH"] = MAX_EXCEL_BYTES + MAX_SVG_BYTES + 1024 * 1024
 
 # =================================================
-# READ TABLES
+# ARTIFACT CATALOG (tables, merge outputs, templates; see bms_tool.catalog)
 # =================================================
-def read_all_tables(df):
-    tables = []
-    current_rows = []
-    in_table = False
-    blank_count = 0
-
-    for _, row in df.iterrows():
-        is_blank = all(pd.isna(v) or str(v).strip() == "" for v in row)
-
-        if is_table_header(row):
-            if current_rows:
-                tables.append(pd.DataFrame(current_rows))
-                current_rows = []
-            in_table = True
-            blank_count = 0
+CATALOG_PATH = os.environ.get("BMS_CATALOG_PATH", "").strip() or os.path.join(UP, "catalog.sqlite3")
+_UUID_RE = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+
+
+def _backfill_catalog(cat):
+    """Register the tables, merge outputs and templates already on disk when the catalog is created."""
+    items = []
+    jobs = []
+    for entry in os.scandir(TEMP_DIR):
+        key, _dot, ext = entry.name.partition(".")
+        if ext in ("table.json", "xlsx") and _UUID_RE.match(key):
+            items.append((key, "table", key, None, entry.stat().st_size))
+        elif ext == "job.json" and key.startswith("final_output_"):
+            jobs.append((key[len("final_output_"):], key, entry.path))
+    for name in os.listdir(SVG_TEMPLATES_DIR):
+        if name.endswith(".svg"):
+            items.append((name, "template", None, None, os.path.getsize(os.path.join(SVG_TEMPLATES_DIR, name))))
+    cat.add_many(items)
+    for job_id, key, job_path in jobs:
+        try:
+            with open(job_path, encoding="utf-8") as f:
+                options = json.load(f)
+        except (OSError, ValueError):
             continue
+        has_changes = os.path.isfile(os.path.join(TEMP_DIR, key + ".changes.json"))
+        cat.add(job_id, "output", key=key, meta={"options": options, "changes": has_changes})
 
-        if not in_table:
-            continue
 
-        if is_blank:
-            blank_count += 1
-        else:
-            blank_count = 0
+catalog = Catalog(CATALOG_PATH, on_create=_backfill_catalog)
 
-        if blank_count >= 2:
-            tables.append(pd.DataFrame(current_rows))
-            current_rows = []
-            in_table = False
-            blank_count = 0
-            continue
-
-        current_rows.append(row)
 
-    if current_rows:
-        tables.append(pd.DataFrame(current_rows))
+def _session_table_ids():
+    """Tables listed for this session, from the catalog (ids of an older session cookie are moved there once)."""
+    sid = _session_id()
+    legacy = session.pop("table_ids", None)
+    if legacy:
+        # Ahead of the tables the catalog already lists for the session, not instead of them
+        listed = catalog.session_tables(sid)
+        catalog.set_session_tables(sid, [tid for tid in legacy if tid not in listed] + listed)
+    return catalog.session_tables(sid)
 
-    return tables
 
 # =================================================
-# SAFE COLUMN
+# BLOB STORE (uploads, saved templates, merge outputs by content digest; see bms_tool.blobstore)
 # =================================================
-def safe_col(df, idx):
-    if idx < df.shape[1]:
-        return df.iloc[:, idx]
-    return pd.Series([""] * len(df))
+# BMS_BLOB_STORE: local (uploads/blobs, default), local:<dir>, or s3://bucket/prefix (read through BLOB_CACHE_DIR)
+BLOB_DIR = os.path.join(UP, "blobs")
+BLOB_CACHE_DIR = os.environ.get("BMS_BLOB_CACHE_DIR", "").strip() or os.path.join(UP, "blob_cache")
+blobs = open_store(os.environ.get("BMS_BLOB_STORE", ""), BLOB_DIR, BLOB_CACHE_DIR)
+# gzip/brotli copies of merge outputs, <digest>.<encoding>: compressed once, sent to every download
+COMPRESSED_DIR = os.path.join(UP, "compressed")
+
+# Generated files: evicted after BMS_ARTIFACT_TTL_HOURS unused, or LRU when over BMS_STORAGE_QUOTA_MB.
+# Tables of sessions active within BMS_SESSION_TTL_HOURS are kept. BMS_STORAGE_SWEEPER=0 disables.
+# EXCEL_DIR and DRAWING_DIR hold uploads from before the blob store; they are only swept.
+storage = ArtifactManager(
+    roots=(TEMP_DIR, OUTPUT_DIR, EXCEL_DIR, DRAWING_DIR, COMPRESSED_DIR, *blobs.swept_dirs()),
+    quota_bytes=_env_int("BMS_STORAGE_QUOTA_MB", 1024) * 1024 * 1024,
+    ttl_seconds=_env_int("BMS_ARTIFACT_TTL_HOURS", 24) * 3600,
+    session_ttl_seconds=_env_int("BMS_SESSION_TTL_HOURS", 12) * 3600,
+    sweep_interval=_env_int("BMS_SWEEP_INTERVAL_SECONDS", 300),
+    catalog=catalog,
+    pinned=blobs.pinned_keys,
+)
+
+
+# Point groups of every saved template (SVG_TEMPLATES_DIR/.index.json), to rank templates for a table
+template_index = TemplateIndex(SVG_TEMPLATES_DIR)
+
+
+# Saved templates are "templates" refs of the blob store; SVG_TEMPLATES_DIR is this instance's copy of them
+TEMPLATE_REFS = "templates"
+_TEMPLATE_SYNC_SECONDS = _env_int("BMS_TEMPLATE_SYNC_SECONDS", 30)
+_template_sync_lock = threading.Lock()
+_template_synced_at = [None]
+
+
+def _install_template(filename, digest):
+    """Put the template blob at SVG_TEMPLATES_DIR/filename (a hard link where possible) and record it."""
+    src = blobs.local_path(digest)
+    path = os.path.join(SVG_TEMPLATES_DIR, filename)
+    tmp = "%s.%s.part" % (path, uuid.uuid4().hex)
+    try:
+        os.link(src, tmp)
+    except OSError:
+        with open(src, "rb") as f_in, open(tmp, "wb") as f_out:
+            while True:
+                chunk = f_in.read(1024 * 1024)
+                if not chunk:
+                    break
+                f_out.write(chunk)
+    os.replace(tmp, path)
+    catalog.add(filename, "template", digest=digest, size=os.path.getsize(path))
+    template_index.update(filename)
+
+
+def sync_templates(force=False):
+    """
+    Bring SVG_TEMPLATES_DIR in line with the template refs (at most every BMS_TEMPLATE_SYNC_SECONDS):
+    templates saved by another instance are fetched, templates only found here are published.
+    """
+    now = time.monotonic()
+    with _template_sync_lock:
+        last = _template_synced_at[0]
+        if not force and last is not None and now - last < _TEMPLATE_SYNC_SECONDS:
+            return
+        _template_synced_at[0] = now
+    refs = blobs.refs(TEMPLATE_REFS)
+    for name in os.listdir(SVG_TEMPLATES_DIR):
+        if not name.endswith(".svg") or name in refs:
+            continue
+        try:
+            digest = blobs.put_file(os.path.join(SVG_TEMPLATES_DIR, name))
+            blobs.set_ref(TEMPLATE_REFS, name, digest)
+        except (OSError, ValueError):
+            continue
+        refs[name] = digest
+        _install_template(name, digest)   # the local copy becomes a link to the blob
+    for name, digest in refs.items():
+        row = catalog.get(name, "template")
+        path = os.path.join(SVG_TEMPLATES_DIR, name)
+        if os.path.isfile(path) and row is not None and row["digest"] == digest:
+            continue
+        try:
+            if os.path.isfile(path) and file_digest(path) == digest:
+                catalog.add(name, "template", digest=digest, size=os.path.getsize(path))
+            else:
+                _install_template(name, digest)
+        except (OSError, ValueError):
+            continue
 
-# =================================================
-# TEXT WRAP
-# =================================================
-def wrap_text(text, max_chars):
-    words = str(text).split()
-    lines, line = [], ""
-    for w in words:
-        if len(line + w) <= max_chars:
-            line += w + " "
-        else:
-            lines.append(line.strip())
-            line = w + " "
-    if line:
-        lines.append(line.strip())
-    return lines
 
-# =================================================
-# BUILD SVG TABLE
-# =================================================
-def build_table_svg(df):
-    font_size = 10
-    line_h = 14
-    padding = 6
-    start_y = 30
-
-    col_x = [20, 110, 270, 430, 690]
-    col_w = [90, 160, 160, 260, 160]
-    wrap_limits = [8, 18, 16, 28, 14]
-
-    rows = []
-    for _, r in df.iterrows():
-        cells = [
-            wrap_text(r["POINT"], wrap_limits[0]),
-            wrap_text(r["SYSTEM"], wrap_limits[1]),
-            wrap_text(r["OBJECT"], wrap_limits[2]),
-            wrap_text(r["DESCRIPTION"], wrap_limits[3]),
-            wrap_text(r["SIGNAL"], wrap_limits[4]),
-        ]
-        max_lines = max(len(c) for c in cells)
-        rows.append((cells, max_lines * line_h + padding * 2))
-
-    height = start_y + sum(rh for _, rh in rows) + 40
-    width = max(col_x) + max(col_w) + 20
-
-    svg = [
-        f'<svg xmlns="{SVG_NS}" width="{width}" height="{height}">',
-        '<style>text{font-family:Arial;}</style>'
-    ]
-
-    headers = ["POINT", "SYSTEM", "OBJECT", "DESCRIPTION", "SIGNAL"]
-    y = start_y
-
-    for i, h in enumerate(headers):
-        svg.append(
-            f'<rect x="{col_x[i]}" y="{y}" width="{col_w[i]}" height="28" fill="#e5e7eb" stroke="black"/>'
-        )
-        svg.append(
-            f'<text x="{col_x[i]+padding}" y="{y+18}" font-size="{font_size}" font-weight="bold">{h}</text>'
-        )
+def list_svg_templates():
+    """Return list of (filename, display_name) for saved SVG templates."""
+    sync_templates()
+    return template_index.templates()
 
-    y += 28
 
-    for cells, rh in rows:
-        for i, cell in enumerate(cells):
-            svg.append(
-                f'<rect x="{col_x[i]}" y="{y}" width="{col_w[i]}" height="{rh}" fill="white" stroke="black"/>'
-            )
-            ty = y + padding + font_size
-            for line in cell:
-                svg.append(
-                    f'<text x="{col_x[i]+padding}" y="{ty}" font-size="{font_size}">{xml_escape(line)}</text>'
-                )
-                ty += line_h
-        y += rh
+def saved_template_paths():
+    """Paths of the saved SVG templates, for precompile()."""
+    return [os.path.join(SVG_TEMPLATES_DIR, name) for name, _label in list_svg_templates()]
 
-    svg.append("</svg>")
-    return "\n".join(svg)
 
-# =================================================
-# COMPACT EXCEL TABLE (merge into drawing)
-# =================================================
-def append_full_excel_table(root, df):
-    if df.empty:
-        return
-    if "viewBox" in root.attrib:
-        vb = list(map(float, root.attrib["viewBox"].split()))
-        svg_width = vb[2]
-    else:
-        svg_width = float(root.attrib.get("width", 1600))
-    row_height = 18
-    header_height = 20
-    title_height = 22
-    padding = 4
-    columns = list(df.columns)
-    col_widths = []
-    for col in columns:
-        max_len = max(
-            [len(str(col))] + [len(str(v)) for v in df[col].astype(str)]
-        )
-        width = max(70, min(max_len * 5, 160))
-        col_widths.append(width)
-    table_width = sum(col_widths)
-    table_height = title_height + header_height + (len(df) * row_height)
-    start_x = svg_width - table_width - 40
-    start_y = 50
-    table = ET.SubElement(root, f"{{{SVG_NS}}}g", {
-        "transform": f"translate({start_x},{start_y})"
-    })
-    ET.SubElement(table, f"{{{SVG_NS}}}rect", {
-        "x": "0", "y": "0", "width": str(table_width), "height": str(table_height),
-        "fill": "#fff", "stroke": "#000", "stroke-width": "1"
-    })
-    ET.SubElement(table, f"{{{SVG_NS}}}text", {
-        "x": str(table_width / 2), "y": "14", "text-anchor": "middle",
-        "font-size": "9", "font-family": "Arial", "font-weight": "bold"
-    }).text = "Excel Data"
-    ET.SubElement(table, f"{{{SVG_NS}}}rect", {
-        "x": "0", "y": str(title_height), "width": str(table_width),
-        "height": str(header_height), "fill": "#f2f2f2", "stroke": "#000"
-    })
-    x_cursor = 0
-    for i, col in enumerate(columns):
-        ET.SubElement(table, f"{{{SVG_NS}}}line", {
-            "x1": str(x_cursor), "y1": str(title_height),
-            "x2": str(x_cursor), "y2": str(table_height),
-            "stroke": "#000", "stroke-width": "0.8"
-        })
-        ET.SubElement(table, f"{{{SVG_NS}}}text", {
-            "x": str(x_cursor + padding), "y": str(title_height + 14),
-            "font-size": "8", "font-family": "Arial", "font-weight": "bold"
-        }).text = str(col)[:15]
-        x_cursor += col_widths[i]
-    for row_index, row in df.iterrows():
-        y = title_height + header_height + (row_index * row_height)
-        ET.SubElement(table, f"{{{SVG_NS}}}line", {
-            "x1": "0", "y1": str(y), "x2": str(table_width), "y2": str(y),
-            "stroke": "#000", "stroke-width": "0.5"
-        })
-        x_cursor = 0
-        for col_index, col in enumerate(columns):
-            value = str(row[col]) if pd.notna(row[col]) else ""
-            value = value[:18]
-            ET.SubElement(table, f"{{{SVG_NS}}}text", {
-                "x": str(x_cursor + padding), "y": str(y + 12),
-                "font-size": "8", "font-family": "Arial"
-            }).text = value
-            x_cursor += col_widths[col_index]
+def preload():
+    """
+    Warm-up before gunicorn forks the workers (see gunicorn.conf.py): heavy imports, the
+    template index and the compiled saved templates (embedded images already converted).
+    gc.freeze() then keeps the garbage collector from writing to these objects, so the
+    workers share their memory copy-on-write instead of each building a copy.
+    """
+    started = time.perf_counter()
+    lazy.warm_up(background=False)
+    templates = saved_template_paths()
+    compiled = precompile(templates, compact=COMPACT_OUTPUT_DEFAULT)
+    gc.collect()
+    gc.freeze()
+    return {"templates": len(templates), "compiled": compiled, "frozen_objects": gc.get_freeze_count(),
+            "seconds": round(time.perf_counter() - started, 2)}
 
 # =================================================
-# UPDATE SVG: point matching + table merge + optional column value at point
+# HEAVY WORK EXECUTOR (ASGI mode, see asgi.py)
 # =================================================
-def _point_to_value_map(df, point_column, display_column):
-    """Map normalized point id -> value from display_column for that row."""
-    if not display_column or display_column not in df.columns:
-        return {}
-    pc = point_column if point_column in df.columns else df.columns[0]
-    out = {}
-    for _, row in df.iterrows():
-        pt = str(row.get(pc, "")).strip().upper()
-        if not pt:
-            continue
-        pt_norm = _normalize_point_id(pt)
-        if not pt_norm:
-            continue
-        val = row[display_column]
-        out[pt_norm] = "" if pd.isna(val) else str(val).strip()
-    return out
+# asgi.py sets a process/thread pool here; under gunicorn sync workers or app.run it stays None.
+_HEAVY_EXECUTOR = None
 
 
-def _normalize_point_id(pid):
-    """Normalize for matching: remove spaces/dashes so BI 1, BI-1, BI1 all match."""
-    if pid is None or (isinstance(pid, float) and pd.isna(pid)):
-        return ""
-    s = str(pid).strip().upper()
-    s = re.sub(r"[\s\-]+", "", s)
-    return s
-
-
-def _point_to_left_right_map(df, point_column, left_column, right_column):
-    """Maps normalized point id -> (left_value, right_value) for matching rows."""
-    pc = point_column if point_column in df.columns else df.columns[0]
-    left_col = left_column if left_column and left_column in df.columns else None
-    right_col = right_column if right_column and right_column in df.columns else None
-    if not left_col and not right_col:
-        return {}
-    out = {}
-    for _, row in df.iterrows():
-        pt = str(row.get(pc, "")).strip().upper()
-        if not pt:
-            continue
-        pt_norm = _normalize_point_id(pt)
-        if not pt_norm:
-            continue
-        lv = "" if not left_col or pd.isna(row.get(left_col)) else str(row[left_col]).strip()
-        rv = "" if not right_col or pd.isna(row.get(right_col)) else str(row[right_col]).strip()
-        out[pt_norm] = (lv, rv)
-    return out
+def set_heavy_executor(executor):
+    """Use executor for CPU-heavy calls (read_all_tables, update_svg). None = run inline."""
+    global _HEAVY_EXECUTOR
+    _HEAVY_EXECUTOR = executor
 
 
-# Fixed IDs for left/right data placement (user-specified)
-LEFT_DATA_ID = "data-ui1"
-RIGHT_DATA_ID = "data-ui2"
-# Image (e.g. id="24Vac" or "bo1-image") visible only when point matches AND SIGNAL has 24Vac
+def run_heavy(fn, *args, **kwargs):
+    """Run fn on the heavy executor when one is configured, else inline; returns fn's result."""
+    executor = _HEAVY_EXECUTOR
+    if executor is None:
+        return fn(*args, **kwargs)
+    return executor.submit(fn, *args, **kwargs).result()
 
-
-def _row_contains_24vac(row):
-    """True if any cell in the row contains '24' and 'vac' (case-insensitive)."""
-    for v in row.values:
-        s = str(v).strip().lower() if pd.notna(v) else ""
-        if "24" in s and "vac" in s:
-            return True
-    return False
+# =================================================
+# PARSED UPLOAD CACHE (keyed by upload sha256)
+# =================================================
+def _parsed_cache_path(kind, digest, extra=""):
+    """TEMP_DIR path of the cached parse result for an upload (kind: 'tables' or 'excel')."""
+    return os.path.join(TEMP_DIR, f"parsed_{kind}_{digest}{extra}.pkl")
 
 
-def _signal_has_24vac(signal_val):
-    """True if signal value contains '24' and 'vac' (case-insensitive)."""
-    s = (str(signal_val or "").strip()).lower()
-    return "24" in s and "vac" in s
+def _load_parsed(path):
+    """Return the cached parse result at path, or None when missing or unreadable."""
+    pd = pandas()
+    if not os.path.isfile(path):
+        return None
+    try:
+        return pd.read_pickle(path)
+    except Exception:
+        return None
 
 
-def _normalize_signal_for_match(s):
-    """Normalize signal string for matching with image id: lower, strip, remove spaces."""
-    if s is None or (isinstance(s, float) and pd.isna(s)):
-        return ""
-    return str(s).strip().lower().replace(" ", "")
+def _store_parsed(path, obj):
+    pd = pandas()
+    tmp = f"{path}.{uuid.uuid4().hex}.part"
+    try:
+        pd.to_pickle(obj, tmp)
+        os.replace(tmp, path)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
 
 
-def _signal_matches_image_id(signal_val, image_id):
-    """True when signal value matches the image id (e.g. '24Vac' matches '24Vac' or '24 VAC'); '0-10V' does not."""
-    sig = _normalize_signal_for_match(signal_val)
-    img = _normalize_signal_for_match(image_id)
-    if not sig or not img:
-        return False
-    if sig == img or img in sig or sig in img:
-        return True
-    # Image id "24Vac": show when signal contains 24 and vac
-    if "24" in img and "vac" in img and "24" in sig and "vac" in sig:
-        return True
-    # Image id like "bo1-image" or "bo2-image": treat as 24Vac symbol, show when signal has 24Vac
-    if img.endswith("image") and "24" in sig and "vac" in sig:
-        return True
-    return False
-
-
-def _get_signal_column(df):
-    """Return SIGNAL column name if present (case-insensitive)."""
-    for col in df.columns:
-        if str(col).strip().upper() == "SIGNAL":
-            return col
-    return None
-
-
-def _point_to_signal_map(df, point_column):
-    """Maps normalized point id -> SIGNAL column value (string). Only when SIGNAL column exists."""
-    pc = point_column if point_column in df.columns else df.columns[0]
-    signal_col = _get_signal_column(df)
-    if signal_col is None:
-        return {}
-    out = {}
-    for _, row in df.iterrows():
-        pt = str(row.get(pc, "")).strip()
-        if not pt:
-            continue
-        pt_norm = _normalize_point_id(pt)
-        if not pt_norm:
-            continue
-        out[pt_norm] = row.get(signal_col)
-    return out
+def _read_uploaded_excel(upload):
+    """DataFrame for an uploaded table workbook; identical re-uploads are served from the parse cache."""
+    cache_path = _parsed_cache_path("excel", upload.digest)
+    df = _load_parsed(cache_path)
+    if df is None:
+        df = guard.read_excel(upload.open(), name=upload.filename)
+        _store_parsed(cache_path, df)
+    return df
 
 
-def _point_has_24vac_map(df, point_column):
-    """Maps normalized point id -> True if that row contains '24 VAC' in any column."""
-    pc = point_column if point_column in df.columns else df.columns[0]
-    out = {}
-    for _, row in df.iterrows():
-        pt = str(row.get(pc, "")).strip()
-        if not pt:
-            continue
-        pt_norm = _normalize_point_id(pt)
-        if not pt_norm:
-            continue
-        if _row_contains_24vac(row):
-            out[pt_norm] = True
-    return out
+# =================================================
+# STORED TABLES (TEMP_DIR/<id>.table.json, .xlsx, .svg)
+# =================================================
+def _table_model_path(table_id):
+    return os.path.join(TEMP_DIR, f"{table_id}.table.json")
 
 
-def _find_by_id(container, id_val):
-    """Return first element under container (self or descendant) with id attribute == id_val."""
-    id_val = (id_val or "").strip()
-    if not id_val:
+def _load_table(table_id):
+    """
+    DataFrame of a stored table, or None if the catalog does not know it (or its files are
+    gone). Reads the JSON table model when there is one (no openpyxl), else the generated .xlsx.
+    """
+    if catalog.get(table_id, "table") is None:
         return None
-    for el in container.iter():
-        if (el.get("id") or "").strip() == id_val:
-            return el
-    return None
-
-
-def _get_label_text_elements(g):
-    """Return list of text elements in g that are labels (not - or +), sorted by x position (left to right)."""
-    candidates = []
-    for text_el in g.findall(".//{%s}text" % SVG_NS):
-        cur = (text_el.text or "").strip()
-        if cur in ("-", "+"):
-            continue
-        x = float(text_el.get("x", 0))
-        candidates.append((x, text_el))
-    candidates.sort(key=lambda x: x[0])
-    return [t for _, t in candidates]
+    model_path = _table_model_path(table_id)
+    try:
+        df = read_table_model(model_path)
+    except FileNotFoundError:
+        # Tables stored before the JSON model existed
+        excel_path = os.path.join(TEMP_DIR, f"{table_id}.xlsx")
+        try:
+            df = pandas().read_excel(excel_path)
+        except FileNotFoundError:
+            return None
+        storage.touch(excel_path)
+        return df
+    storage.touch(model_path)
+    return df
 
 
-def _get_point_name_and_left_right_slots(g):
+def _save_table(table_id, df, prefetch=True):
     """
-    Point name = text with text-anchor="middle" (inside the box) – never touch.
-    Left slots = non–point-name texts with x < point_name_x (1). Right slots = x > point_name_x (1).
-    Returns (point_name_el or None, left_slots_list, right_slots_list).
+    Store a table: its JSON model only. The preview SVG and the .xlsx are built from the model
+    when first asked for (_table_svg, _table_excel); files built from an older model are removed.
+    prefetch: start building the preview in the background now (see _prefetch_preview).
     """
-    texts = _get_label_text_elements(g)
-    if not texts:
-        return None, [], []
-    middle = None
-    others = []
-    for t in texts:
-        if (t.get("text-anchor") or "").lower() == "middle":
-            middle = t
-        else:
-            others.append(t)
-    if not others:
-        return middle, [], []
-    others_sorted = sorted(others, key=lambda t: float(t.get("x", 0)))
-    mid_x = float(middle.get("x", 0)) if middle is not None else None
-    if mid_x is not None:
-        left_slots = [t for t in others_sorted if float(t.get("x", 0)) < mid_x][:1]
-        right_slots = [t for t in others_sorted if float(t.get("x", 0)) > mid_x][:1]
-    else:
-        n = len(others_sorted)
-        left_slots = others_sorted[:1]
-        right_slots = others_sorted[-1:] if n > 1 and others_sorted[-1] is not others_sorted[0] else []
-    return middle, left_slots, right_slots
-
-
-def _set_point_label_left_right(g, left_value, right_value):
-    """Set left value in id=data-ui1, right value in id=data-ui2. Fallback to position-based slots if IDs not found."""
-    left_val = (left_value or "").strip()
-    right_val = (right_value or "").strip()
-    left_el = _find_by_id(g, LEFT_DATA_ID)
-    right_el = _find_by_id(g, RIGHT_DATA_ID)
-    if left_el is not None:
-        left_el.text = left_val
-    if right_el is not None:
-        right_el.text = right_val
-    if left_el is not None and right_el is not None:
-        return
-    _point_name_el, left_slots, right_slots = _get_point_name_and_left_right_slots(g)
-    for el in left_slots:
-        el.text = left_val
-    for el in right_slots:
-        el.text = right_val
-    if not left_slots and not right_slots:
-        pass
-    elif not left_slots and right_slots:
-        if left_val and right_val:
-            right_slots[0].text = (left_val + "  " + right_val).strip()
-        elif left_val:
-            right_slots[0].text = left_val
-    elif left_slots and not right_slots:
-        if left_val and right_val:
-            left_slots[0].text = (left_val + "  " + right_val).strip()
-        elif right_val:
-            left_slots[0].text = right_val
-
-
-def _set_point_label_spare(g):
-    """If point name does not match Excel: find id=data-ui1 and id=data-ui2 in this <g>, replace their text with SPARE."""
-    spare = "SPARE"
-    for el in g.iter():
-        eid = (el.get("id") or "").strip()
-        if eid != LEFT_DATA_ID and eid != RIGHT_DATA_ID:
-            continue
-        el.text = spare
-        for child in list(el):
-            el.remove(child)
-
-
-def update_svg(svg_path, df, output_svg, point_column="POINT", display_column=None,
-               left_column=None, right_column=None):
-    tree = ET.parse(svg_path)
-    root = tree.getroot()
-    # Match point ID with Excel (normalized: BI 1, BI-1, BI1 all match)
-    pc = point_column if point_column in df.columns else df.columns[0]
-    excel_point_ids = set(_normalize_point_id(v) for v in df[pc].dropna().astype(str))
-    excel_point_ids.discard("")
-    point_to_lr = _point_to_left_right_map(df, point_column, left_column, right_column)
-    point_to_value = _point_to_value_map(df, point_column, display_column) if display_column else {}
-    # Image visible only when: point name matches AND row SIGNAL value matches the image id (e.g. "24Vac")
-    point_to_signal = _point_to_signal_map(df, pc)
-    point_pattern = re.compile(r"^(UI|AI|DI|AO|DO|BO|BI|NODE)[\w\-]+$", re.IGNORECASE)
-
-    def _group_has_data_ui(grp):
-        return any(
-            (el.get("id") or "").strip() in (LEFT_DATA_ID, RIGHT_DATA_ID)
-            for el in grp.iter()
-        )
-
-    # 1) Every <g> with id that has data-ui1/data-ui2: match id with Excel point → print column data; else replace with SPARE
-    for g in root.iter():
-        tag = g.tag if hasattr(g.tag, "endswith") else str(g.tag)
-        if tag != "g" and not tag.endswith("}g"):
-            continue
-        gid = g.get("id")
-        if not gid:
-            continue
-        if not _group_has_data_ui(g):
-            continue
-        # Only process leaf point groups (no nested <g> with id that also has data-ui1/data-ui2)
-        has_nested = False
-        for child in g:
-            ctag = child.tag if hasattr(child.tag, "endswith") else str(child.tag)
-            if (ctag == "g" or ctag.endswith("}g")) and child.get("id") and _group_has_data_ui(child):
-                has_nested = True
-                break
-        if has_nested:
-            continue
-        gid_clean = (gid or "").strip().upper()
-        gid_norm = _normalize_point_id(gid_clean)
-        if gid_norm in excel_point_ids:
-            if gid_norm in point_to_lr:
-                left_val, right_val = point_to_lr[gid_norm]
-                _set_point_label_left_right(g, left_val, right_val)
-            elif gid_norm in point_to_value:
-                _set_point_label_left_right(g, point_to_value[gid_norm], "")
-            else:
-                _set_point_label_left_right(g, "", "")
-        else:
-            _set_point_label_spare(g)
+    model_path = write_table_model(df, _table_model_path(table_id))
+    with open(model_path, "rb") as f:
+        model = f.read()
+    # The digest versions the preview (see _preview_version). Recorded before the old files
+    # are removed, so a file built from the old model meanwhile is never kept (see _table_file).
+    catalog.add(table_id, "table", key=table_id, digest=hashlib.sha1(model).hexdigest()[:16],
+                size=len(model), rows=len(df))
+    for path in [os.path.join(TEMP_DIR, table_id + ext) for ext in (".svg", ".grid.svg", ".xlsx", ".thumb.png")] + \
+            glob.glob(os.path.join(TEMP_DIR, table_id + ".*.thumb.png")):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    if prefetch:
+        _prefetch_preview(table_id)
+    return model_path
 
-    # 2) Image visibility (24Vac): only for groups matching point pattern
-    for g in root.findall(".//{%s}g" % SVG_NS):
-        gid = g.get("id")
-        if not gid:
-            continue
-        gid_clean = (gid or "").strip().upper()
-        gid_norm = _normalize_point_id(gid_clean)
-        if not point_pattern.match(gid_clean):
-            continue
-        point_signal = point_to_signal.get(gid_norm) if gid_norm in excel_point_ids else None
-        for img_el in g.iter():
-            tag = img_el.tag if hasattr(img_el.tag, "endswith") else str(img_el.tag)
-            if tag != "image" and not tag.endswith("}image"):
-                continue
-            image_id = (img_el.get("id") or "").strip()
-            show_image = (
-                gid_norm in excel_point_ids
-                and _signal_matches_image_id(point_signal, image_id)
-            )
-            img_el.set("visibility", "visible" if show_image else "hidden")
-    if "viewBox" in root.attrib:
-        vb = list(map(float, root.attrib["viewBox"].split()))
-        width, height = vb[2], vb[3]
-    else:
-        width = float(root.attrib.get("width", 1600))
-        height = float(root.attrib.get("height", 1000))
-    new_width = width + 350
-    new_height = height + 120
-    root.set("viewBox", f"0 0 {new_width} {new_height}")
-    root.set("width", str(new_width))
-    root.set("height", str(new_height))
-    drawing_group = ET.Element(f"{{{SVG_NS}}}g", {
-        "transform": "translate(40,120) scale(0.7)"
-    })
-    for child in list(root):
-        drawing_group.append(child)
-    root.clear()
-    root.append(drawing_group)
-    append_full_excel_table(root, df)
-    tree.write(output_svg, encoding="utf-8", xml_declaration=True)
-    convert_to_visio_svg(output_svg, output_svg)
 
-# =================================================
-# CONVERT SVG TO VISIO-COMPATIBLE FORMAT
-# =================================================
-def _data_uri_svg_xml_to_png(data_uri):
-    """Convert data:image/svg+xml;base64,... to data:image/png;base64,... so Visio can show it."""
-    if not HAS_CAIROSVG:
-        return None
-    s = data_uri.strip()
-    if not s.lower().startswith("data:image/svg+xml;base64,"):
-        return None
-    try:
-        b64 = s.split(",", 1)[1]
-        b64_clean = "".join(b64.split())
-        svg_bytes = base64.b64decode(b64_clean)
-    except Exception:
-        return None
-    try:
-        png_bytes = cairosvg.svg2png(bytestring=svg_bytes)
-        new_b64 = base64.b64encode(png_bytes).decode("ascii")
-        return "data:image/png;base64," + new_b64
-    except Exception:
-        return None
+# Built files of a table: one build at a time per file in this process (striped locks)
+_BUILD_LOCKS = [threading.Lock() for _ in range(32)]
 
 
-def _parse_svg_css(style_text):
-    """Parse CSS from <style> content: return dict class_name -> rule string."""
-    if not style_text or not style_text.strip():
-        return {}
-    out = {}
-    for m in re.finditer(r"\.([\w-]+)\s*\{([^{}]*)\}", style_text, re.DOTALL):
-        name, body = m.group(1), m.group(2)
-        out[name.strip()] = " ".join(body.split()).strip()
-    return out
+def _build_table_svg(df, path):
+    with open(path, "wb") as f:
+        f.write(build_table_svg(df, grid=TABLE_GRID_DEFAULT).encode("utf-8"))
 
 
-def _inline_css_on_elements(root, css_map):
-    """Set style attribute on each element that has class= so Visio shows same as browser."""
-    if not css_map:
-        return
-    for el in root.iter():
-        cls = el.get("class")
-        if not cls:
-            continue
-        parts = [p.strip() for p in str(cls).split() if p.strip()]
-        rules = [css_map[p] for p in parts if p in css_map]
-        if not rules:
-            continue
-        combined = "; ".join(r for r in rules if r)
-        existing = (el.get("style") or "").strip()
-        if existing:
-            el.set("style", existing.rstrip(";") + "; " + combined)
-        else:
-            el.set("style", combined)
+def _build_table_excel(df, path):
+    # Through a file object: pandas refuses a path that does not end in .xlsx (the temp name)
+    with open(path, "wb") as f:
+        df.to_excel(f, index=False, engine="openpyxl")
 
 
-def convert_to_visio_svg(input_path, output_path):
+def _table_file(table_id, ext, build):
     """
-    Make SVG valid for Microsoft Visio: same drawing as browser, editable.
-    Inline CSS onto elements so Visio shows styles; keep xlink, defs, images.
+    Path of TEMP_DIR/<table_id><ext>, built from the table by build(df, path) on first use and
+    kept; None for an unknown table.
     """
-    tree = ET.parse(input_path)
-    root = tree.getroot()
-
-    root.set("xmlns", SVG_NS)
-    root.set("version", "1.1")
-
-    # Visio expects width/height with units (px) when present
-    w = root.get("width")
-    h = root.get("height")
-    if w and re.match(r"^\d*\.?\d+$", str(w).strip()):
-        root.set("width", str(w).strip() + "px")
-    if h and re.match(r"^\d*\.?\d+$", str(h).strip()):
-        root.set("height", str(h).strip() + "px")
-
-    # viewBox: keep as-is but ensure clean format (no scientific notation)
-    vb = root.get("viewBox")
-    if vb:
-        parts = vb.replace(",", " ").split()
-        if len(parts) == 4:
-            try:
-                nums = [float(x) for x in parts]
-                root.set("viewBox", " ".join(str(int(x) if x == int(x) else x) for x in nums))
-            except (ValueError, TypeError):
-                pass
-
-    for el in root.iter():
-        if el.get("visibility") == "hidden":
-            el.set("display", "none")
-            del el.attrib["visibility"]
+    path = os.path.join(TEMP_DIR, table_id + ext)
+    if os.path.isfile(path):
+        return path
+    with _BUILD_LOCKS[hash((table_id, ext)) % len(_BUILD_LOCKS)]:
+        if os.path.isfile(path):
+            return path
+        version = _preview_version(table_id)
+        df = _load_table(table_id) if version else None
+        if df is None:
+            return None
+        tmp = f"{path}.{uuid.uuid4().hex}.part"
+        try:
+            build(df, tmp)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        if _preview_version(table_id) == version:
+            return path
+        # Edited while building: drop the file (it may show the old rows) and build again
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    return _table_file(table_id, ext, build)
 
-    # Inline CSS so Visio shows same styles as browser (Visio often ignores <style> block)
-    for style_el in root.iter():
-        tag = style_el.tag.split("}")[-1] if "}" in style_el.tag else style_el.tag
-        if tag != "style":
-            continue
-        raw = style_el.text or ""
-        for child in style_el:
-            if child.text:
-                raw += child.text
-            if child.tail:
-                raw += child.tail
-        css_map = _parse_svg_css(raw)
-        if css_map:
-            _inline_css_on_elements(root, css_map)
-        break
-
-    # Ensure path/line (wires) have stroke so they print properly
-    for el in root.iter():
-        tag = el.tag.split("}")[-1] if "}" in el.tag else el.tag
-        if tag not in ("path", "line"):
-            continue
-        if el.get("style") or el.get("class"):
-            continue
-        el.set("style", "stroke:#000000;stroke-width:1;fill:none")
-
-    # Remove only unknown namespace attributes (keep w3.org, xlink, Visio)
-    for el in root.iter():
-        to_drop = [
-            k for k in el.attrib
-            if k.startswith("{")
-            and "w3.org" not in k
-            and "schemas.microsoft.com" not in k
-        ]
-        for k in to_drop:
-            del el.attrib[k]
-
-    # Declare xlink and Visio on root so styles and drawing stay correct in Visio
-    has_xlink = any(
-        k.startswith("{") and "1999/xlink" in k
-        for el in root.iter() for k in el.attrib
-    )
-    if has_xlink:
-        root.set("xmlns:xlink", XLINK_NS)
-    has_visio = any(
-        getattr(el, "tag", "").startswith("{") and "schemas.microsoft.com" in getattr(el, "tag", "")
-        for el in root.iter()
-    ) or any(
-        k.startswith("{") and "schemas.microsoft.com" in k
-        for el in root.iter() for k in el.attrib
-    )
-    if has_visio:
-        root.set("xmlns:v", VISIO_NS)
 
-    # For <image>: normalize data URI; convert image/svg+xml to PNG so Visio can show it
-    for el in root.iter():
-        tag = el.tag.split("}")[-1] if "}" in el.tag else el.tag
-        if tag != "image":
-            continue
-        href_key = None
-        for k in el.attrib:
-            if k.startswith("{") and "1999/xlink" in k and "href" in k:
-                href_key = k
-                break
-        if href_key is None:
-            continue
-        val = el.attrib[href_key]
-        if not isinstance(val, str) or not val.strip().lower().startswith("data:"):
-            continue
-        val = "".join(val.split())
-        if val.lower().startswith("data:image/svg+xml;base64,"):
-            png_uri = _data_uri_svg_xml_to_png(val)
-            if png_uri is not None:
-                val = png_uri
-        el.set("href", val)
-        el.attrib[href_key] = val
-
-    # Write with default namespace so output is clean SVG (no ns0: prefix)
-    with open(output_path, "wb") as f:
-        f.write(b'<?xml version="1.0" encoding="UTF-8"?>\n')
-        _serialize_visio_svg(root, f, is_root=True)
-
-
-def _escape_text(s):
-    if not s:
-        return ""
-    return s.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace('"', "&quot;")
+def _table_svg(table_id):
+    """Path of the table's preview SVG (built on first use), or None for an unknown table."""
+    # One file per grid mode, so a changed BMS_TABLE_GRID never serves a table drawn the other way
+    return _table_file(table_id, ".grid.svg" if TABLE_GRID_DEFAULT else ".svg", _build_table_svg)
 
 
-def _attr_value_for_serialize(k, v):
-    """Escape attribute value; collapse whitespace in data: URIs so base64 images work in Visio."""
-    s = str(v)
-    if s.strip().lower().startswith("data:"):
-        s = "".join(s.split())
-    return _escape_text(s)
+def _table_excel(table_id):
+    """Path of the table's .xlsx (built on first download), or None for an unknown table."""
+    return _table_file(table_id, ".xlsx", _build_table_excel)
 
 
-def _serialize_visio_svg(el, f, indent=0, is_root=False):
-    """Write one element and children; preserve SVG, xlink, and Visio (v:) so styles and images work."""
-    space = "  " * indent
-    if "}" in el.tag:
-        ns_uri, local = el.tag[1:].split("}", 1)
-        tag = f"v:{local}" if "schemas.microsoft.com" in ns_uri else local
-    else:
-        tag = el.tag
-    attrs = []
-    for k, v in el.attrib.items():
-        val_esc = _attr_value_for_serialize(k, v)
-        if k.startswith("{"):
-            ns_uri = k[1:].split("}", 1)[0]
-            local = k.split("}")[-1]
-            if "1999/xlink" in ns_uri:
-                attrs.append(f' xlink:{local}="{val_esc}"')
-            elif "schemas.microsoft.com" in ns_uri:
-                attrs.append(f' v:{local}="{val_esc}"')
-            elif "w3.org" in ns_uri and "XML" in ns_uri:
-                attrs.append(f' xml:{local}="{val_esc}"')
-            continue
-        if is_root and tag == "svg" and k in ("xmlns", "version"):
-            continue
-        attrs.append(f' {k}="{val_esc}"')
-    if is_root and tag == "svg":
-        attrs.insert(0, f' xmlns="{SVG_NS}"')
-        attrs.append(' version="1.1"')
-        # xmlns:xlink and xmlns:v are already on root.attrib from convert_to_visio_svg
-    attr_str = "".join(attrs)
-    has_children = len(el) > 0
-    text = (el.text or "").strip()
-    # Style/script: output content as CDATA so CSS and special chars are preserved for Visio
-    is_style_or_script = tag in ("style", "script")
-    if not has_children and not text and not is_style_or_script:
-        f.write((space + f"<{tag}{attr_str}/>\n").encode("utf-8"))
-        return
-    f.write((space + f"<{tag}{attr_str}>").encode("utf-8"))
-    if is_style_or_script and (text or (has_children and el.text)):
-        content = el.text or ""
-        for c in el:
-            if c.text:
-                content += c.text
-            if c.tail:
-                content += c.tail
-        if content.strip():
-            f.write(b"\n<![CDATA[\n")
-            f.write(content.encode("utf-8"))
-            f.write(b"\n]]>\n")
-        f.write((space + f"</{tag}>\n").encode("utf-8"))
-        return
-    if text and not has_children:
-        f.write(_escape_text(el.text).encode("utf-8"))
-        f.write((f"</{tag}>\n").encode("utf-8"))
-        return
-    if text:
-        f.write(("\n" + "  " * (indent + 1) + _escape_text(el.text)).encode("utf-8"))
-    f.write(b"\n")
-    for i, child in enumerate(el):
-        _serialize_visio_svg(child, f, indent + 1, is_root=False)
-        if child.tail and child.tail.strip():
-            f.write(("  " * (indent + 1) + _escape_text(child.tail.strip()) + "\n").encode("utf-8"))
-    f.write((space + f"</{tag}>\n").encode("utf-8"))
 @app.after_request
 def _no_cache_html(response):
     """Avoid cached pages on other PC so the app always loads fresh (no reload loop)."""
@@ -870,12 +404,167 @@ def _no_cache_html(response):
     return response
 
 
+@app.after_request
+def _compress_svg(response):
+    """gzip/brotli for SVG responses (previews, merged drawings) when the client accepts it."""
+    if (response.status_code != 200 or response.mimetype != "image/svg+xml"
+            or "Content-Encoding" in response.headers):
+        return response
+    encoding = output_size.choose_encoding(request.headers.get("Accept-Encoding"))
+    if encoding is None:
+        return response
+    if response.content_length is not None and response.content_length > output_size.MAX_COMPRESS_BYTES:
+        return response
+    response.direct_passthrough = False
+    data = response.get_data()
+    if len(data) < output_size.MIN_COMPRESS_BYTES:
+        return response
+    packed = output_size.compress(data, encoding)
+    if len(packed) >= len(data):
+        return response
+    response.set_data(packed)
+    response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        # Same content, different bytes on the wire
+        response.set_etag(etag, weak=True)
+    response.headers["X-BMS-Compression-Saved-Bytes"] = str(len(data) - len(packed))
+    output_size.record_compression(len(data), len(packed))
+    return response
+
+
+@app.before_request
+def _start_storage_sweeper():
+    """Start the artifact sweeper on the first request (not at import, so helper processes never run it)."""
+    if os.environ.get("BMS_STORAGE_SWEEPER", "1").strip().lower() not in ("0", "false", "no"):
+        storage.start()
+
+
+@app.before_request
+def _warm_up_heavy_imports():
+    """First real request: import pandas/openpyxl/cairosvg in the background. /health stays instant."""
+    if request.endpoint not in ("health", "favicon"):
+        lazy.warm_up()
+
+
+def _session_id():
+    """Stable id for this browser session (used to pin its tables against eviction)."""
+    sid = session.get("sid")
+    if not sid:
+        sid = session["sid"] = str(uuid.uuid4())
+    return sid
+
+
+@app.errorhandler(413)
+def _request_too_large(e):
+    """Whole request over MAX_CONTENT_LENGTH (rejected before the upload is read)."""
+    limit_mb = (app.config.get("MAX_CONTENT_LENGTH") or 0) // (1024 * 1024)
+    return "Upload too large (limit %s MB per request)." % limit_mb, 413
+
+
+@app.errorhandler(ParseLimitExceeded)
+def _parse_limit_exceeded(e):
+    """Drawing or workbook over a parsing budget (bms_tool.guard)."""
+    return str(e), 413
+
+
 @app.route("/health")
 def health():
     """Health check for hosting platforms (Render, Railway, etc.). Returns 200 when app is up."""
     return "ok", 200
 
 
+@app.route("/storage-stats")
+def storage_stats():
+    """Disk usage of generated files, quota, live sessions, eviction totals and catalog counts (JSON)."""
+    stats = storage.stats()
+    stats["catalog"] = catalog.stats()
+    stats["blobs"] = blobs.stats()
+    return jsonify(stats)
+
+
+@app.route("/output-stats")
+def output_stats():
+    """Bytes saved by compact output and by response compression since this worker started (JSON)."""
+    return jsonify(output_size.stats())
+
+
+@app.route("/parse-stats")
+def parse_stats():
+    """Parsing budgets, and the parses, refusals and largest inputs of this worker (JSON)."""
+    return jsonify(guard.stats())
+
+
+# =================================================
+# PROFILING – opt-in cProfile + tracemalloc for slow requests
+# =================================================
+# BMS_PROFILING=1: profile requests sent with ?profile=<token> or header X-BMS-Profile: <token>;
+# BMS_PROFILING=all: every profiled route. Off unless BMS_PROFILE_TOKEN is set (the token
+# also guards /profiles).
+PROFILE_DIR = os.path.join(UP, "profiles")
+PROFILING = os.environ.get("BMS_PROFILING", "").strip().lower()
+PROFILE_TOKEN = os.environ.get("BMS_PROFILE_TOKEN", "").strip()
+PROFILING_ENABLED = PROFILING not in ("", "0", "false", "no") and bool(PROFILE_TOKEN)
+if PROFILING not in ("", "0", "false", "no") and not PROFILE_TOKEN:
+    app.logger.warning("BMS_PROFILING is ignored: set BMS_PROFILE_TOKEN to a secret to enable profiling")
+profiles = ProfileStore(PROFILE_DIR, keep=_env_int("BMS_PROFILE_KEEP", 50))
+
+
+def _profile_token_ok():
+    flag = request.headers.get("X-BMS-Profile") or request.args.get("profile") or ""
+    if not flag or not PROFILE_TOKEN:
+        return False
+    return hmac.compare_digest(flag, PROFILE_TOKEN)
+
+
+def profiled(view):
+    """Wrap a view in a profile capture when profiling is on and asked for; adds X-BMS-Profile-Id."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not PROFILING_ENABLED or (PROFILING != "all" and not _profile_token_ok()):
+            return view(*args, **kwargs)
+        with profiles.capture(request.endpoint, method=request.method, path=request.path) as record:
+            response = app.make_response(view(*args, **kwargs))
+        if record["id"]:
+            response.headers["X-BMS-Profile-Id"] = record["id"]
+        return response
+    return wrapper
+
+
+def _profiles_allowed():
+    # Listing needs the token too
+    return PROFILING_ENABLED and _profile_token_ok()
+
+
+@app.route("/profiles")
+def list_profiles():
+    """Captured profiles, newest first, with download links (JSON)."""
+    if not _profiles_allowed():
+        return "Profiling is not enabled.", 404
+    out = []
+    for record in profiles.list():
+        record["prof_url"] = url_for("profile_file", profile_id=record["id"], kind="prof")
+        record["speedscope_url"] = url_for("profile_file", profile_id=record["id"], kind="speedscope")
+        out.append(record)
+    return jsonify({"profiles": out})
+
+
+@app.route("/profiles/<profile_id>/<kind>")
+def profile_file(profile_id, kind):
+    """A capture's .prof (pstats) or speedscope JSON."""
+    if not _profiles_allowed():
+        return "Profiling is not enabled.", 404
+    if kind not in ("prof", "speedscope"):
+        return "Unknown profile file.", 404
+    path = profiles.path(profile_id, kind)
+    if path is None or not os.path.isfile(path):
+        return "Profile not found.", 404
+    name = os.path.basename(path)
+    mimetype = "application/json" if kind == "speedscope" else "application/octet-stream"
+    return send_file(path, mimetype=mimetype, as_attachment=True, download_name=name)
+
+
 @app.route("/favicon.ico")
 def favicon():
     """Avoid 404 when browser requests favicon."""
@@ -889,6 +578,7 @@ def step1_redirect():
 
 
 @app.route("/", methods=["GET", "POST"])
+@profiled
 def step1():
     if request.method == "POST":
         excel = request.files.get("excel")
@@ -898,84 +588,212 @@ def step1():
             sheet = int(request.form.get("sheet", 0))
         except (ValueError, TypeError):
             sheet = 0
-        path = os.path.join(EXCEL_DIR, excel.filename)
         try:
-            excel.save(path)
-            raw = pd.read_excel(path, sheet_name=sheet, header=None)
-        except Exception:
-            return redirect(url_for("step1") + "?error=excel"), 302
-        tables = read_all_tables(raw)
+            upload = receive_upload(excel, MAX_EXCEL_BYTES)
+        except UploadTooLarge:
+            return redirect(url_for("step1") + "?error=toolarge"), 302
+        with upload:
+            # Same workbook + sheet uploaded before: reuse the parsed tables, skip read_excel
+            cache_path = _parsed_cache_path("tables", upload.digest, f"_{sheet}")
+            tables = _load_parsed(cache_path)
+            if tables is None:
+                blobs.put_upload(upload)
+                try:
+                    raw = guard.read_excel(upload.open(), name=excel.filename, sheet_name=sheet, header=None)
+                except ParseLimitExceeded as e:
+                    return redirect(url_for("step1", error="limits", detail=str(e))), 302
+                except Exception:
+                    return redirect(url_for("step1") + "?error=excel"), 302
+                tables = run_heavy(read_all_tables, raw)
+                _store_parsed(cache_path, tables)
         table_ids = []
 
         for tdf in tables:
-            prefix = safe_col(tdf, 0).astype(str).str.strip()
-            numbers = pd.to_numeric(safe_col(tdf, 1), errors="coerce")
-
-            clean_numbers = numbers.apply(
-                lambda x: str(int(x)) if pd.notna(x) and float(x).is_integer()
-                else (str(x) if pd.notna(x) else "")
-            )
-
-            point_col = prefix + clean_numbers
-
-            df = pd.DataFrame({
-                "POINT": point_col,
-                "SYSTEM": safe_col(tdf, 2).astype(str),
-                "OBJECT": safe_col(tdf, 3).astype(str),
-                "DESCRIPTION": safe_col(tdf, 4).astype(str),
-                "SIGNAL": safe_col(tdf, 5).astype(str),
-            }).fillna("").replace("nan", "")
+            df = normalize_table(tdf)
 
             tid = str(uuid.uuid4())
 
-            # Save SVG
-            svg = build_table_svg(df)
-            svg_path = os.path.join(TEMP_DIR, f"{tid}.svg")
-            with open(svg_path, "w", encoding="utf-8") as f:
-                f.write(svg)
-
-            # Save Excel
-            excel_out = os.path.join(TEMP_DIR, f"{tid}.xlsx")
-            df.to_excel(excel_out, index=False)
-
+            # Only the model: the preview and the .xlsx are built when first asked for
+            _save_table(tid, df, prefetch=False)
             table_ids.append(tid)
 
-        session["table_ids"] = table_ids
-        return render_template("step1.html", table_ids=table_ids, preview_refresh="")
+        # A new workbook replaces the session's tables, those of an older session cookie too
+        session.pop("table_ids", None)
+        catalog.set_session_tables(_session_id(), table_ids)
+        # Queued once every model is stored, so building previews does not slow this response
+        for tid in table_ids:
+            _prefetch_preview(tid)
+        return _render_step1(table_ids)
 
-    preview_refresh = request.args.get("refresh")
     upload_error = request.args.get("error")
-    table_ids = session.get("table_ids") or []
-    return render_template("step1.html", table_ids=table_ids, preview_refresh=preview_refresh, upload_error=upload_error)
+    table_ids = _session_table_ids()
+    if table_ids:
+        storage.touch_session(_session_id(), table_ids)
+    return _render_step1(table_ids, upload_error=upload_error, error_detail=request.args.get("detail"))
+
+
+def _render_step1(table_ids, upload_error=None, error_detail=None):
+    previews = {tid: _preview_version(tid) for tid in table_ids}
+    return render_template("step1.html", table_ids=table_ids, previews=previews,
+                           thumbnails=_thumbnails_enabled(), upload_error=upload_error, error_detail=error_detail)
 
 # =================================================
-# PREVIEW SVG
+# PREVIEW SVG (content-versioned URLs + background thumbnails)
 # =================================================
+# /preview/<pid>?v=<version> is immutable: the version is the table's model digest plus the
+# render options (grid mode), so an edited table or a changed BMS_TABLE_GRID gets a new URL.
+# Without ?v= (or with an old one) the browser revalidates by ETag.
+PREVIEW_MAX_AGE = 365 * 24 * 3600
+THUMBNAIL_WIDTH = _env_int("BMS_THUMBNAIL_WIDTH", 480)
+# Opt-in: step 1 shows a small PNG per table instead of the scrollable full preview (needs cairosvg)
+THUMBNAILS_WANTED = os.environ.get("BMS_PREVIEW_THUMBNAILS", "").strip().lower() in ("1", "true", "yes")
+# Step 1 stores only table models; the previews are built in the background (BMS_PREFETCH_PREVIEWS=0: on request only)
+PREFETCH_PREVIEWS = os.environ.get("BMS_PREFETCH_PREVIEWS", "1").strip().lower() not in ("0", "false", "no")
+_THUMBNAIL_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bms-thumbnail")
+_preview_versions = {}  # svg path -> (mtime_ns, size, version)
+_preview_versions_lock = threading.Lock()
+
+
+def _preview_version(pid):
+    """Version of the table's preview: its content hash and grid mode; "" for an unknown table."""
+    version = _table_digest(pid)
+    return version + "-grid" if version and TABLE_GRID_DEFAULT else version
+
+
+def _table_digest(pid):
+    """Short content hash of the table (the catalog digest); "" for an unknown table."""
+    row = catalog.get(pid, "table")
+    if row is None:
+        return ""
+    if row["digest"]:
+        return row["digest"]
+    # Tables registered from disk (catalog backfill): hash the model, or the SVG of tables stored
+    # before there were models, memoized by mtime/size
+    path = _table_model_path(pid)
+    if not os.path.isfile(path):
+        path = os.path.join(TEMP_DIR, f"{pid}.svg")
+    try:
+        st = os.stat(path)
+    except OSError:
+        return ""
+    with _preview_versions_lock:
+        cached = _preview_versions.get(path)
+    if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+        return cached[2]
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b""):
+            h.update(chunk)
+    version = h.hexdigest()[:16]
+    with _preview_versions_lock:
+        _preview_versions[path] = (st.st_mtime_ns, st.st_size, version)
+    return version
+
+
+def _thumbnail_path(pid, version):
+    # Named by the preview version, so a thumbnail of an older table is never sent
+    return os.path.join(TEMP_DIR, f"{pid}.{version}.thumb.png")
+
+
+def _render_thumbnail(pid):
+    version = _preview_version(pid)
+    svg_path = _table_svg(pid) if version else None
+    if svg_path is None:
+        return
+    out = _thumbnail_path(pid, version)
+    tmp = f"{out}.{uuid.uuid4().hex}.part"
+    try:
+        cairosvg().svg2png(url=svg_path, write_to=tmp, output_width=THUMBNAIL_WIDTH)
+        os.replace(tmp, out)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return
+    if _preview_version(pid) != version:
+        # Edited while rendering: _save_table may have cleared thumbnails before this one was written
+        try:
+            os.remove(out)
+        except FileNotFoundError:
+            pass
+
+
+def _thumbnails_enabled():
+    return THUMBNAILS_WANTED and cairosvg() is not None
+
+
+def _prefetch_preview(pid):
+    """
+    Build the preview of a new or edited table in the background, before the browser asks for
+    it: the thumbnail (and so the SVG) when thumbnails are on, else the SVG when
+    BMS_PREFETCH_PREVIEWS is on.
+    """
+    if _thumbnails_enabled():
+        _THUMBNAIL_EXECUTOR.submit(_render_thumbnail, pid)
+    elif PREFETCH_PREVIEWS:
+        _THUMBNAIL_EXECUTOR.submit(_table_svg, pid)
+
+
+def _send_versioned(path, mimetype, version):
+    """send_file with ETag; immutable caching when the request asks for the current version."""
+    immutable = bool(version) and request.args.get("v") == version
+    resp = send_file(path, mimetype=mimetype, etag=version or True, conditional=True,
+                     max_age=PREVIEW_MAX_AGE if immutable else 0)
+    if immutable:
+        resp.headers["Cache-Control"] = "public, max-age=%d, immutable" % PREVIEW_MAX_AGE
+    else:
+        resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+
 @app.route("/preview/<pid>")
 def preview(pid):
-    path = os.path.join(TEMP_DIR, f"{pid}.svg")
-    if not os.path.isfile(path):
+    version = _preview_version(pid)
+    path = _table_svg(pid) if version else None
+    if path is None:
         return "Not found", 404
-    resp = send_file(path)
-    resp.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, max-age=0"
-    resp.headers["Pragma"] = "no-cache"
-    return resp
+    storage.touch(path)
+    try:
+        return _send_versioned(path, "image/svg+xml", version)
+    except FileNotFoundError:
+        return "Not found", 404
+
+
+@app.route("/preview/<pid>/thumb.png")
+def preview_thumbnail(pid):
+    """Small PNG of the table; falls back to the full SVG until the thumbnail is rendered."""
+    version = _preview_version(pid)
+    if not version:
+        return "Not found", 404
+    thumb = _thumbnail_path(pid, version)
+    if not os.path.isfile(thumb):
+        return redirect(url_for("preview", pid=pid, v=version))
+    try:
+        return _send_versioned(thumb, "image/png", version)
+    except FileNotFoundError:
+        return redirect(url_for("preview", pid=pid, v=version))
 
 # =================================================
 # DOWNLOAD GENERATED EXCEL
 # =================================================
 @app.route("/download_excel/<pid>")
 def download_excel(pid):
-    return send_file(os.path.join(TEMP_DIR, f"{pid}.xlsx"), as_attachment=True)
+    # Tables have only their JSON model until someone downloads
+    path = _table_excel(pid) if catalog.get(pid, "table") is not None else None
+    if path is None:
+        return "Table not found. Go back and create tables first.", 404
+    storage.touch(path)
+    return send_file(path, as_attachment=True)
 
 
 # =================================================
 # EDIT TABLE – change values before generating
 # =================================================
 @app.route("/edit-table/<table_id>", methods=["GET", "POST"])
+@profiled
 def edit_table(table_id):
-    excel_path = os.path.join(TEMP_DIR, f"{table_id}.xlsx")
-    if not os.path.isfile(excel_path):
+    pd = pandas()
+    df = _load_table(table_id)
+    if df is None:
         return "Table not found. Go back and create tables first.", 404
     if request.method == "POST":
         # Build DataFrame from form: data_0_POINT, data_0_SYSTEM, ... data_1_POINT, ...
@@ -995,16 +813,10 @@ def edit_table(table_id):
         if not rows:
             return "No data submitted.", 400
         df = pd.DataFrame(rows, columns=columns)
-        df.to_excel(excel_path, index=False)
-        # Regenerate table SVG so preview stays in sync
-        svg = build_table_svg(df)
-        svg_path = os.path.join(TEMP_DIR, f"{table_id}.svg")
-        with open(svg_path, "w", encoding="utf-8") as f:
-            f.write(svg)
-        # Redirect with refresh so step1 loads new preview (no cache)
-        import time
-        return redirect(url_for("step1", refresh=int(time.time() * 1000)))
-    df = pd.read_excel(excel_path)
+        # The preview and the .xlsx are rebuilt from the new model when next asked for
+        _save_table(table_id, df)
+        # Preview URLs carry a content version, so step1 shows the edited table without cache busting
+        return redirect(url_for("step1"))
     cols = [str(c).strip() for c in df.columns]
     want = ["POINT", "SYSTEM", "OBJECT", "DESCRIPTION", "SIGNAL"]
     for c in want:
@@ -1016,6 +828,47 @@ def edit_table(table_id):
     return render_template("edit_table.html", table_id=table_id, df=df, table_index=request.args.get("table_index", "1"))
 
 
+# =================================================
+# INGEST ROWS – JSON / CSV point rows without Excel
+# =================================================
+@app.route("/ingest-rows", methods=["POST"])
+def ingest_rows():
+    """
+    Create a table from POINT/SYSTEM/OBJECT/DESCRIPTION/SIGNAL rows (see bms_tool.rows):
+    a "rows" file field (.json/.ndjson/.csv) or the raw request body (Content-Type
+    application/json, application/x-ndjson or text/csv); ?format=json|csv overrides.
+    The table joins this session's tables like an uploaded workbook. Returns JSON.
+    """
+    upload = request.files.get("rows")
+    if upload is not None:
+        stream, filename, content_type = upload.stream, upload.filename, upload.mimetype
+    else:
+        stream, filename, content_type = request.stream, None, request.mimetype
+    fmt = (request.args.get("format") or "").strip().lower() or detect_format(filename, content_type)
+    if not fmt:
+        return jsonify(error="Send JSON or CSV rows (Content-Type or ?format=json|csv)."), 415
+    try:
+        # Parsed while the body is read (not via run_heavy: a request stream cannot go to another process)
+        df = parse_rows(stream, fmt, max_bytes=MAX_EXCEL_BYTES, filename=filename)
+    except UploadTooLarge as e:
+        return jsonify(error=str(e)), 413
+    except RowsError as e:
+        return jsonify(error=str(e)), 400
+    if df.empty:
+        return jsonify(error="No rows."), 400
+
+    tid = str(uuid.uuid4())
+    _save_table(tid, df)
+    _session_table_ids()  # moves the ids of an older session cookie first
+    catalog.add_session_table(_session_id(), tid)
+    return jsonify(
+        table_id=tid,
+        rows=len(df),
+        preview_url=url_for("preview", pid=tid, v=_preview_version(tid)),
+        excel_url=url_for("download_excel", pid=tid),
+    ), 201
+
+
 # =================================================
 # MERGE TABLE INTO DRAWING
 # =================================================
@@ -1023,17 +876,26 @@ def edit_table(table_id):
 def merge():
     drawing = request.files["drawing"]
     table_id = request.form["table_id"]
+    if catalog.get(table_id, "table") is None:
+        return "Table not found. Go back and create tables first.", 404
 
-    drawing_path = os.path.join(DRAWING_DIR, drawing.filename)
-    drawing.save(drawing_path)
-
-    drawing_tree = ET.parse(drawing_path)
+    try:
+        upload = receive_upload(drawing, MAX_SVG_BYTES)
+    except UploadTooLarge as e:
+        return str(e), 413
+    with upload:
+        # Stored by content digest (never by the client's filename); re-uploads are not rewritten
+        blobs.put_upload(upload)
+        drawing_tree = parse_svg(upload.open(), name=drawing.filename)
     drawing_root = drawing_tree.getroot()
     ET.register_namespace("", SVG_NS)
 
     draw_w, draw_h = get_viewbox(drawing_root)
 
-    table_tree = ET.parse(os.path.join(TEMP_DIR, f"{table_id}.svg"))
+    table_svg = _table_svg(table_id)
+    if table_svg is None:
+        return "Table not found. Go back and create tables first.", 404
+    table_tree = ET.parse(table_svg)
     table_root = table_tree.getroot()
 
     table_w = float(table_root.attrib["width"])
@@ -1054,17 +916,43 @@ def merge():
 
     out = os.path.join(TEMP_DIR, f"FINAL_{uuid.uuid4()}.svg")
     drawing_tree.write(out, encoding="utf-8", xml_declaration=True)
-
-    return send_file(out, as_attachment=True)
+    download_name = os.path.basename(out)
+    out = blobs.local_path(blobs.put_file(out, move=True))
+    return send_file(out, as_attachment=True, download_name=download_name)
 
 # =================================================
 # MERGE DASHBOARD – select table or upload Excel + SVG
 # =================================================
 @app.route("/merge-dashboard", methods=["GET"])
 def merge_dashboard():
-    table_ids = session.get("table_ids") or []
+    table_ids = _session_table_ids()
+    if table_ids:
+        storage.touch_session(_session_id(), table_ids)
     svg_templates = list_svg_templates()
-    return render_template("merge_dashboard.html", table_ids=table_ids, svg_templates=svg_templates)
+    # Best-matching template per table (by shared point ids), preselected in its row
+    matches = {}
+    for tid in table_ids:
+        df = _load_table(tid)
+        if df is not None and not df.empty:
+            ranked = template_index.rank(table_point_ids(df))
+            matches[tid] = {
+                "best": ranked[0]["template"] if ranked else None,
+                "by_template": {r["template"]: r for r in ranked},
+            }
+    return render_template("merge_dashboard.html", table_ids=table_ids, svg_templates=svg_templates,
+                           matches=matches, compact_default=COMPACT_OUTPUT_DEFAULT,
+                           prune_hidden_default="hidden" in PRUNE_DEFAULT,
+                           prune_base=",".join(k for k in PRUNE_DEFAULT if k != "hidden") or "0")
+
+
+@app.route("/template-matches/<table_id>", methods=["GET"])
+def template_matches(table_id):
+    """Saved templates ranked by the points they share with a table (JSON)."""
+    df = _load_table(table_id)
+    if df is None:
+        return jsonify({"error": "Table not found."}), 404
+    points = table_point_ids(df, request.args.get("point_column") or "POINT")
+    return jsonify({"table_id": table_id, "points": len(points), "templates": template_index.rank(points)})
 
 
 # =================================================
@@ -1080,14 +968,31 @@ def save_svg_template():
         return "Please upload an SVG file.", 400
     safe_name = re.sub(r"[^\w\s-]", "", name).strip().replace(" ", "_") or "template"
     filename = f"{safe_name}.svg"
-    path = os.path.join(SVG_TEMPLATES_DIR, filename)
-    svg_file.save(path)
+    try:
+        upload = receive_upload(svg_file, MAX_SVG_BYTES)
+    except UploadTooLarge as e:
+        return str(e), 413
+    with upload:
+        check_svg(upload.open(), name=svg_file.filename)
+        digest = blobs.put_upload(upload)
+    # The ref makes the template visible to every instance sharing the blob store
+    blobs.set_ref(TEMPLATE_REFS, filename, digest)
+    _install_template(filename, digest)
     return redirect(url_for("merge_dashboard"))
 
 # =================================================
 # MERGE FINAL – same process: point match + table in drawing
 # =================================================
+# Compact output by default? (BMS_COMPACT_OUTPUT=1). The dashboard checkbox overrides per merge.
+COMPACT_OUTPUT_DEFAULT = os.environ.get("BMS_COMPACT_OUTPUT", "").strip().lower() in ("1", "true", "yes")
+# Tables drawn as grid paths + one <text> per column (BMS_TABLE_GRID=1); form field table_grid overrides per merge
+TABLE_GRID_DEFAULT = os.environ.get("BMS_TABLE_GRID", "").strip().lower() in ("1", "true", "yes")
+# What to leave out of merge outputs (BMS_PRUNE=hidden / hidden,defs,groups / all; see bms_tool.prune); form field prune overrides
+PRUNE_DEFAULT = list(prune_kinds(os.environ.get("BMS_PRUNE", "")))
+
+
 @app.route("/merge-final", methods=["POST"])
+@profiled
 def merge_final():
     table_source = request.form.get("table_source", "selected")
     svg_source = request.form.get("svg_source", "upload")
@@ -1098,36 +1003,137 @@ def merge_final():
         if not svg_template:
             return "Please select a saved SVG template.", 400
         path = os.path.join(SVG_TEMPLATES_DIR, svg_template)
+        if not os.path.isfile(path):
+            sync_templates(force=True)   # saved by another instance since the last sync
         if not os.path.isfile(path):
             return "Selected SVG template not found.", 404
         svg_path = path
     else:
         if not svg_file or not svg_file.filename:
             return "Please upload an SVG drawing or select a saved template.", 400
-        svg_path = os.path.join(TEMP_DIR, f"input_drawing_{uuid.uuid4()}.svg")
-        svg_file.save(svg_path)
+        try:
+            with receive_upload(svg_file, MAX_SVG_BYTES) as upload:
+                svg_path = blobs.local_path(blobs.put_upload(upload))
+        except UploadTooLarge as e:
+            return str(e), 413
 
     if table_source == "upload":
         excel_file = request.files.get("excel_file")
         if not excel_file:
             return "Please upload an Excel file when choosing 'Upload new Excel'.", 400
-        excel_path = os.path.join(TEMP_DIR, f"input_excel_{uuid.uuid4()}.xlsx")
-        excel_file.save(excel_path)
-        df = pd.read_excel(excel_path)
+        try:
+            with receive_upload(excel_file, MAX_EXCEL_BYTES) as upload:
+                df = _read_uploaded_excel(upload)
+        except UploadTooLarge as e:
+            return str(e), 413
     else:
         table_id = request.form.get("table_id")
         if not table_id:
             return "Please select a table.", 400
-        excel_path = os.path.join(TEMP_DIR, f"{table_id}.xlsx")
-        if not os.path.isfile(excel_path):
+        df = _load_table(table_id)
+        if df is None:
             return "Selected table file not found. Go back and create tables first.", 404
-        df = pd.read_excel(excel_path)
 
-    point_column = (request.form.get("point_column") or "POINT").strip() or "POINT"
-    display_column = (request.form.get("display_column") or "").strip() or None
-    left_column = (request.form.get("left_column") or "").strip() or None
-    right_column = (request.form.get("right_column") or "").strip() or None
+    options = _merge_options()
+    job_id = str(uuid.uuid4())
+    output_svg = os.path.join(TEMP_DIR, f"final_output_{job_id}.svg")
+    # Saved templates are merged from their compiled form (kept per worker process; see bms_tool.compiled)
+    merge = merge_template if svg_source == "template" else update_svg
+    try:
+        report = run_heavy(merge, svg_path, df, output_svg, **options)
+    except ParseLimitExceeded as e:
+        if svg_source == "template":
+            raise
+        # Name the drawing as uploaded, not by its stored digest name
+        return str(ParseLimitExceeded(svg_file.filename, e.limit, e.value, e.budget)), 413
+    # Stored once however many merges produce the same drawing
+    digest = blobs.put_file(output_svg, move=True)
+    output_svg = blobs.local_path(digest)
+    _save_merge_job(job_id, df, options, report, digest)
+    return _send_merge_output(output_svg, digest, job_id, report)
+
+
+def _merge_options(defaults=None):
+    """update_svg keyword options from the form; fields not sent fall back to defaults (a previous job's)."""
+    defaults = defaults or {}
+
+    def column(name, fallback=None):
+        if name not in request.form:
+            return defaults.get(name, fallback)
+        return (request.form.get(name) or "").strip() or fallback
+
+    # Dashboard sends a hidden "0" plus the checkbox's "1" when ticked; API callers may omit it
+    compact_values = request.form.getlist("compact_output")
+    if compact_values:
+        compact = any(v in ("1", "on", "true") for v in compact_values)
+    else:
+        compact = defaults.get("compact", COMPACT_OUTPUT_DEFAULT)
+    if "table_grid" in request.form:
+        table_grid = request.form.get("table_grid") in ("1", "on", "true")
+    else:
+        table_grid = defaults.get("table_grid", TABLE_GRID_DEFAULT)
+    # Same pattern as compact_output: the dashboard sends the other BMS_PRUNE kinds (or "0") plus "hidden" when ticked
+    prune_values = request.form.getlist("prune")
+    if prune_values:
+        prune = list(prune_kinds(",".join(prune_values)))
+    else:
+        prune = defaults.get("prune", PRUNE_DEFAULT)
+    return {
+        "point_column": column("point_column", "POINT"),
+        "display_column": column("display_column"),
+        "left_column": column("left_column"),
+        "right_column": column("right_column"),
+        "compact": compact,
+        "table_grid": table_grid,
+        "prune": prune,
+    }
+
+
+def _merge_job_paths(job_id):
+    """
+    (output svg as written by the merge, table model) of a merge job, or None for a malformed
+    job id. The output is then moved into the blob store (see _merge_job_output).
+    """
+    try:
+        job_id = str(uuid.UUID(job_id))
+    except (ValueError, TypeError):
+        return None
+    stem = os.path.join(TEMP_DIR, f"final_output_{job_id}")
+    return stem + ".svg", stem + ".table.json"
+
+
+def _save_merge_job(job_id, df, options, report, digest, changes=False):
+    """
+    Keep the table of a merge and catalog the job with its options and the blob digest of its
+    output, so /merge-delta can start from it (changes: a /merge-report exists for it).
+    """
+    _svg, model_path = _merge_job_paths(job_id)
+    write_table_model(df, model_path)
+    catalog.add(job_id, "output", key=f"final_output_{job_id}", session_id=_session_id(), digest=digest,
+                size=report["bytes"], rows=len(df), meta={"options": options, "changes": changes})
+
+
+def _merge_job_output(job):
+    """Local path of a cataloged merge job's output (jobs from before the blob store: TEMP_DIR)."""
+    if job["digest"]:
+        return blobs.local_path(job["digest"])
+    return _merge_job_paths(job["id"])[0]
+
+
+def _compressed_output(output_svg, digest, encoding):
+    """Path of the merge output compressed with encoding (made on first use), or None when not worth it."""
+    size = os.path.getsize(output_svg)
+    if size < output_size.MIN_COMPRESS_BYTES:
+        return None
+    path = os.path.join(COMPRESSED_DIR, "%s.%s" % (digest, encoding))
+    if not os.path.isfile(path):
+        os.makedirs(COMPRESSED_DIR, exist_ok=True)
+        output_size.compress_file(output_svg, path, encoding)
+    storage.touch(path)
+    return path if os.path.getsize(path) < size else None
+
 
+def _send_merge_output(output_svg, digest, job_id, report):
     # User-provided download filename (optional)
     raw_name = (request.form.get("output_filename") or "").strip()
     if raw_name:
@@ -1135,11 +1141,126 @@ def merge_final():
         download_name = safe if safe.lower().endswith(".svg") else (safe + ".svg")
     else:
         download_name = "final_output.svg"
+    encoding = output_size.choose_encoding(request.headers.get("Accept-Encoding"))
+    packed = _compressed_output(output_svg, digest, encoding) if encoding else None
+    if packed is None:
+        resp = send_file(output_svg, as_attachment=True, download_name=download_name)
+    else:
+        original = os.path.getsize(output_svg)
+        resp = send_file(packed, mimetype="image/svg+xml", as_attachment=True, download_name=download_name)
+        resp.headers["Content-Encoding"] = encoding
+        resp.vary.add("Accept-Encoding")
+        resp.headers["X-BMS-Compression-Saved-Bytes"] = str(original - resp.content_length)
+        output_size.record_compression(original, resp.content_length)
+    resp.headers["X-BMS-Job-Id"] = job_id
+    if report and report["compact"]:
+        output_size.record_compact(report["saved_bytes"])
+        resp.headers["X-BMS-Compact-Saved-Bytes"] = str(report["saved_bytes"])
+    if report and report["pruned"]:
+        resp.headers["X-BMS-Pruned"] = "; ".join("%s=%d" % item for item in report["pruned"].items())
+    return resp
+
 
-    output_svg = os.path.join(TEMP_DIR, f"final_output_{uuid.uuid4()}.svg")
-    update_svg(svg_path, df, output_svg, point_column=point_column, display_column=display_column,
-              left_column=left_column, right_column=right_column)
-    return send_file(output_svg, as_attachment=True, download_name=download_name)
+# =================================================
+# DELTA MERGE – apply a revised table to a previous output
+# =================================================
+@app.route("/merge-delta", methods=["POST"])
+def merge_delta():
+    """
+    Update a previous merge output for a revised table instead of merging from the blank drawing.
+    Previous state: job_id of an earlier /merge-final or /merge-delta (X-BMS-Job-Id header), or
+    an uploaded previous_svg plus old_table_id / old_excel_file. New table: table_id or excel_file.
+    Column options default to the previous job's. The change report is at X-BMS-Change-Report.
+    """
+    options_default = None
+    svg_file = None
+    prev_job = request.form.get("job_id")
+    if prev_job:
+        job = catalog.get(prev_job, "output")
+        if job is None:
+            return "Previous merge not found (it may have expired). Run a full merge.", 404
+        _svg, model_path = _merge_job_paths(prev_job)
+        try:
+            previous_svg = _merge_job_output(job)
+            storage.touch(previous_svg, model_path)
+            old_df = read_table_model(model_path)
+        except FileNotFoundError:
+            return "Previous merge not found (it may have expired). Run a full merge.", 404
+        options_default = job["meta"].get("options") or {}
+        if "hidden" in options_default.get("prune", ()):
+            return "The previous merge left out hidden images, so it cannot be updated. Run a full merge.", 409
+    else:
+        svg_file = request.files.get("previous_svg")
+        if not svg_file or not svg_file.filename:
+            return "Send job_id, or the previous output as previous_svg.", 400
+        try:
+            with receive_upload(svg_file, MAX_SVG_BYTES) as upload:
+                previous_svg = blobs.local_path(blobs.put_upload(upload))
+        except UploadTooLarge as e:
+            return str(e), 413
+        old_df, error = _request_table("old_table_id", "old_excel_file")
+        if error:
+            return error
+
+    df, error = _request_table("table_id", "excel_file")
+    if error:
+        return error
+
+    options = _merge_options(options_default)
+    job_id = str(uuid.uuid4())
+    output_svg, _model = _merge_job_paths(job_id)
+    try:
+        report = run_heavy(update_svg_delta, previous_svg, old_df, df, output_svg, **options)
+    except ParseLimitExceeded as e:
+        if svg_file is None:
+            raise
+        # Name the drawing as uploaded, not by its stored digest name
+        return str(ParseLimitExceeded(svg_file.filename, e.limit, e.value, e.budget)), 413
+    digest = blobs.put_file(output_svg, move=True)
+    output_svg = blobs.local_path(digest)
+    _save_merge_job(job_id, df, options, report, digest, changes=True)
+    report_path = os.path.join(TEMP_DIR, f"final_output_{job_id}.changes.json")
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f)
+
+    changes = report["changes"]
+    resp = _send_merge_output(output_svg, digest, job_id, report)
+    resp.headers["X-BMS-Changes"] = "added=%d; removed=%d; changed=%d; unchanged=%d" % (
+        len(changes["added"]), len(changes["removed"]), len(changes["changed"]), changes["unchanged"])
+    resp.headers["X-BMS-Change-Report"] = url_for("merge_report", job_id=job_id)
+    return resp
+
+
+def _request_table(id_field, file_field):
+    """(DataFrame, None) from a stored table id or an uploaded workbook in the form; (None, error response) otherwise."""
+    upload_file = request.files.get(file_field)
+    if upload_file and upload_file.filename:
+        try:
+            with receive_upload(upload_file, MAX_EXCEL_BYTES) as upload:
+                return _read_uploaded_excel(upload), None
+        except UploadTooLarge as e:
+            return None, (str(e), 413)
+    table_id = request.form.get(id_field)
+    if not table_id:
+        return None, ("Send %s or %s." % (id_field, file_field), 400)
+    df = _load_table(table_id)
+    if df is None:
+        return None, ("Table %s not found." % table_id, 404)
+    return df, None
+
+
+@app.route("/merge-report/<job_id>")
+def merge_report(job_id):
+    """Change report of a /merge-delta job (JSON): added/removed/changed points and what was rewritten."""
+    job = catalog.get(job_id, "output")
+    if job is None or not job["meta"].get("changes"):
+        return jsonify(error="No change report for this job."), 404
+    report_path = os.path.join(TEMP_DIR, f"final_output_{job['id']}.changes.json")
+    storage.touch(report_path)
+    try:
+        return send_file(report_path, mimetype="application/json")
+    except FileNotFoundError:
+        return jsonify(error="No change report for this job."), 404
 
 # =================================================
 # FINAL RUNNING LINK (for other PCs)
@@ -1275,7 +1396,6 @@ def running_link():
 
 if __name__ == "__main__":
     import sys
-    import time
     import logging
     from threading import Thread
 
@@ -0,0 +1,222 @@
+"""
+ASGI serving mode for the BMS Point Tool.
+
+Run with one of:
+    uvicorn asgi:app --host 0.0.0.0 --port $PORT
+    gunicorn asgi:app -k uvicorn.workers.UvicornWorker --bind 0.0.0.0:$PORT
+
+The Flask app in app.py is unchanged. This adapter:
+  - receives request bodies (Excel / SVG uploads) asynchronously on the event loop,
+    spooling them to a temp file, so a slow upload never holds a worker thread;
+  - runs the Flask view on a request thread pool, so file reads/writes and send_file
+    streaming happen off the event loop;
+  - configures app.run_heavy() with a separate executor, so read_all_tables and
+    update_svg run there and a big merge does not block previews, health checks or
+    other users' uploads. Each heavy worker process compiles the saved templates when
+    it starts (app.preload's compiled templates are not shared with spawned processes).
+
+Env:
+  BMS_ASGI_THREADS     request threads (default 32)
+  BMS_HEAVY_EXECUTOR   "process" (default) or "thread"
+  BMS_HEAVY_WORKERS    heavy workers (default: CPU count)
+  BMS_SPOOL_MAX_BYTES  upload bytes kept in memory before spilling to disk (default 1 MB)
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import app as flask_module
+from bms_tool.compiled import precompile
+
+flask_app = flask_module.app
+
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, "").strip() or default)
+    except (ValueError, TypeError):
+        return default
+
+
+REQUEST_THREADS = _env_int("BMS_ASGI_THREADS", 32)
+HEAVY_WORKERS = _env_int("BMS_HEAVY_WORKERS", os.cpu_count() or 2)
+SPOOL_MAX_BYTES = _env_int("BMS_SPOOL_MAX_BYTES", 1024 * 1024)
+
+
+def _make_heavy_executor():
+    kind = os.environ.get("BMS_HEAVY_EXECUTOR", "process").strip().lower()
+    if kind == "thread":
+        return ThreadPoolExecutor(max_workers=HEAVY_WORKERS, thread_name_prefix="bms-heavy")
+    # spawn: never fork a process that already runs an event loop and thread pools. Spawned
+    # workers do not inherit the preloaded compiled templates, so each compiles them on start.
+    return ProcessPoolExecutor(max_workers=HEAVY_WORKERS, mp_context=multiprocessing.get_context("spawn"),
+                               initializer=precompile,
+                               initargs=(flask_module.saved_template_paths(), flask_module.COMPACT_OUTPUT_DEFAULT))
+
+
+def _build_environ(scope, body, content_length):
+    """WSGI environ for one ASGI http scope (PEP 3333)."""
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    root_path = scope.get("root_path", "")
+    path = scope["path"]
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": root_path.encode("utf-8").decode("latin-1"),
+        "PATH_INFO": path.encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": "HTTP/%s" % scope.get("http_version", "1.1"),
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "CONTENT_LENGTH": str(content_length),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for raw_name, raw_value in scope.get("headers", []):
+        name = raw_name.decode("latin-1").upper().replace("-", "_")
+        value = raw_value.decode("latin-1")
+        if name == "CONTENT_TYPE":
+            environ["CONTENT_TYPE"] = value
+            continue
+        if name == "CONTENT_LENGTH":
+            continue
+        key = "HTTP_" + name
+        environ[key] = environ[key] + "," + value if key in environ else value
+    return environ
+
+
+class AsgiAdapter:
+    """Serve a Flask (WSGI) app over ASGI with async body receive and threaded views."""
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+        self.request_pool = ThreadPoolExecutor(max_workers=REQUEST_THREADS, thread_name_prefix="bms-request")
+        self.heavy_pool = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self._http(scope, receive, send)
+
+    def _start_heavy_pool(self):
+        if self.heavy_pool is None:
+            self.heavy_pool = _make_heavy_executor()
+            flask_module.set_heavy_executor(self.heavy_pool)
+
+    def _stop_heavy_pool(self):
+        if self.heavy_pool is not None:
+            flask_module.set_heavy_executor(None)
+            self.heavy_pool.shutdown(wait=False, cancel_futures=True)
+            self.heavy_pool = None
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    self._start_heavy_pool()
+                except Exception as e:
+                    await send({"type": "lifespan.startup.failed", "message": str(e)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self._stop_heavy_pool()
+                self.request_pool.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _receive_body(self, receive, max_bytes):
+        """Read the request body chunk by chunk into a spooled temp file; None if over max_bytes."""
+        loop = asyncio.get_running_loop()
+        body = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+        size = 0
+        more = True
+        while more:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                body.close()
+                return None, -1
+            chunk = message.get("body", b"")
+            more = message.get("more_body", False)
+            if not chunk:
+                continue
+            size += len(chunk)
+            if max_bytes and size > max_bytes:
+                body.close()
+                return None, size
+            if size > SPOOL_MAX_BYTES:
+                # Spilled to disk: keep the blocking write off the event loop
+                await loop.run_in_executor(self.request_pool, body.write, chunk)
+            else:
+                body.write(chunk)
+        body.seek(0)
+        return body, size
+
+    async def _http(self, scope, receive, send):
+        if self.heavy_pool is None:
+            # Server without lifespan support: start the heavy pool on first request
+            self._start_heavy_pool()
+        max_bytes = flask_app.config.get("MAX_CONTENT_LENGTH")
+        body, size = await self._receive_body(receive, max_bytes)
+        if body is None:
+            if size >= 0:
+                await send({"type": "http.response.start", "status": 413,
+                            "headers": [(b"content-type", b"text/plain; charset=utf-8")]})
+                await send({"type": "http.response.body", "body": b"Upload too large."})
+            return
+        environ = _build_environ(scope, body, size)
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self.request_pool, self._run_wsgi, environ, loop, send)
+        finally:
+            body.close()
+
+    def _run_wsgi(self, environ, loop, send):
+        """Call the WSGI app on a request thread and forward status, headers and body to ASGI send."""
+        started = {}
+
+        def send_sync(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and started.get("sent"):
+                raise exc_info[1].with_traceback(exc_info[2])
+            started["status"] = int(status.split(" ", 1)[0])
+            started["headers"] = [
+                (k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers
+            ]
+
+        result = self.wsgi_app(environ, start_response)
+        try:
+            for chunk in result:
+                if not chunk:
+                    continue
+                if not started.get("sent"):
+                    send_sync({"type": "http.response.start", "status": started["status"],
+                               "headers": started["headers"]})
+                    started["sent"] = True
+                send_sync({"type": "http.response.body", "body": chunk, "more_body": True})
+            if not started.get("sent"):
+                send_sync({"type": "http.response.start", "status": started["status"],
+                           "headers": started["headers"]})
+            send_sync({"type": "http.response.body", "body": b""})
+        finally:
+            close = getattr(result, "close", None)
+            if close is not None:
+                close()
+
+
+app = AsgiAdapter(flask_app)
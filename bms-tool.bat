@@ -0,0 +1,4 @@
+@echo off
+rem Headless BMS Point Tool: bms-tool extract ... / bms-tool merge ...  (see DEPLOY.md)
+set "PYTHONPATH=%~dp0;%PYTHONPATH%"
+python -m bms_tool %*
@@ -0,0 +1,5 @@
+"""
+BMS Point Tool building blocks used by the web app (app.py).
+
+Modules here do not import Flask, so they can be reused from scripts.
+"""
@@ -0,0 +1,5 @@
+import sys
+
+from bms_tool.cli import main
+
+sys.exit(main())
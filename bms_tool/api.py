@@ -0,0 +1,79 @@
+"""
+Python API for the merge pipeline. Does not import Flask.
+
+    from bms_tool import api
+    tables = api.extract_tables("schedule.xlsx", sheet=0)
+    api.write_table(tables[0], "out", "schedule_t1")           # out/schedule_t1.svg + .xlsx
+    report = api.merge("drawing.svg", tables[0], "out/final.svg", left_column="SYSTEM")
+    report = api.merge_delta("out/final.svg", tables[0], "revised.xlsx", "out/final_v2.svg", left_column="SYSTEM")
+"""
+import os
+
+from bms_tool.guard import read_excel
+from bms_tool.tables import read_all_tables, normalize_table, build_table_svg
+from bms_tool.drawing import update_svg, update_svg_delta
+from bms_tool.rows import detect_format, parse_rows, read_table_model
+
+
+def extract_tables(excel, sheet=0):
+    """Tables found on one sheet of a workbook (path or file object), normalized to TABLE_COLUMNS."""
+    raw = read_excel(excel, sheet_name=sheet, header=None)
+    return [normalize_table(tdf) for tdf in read_all_tables(raw)]
+
+
+def write_table(df, out_dir, stem, excel=True, grid=False):
+    """
+    Write <stem>.svg (table drawing; grid=True for the compact grid markup) and, unless
+    excel=False, <stem>.xlsx. Returns the paths written.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    svg_path = os.path.join(out_dir, f"{stem}.svg")
+    with open(svg_path, "w", encoding="utf-8") as f:
+        f.write(build_table_svg(df, grid=grid))
+    paths = [svg_path]
+    if excel:
+        xlsx_path = os.path.join(out_dir, f"{stem}.xlsx")
+        df.to_excel(xlsx_path, index=False)
+        paths.append(xlsx_path)
+    return paths
+
+
+def load_table(path):
+    """
+    Table from a .xlsx/.xls file (as written by write_table or the web app), a stored
+    <id>.table.json model, or JSON/CSV point rows (see bms_tool.rows).
+    """
+    if path.lower().endswith(".table.json"):
+        return read_table_model(path)
+    fmt = detect_format(path)
+    if fmt:
+        with open(path, "rb") as f:
+            return parse_rows(f, fmt, filename=os.path.basename(path))
+    return read_excel(path)
+
+
+def merge(drawing, table, output, point_column="POINT", display_column=None,
+          left_column=None, right_column=None, compact=False, table_grid=False, prune=()):
+    """
+    Merge table (DataFrame or table file path) into drawing (SVG path) and write output.
+    Same result as /merge-final. prune: what to leave out (see bms_tool.prune).
+    Returns the size report from convert_to_visio_svg.
+    """
+    df = load_table(table) if isinstance(table, str) else table
+    return update_svg(drawing, df, output, point_column=point_column, display_column=display_column,
+                      left_column=left_column, right_column=right_column, compact=compact,
+                      table_grid=table_grid, prune=prune)
+
+
+def merge_delta(previous_output, old_table, new_table, output, point_column="POINT", display_column=None,
+                left_column=None, right_column=None, compact=False, table_grid=False, prune=()):
+    """
+    Apply a revised table to previous_output (made by merge() from old_table with the same
+    column options, without pruning "hidden") and write output. Returns the size report with
+    the change report under "changes".
+    """
+    old_df = load_table(old_table) if isinstance(old_table, str) else old_table
+    new_df = load_table(new_table) if isinstance(new_table, str) else new_table
+    return update_svg_delta(previous_output, old_df, new_df, output, point_column=point_column,
+                            display_column=display_column, left_column=left_column,
+                            right_column=right_column, compact=compact, table_grid=table_grid, prune=prune)
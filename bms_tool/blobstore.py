@@ -0,0 +1,405 @@
+"""
+Content-addressed storage for uploaded workbooks and drawings, saved templates and merge
+outputs. Identical files are stored once, and with the S3 backend every app instance sees
+the same blobs.
+
+    blobs = open_store(os.environ.get("BMS_BLOB_STORE", ""), "uploads/blobs", "uploads/blob_cache")
+    digest = blobs.put_upload(upload)            # a SpooledUpload; sha256, as upload.digest
+    digest = blobs.put_file(path, move=True)     # a file written by the app (it is moved in)
+    path = blobs.local_path(digest)              # local file with the bytes (FileNotFoundError if gone)
+    blobs.set_ref("templates", "AHU_1.svg", digest)
+    blobs.refs("templates")                      # {"AHU_1.svg": digest, ...}
+
+Blobs are named by the sha256 of their bytes, so putting bytes that are already stored only
+refreshes their last use. Writes go to a .part name that is renamed into place, so a reader
+never sees half a blob. Refs give names to blobs (the saved templates); a ref is one small
+object, rewritten whole.
+
+Backends (BMS_BLOB_STORE):
+
+    local (default)        a directory, uploads/blobs (local:/other/dir for another one).
+                           local_path() is the blob itself.
+    s3://bucket/prefix     any S3-compatible service (BMS_S3_ENDPOINT_URL for MinIO, a
+                           moto server or another stand-in; credentials as boto3 finds them).
+                           Needs boto3. Blobs are read through a local cache directory and
+                           checked against their digest when downloaded.
+
+The local directory and the S3 cache hold plain files named <digest>, so the artifact
+sweeper (bms_tool.lifecycle) can evict them; pinned_keys() are the blobs refs point to.
+"""
+import hashlib
+import os
+import re
+import shutil
+import threading
+import uuid
+
+from bms_tool.lazy import boto3
+
+CHUNK_SIZE = 1024 * 1024
+_PARTIAL_SUFFIX = ".part"
+_DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+_REF_NAME_RE = re.compile(r"^[\w.\- ]+$")
+
+
+def file_digest(path):
+    """sha256 hex digest of a file."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _check_digest(digest):
+    if not _DIGEST_RE.match(digest or ""):
+        raise ValueError("not a blob digest: %r" % (digest,))
+    return digest
+
+
+def _check_ref(namespace, name):
+    for part in (namespace, name):
+        if not _REF_NAME_RE.match(part or "") or part.startswith("."):
+            raise ValueError("not a ref name: %r" % (part,))
+
+
+def _copy_atomic(src, path):
+    """Copy the file object src to path through a .part file."""
+    tmp = "%s.%s%s" % (path, uuid.uuid4().hex, _PARTIAL_SUFFIX)
+    try:
+        with open(tmp, "wb") as out:
+            shutil.copyfileobj(src, out, CHUNK_SIZE)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def _write_text_atomic(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = "%s.%s%s" % (path, uuid.uuid4().hex, _PARTIAL_SUFFIX)
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def _touch(path):
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+class _Counters:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.values = {"puts": 0, "deduplicated": 0, "stored_bytes": 0, "cache_hits": 0, "cache_misses": 0,
+                       "downloaded_bytes": 0}
+
+    def add(self, **amounts):
+        with self._lock:
+            for name, amount in amounts.items():
+                self.values[name] += amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.values)
+
+
+# =================================================
+# LOCAL DIRECTORY
+# =================================================
+class LocalBlobStore:
+    """Blobs as <root>/<digest>, refs as <root>/refs/<namespace>/<name> (a file holding the digest)."""
+
+    backend = "local"
+
+    def __init__(self, root):
+        self.root = root
+        self._counters = _Counters()
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, digest):
+        return os.path.join(self.root, _check_digest(digest))
+
+    def _ref_path(self, namespace, name=None):
+        return os.path.join(self.root, "refs", namespace, *([name] if name else []))
+
+    # ---------- blobs ----------
+    def _stored(self, digest, size):
+        path = self._path(digest)
+        if os.path.isfile(path):
+            _touch(path)   # a fresh use for the artifact sweeper
+            self._counters.add(puts=1, deduplicated=1)
+            return True
+        self._counters.add(puts=1, stored_bytes=size)
+        return False
+
+    def put_upload(self, upload):
+        """Store a SpooledUpload (bms_tool.uploads) under its digest. Returns the digest."""
+        if not self._stored(upload.digest, upload.size):
+            _copy_atomic(upload.open(), self._path(upload.digest))
+        return upload.digest
+
+    def put_file(self, path, move=False):
+        """Store the file at path; move=True takes the file itself (it is gone afterwards). Returns the digest."""
+        digest = file_digest(path)
+        if self._stored(digest, os.path.getsize(path)):
+            if move:
+                os.remove(path)
+        elif move:
+            os.replace(path, self._path(digest))
+        else:
+            with open(path, "rb") as src:
+                _copy_atomic(src, self._path(digest))
+        return digest
+
+    def exists(self, digest):
+        return os.path.isfile(self._path(digest))
+
+    def local_path(self, digest):
+        """The blob's file. Raises FileNotFoundError when it is not stored (or was evicted)."""
+        path = self._path(digest)
+        if not os.path.isfile(path):
+            raise FileNotFoundError("blob %s is not stored" % digest)
+        return path
+
+    # ---------- refs ----------
+    def set_ref(self, namespace, name, digest):
+        _check_ref(namespace, name)
+        _write_text_atomic(self._ref_path(namespace, name), _check_digest(digest))
+
+    def refs(self, namespace):
+        """{name: digest} of the refs in namespace."""
+        out = {}
+        try:
+            entries = list(os.scandir(self._ref_path(namespace)))
+        except OSError:
+            return out
+        for entry in entries:
+            if entry.name.endswith(_PARTIAL_SUFFIX) or not entry.is_file():
+                continue
+            try:
+                with open(entry.path, encoding="utf-8") as f:
+                    digest = f.read().strip()
+            except OSError:
+                continue
+            if _DIGEST_RE.match(digest):
+                out[entry.name] = digest
+        return out
+
+    def delete_ref(self, namespace, name):
+        _check_ref(namespace, name)
+        try:
+            os.remove(self._ref_path(namespace, name))
+        except FileNotFoundError:
+            pass
+
+    # ---------- lifecycle ----------
+    def swept_dirs(self):
+        """Directories of plain <digest> files the artifact sweeper may evict from."""
+        return [self.root]
+
+    def pinned_keys(self):
+        """Blobs the sweeper must keep: those a ref points to."""
+        refs_dir = self._ref_path("")
+        try:
+            namespaces = [e.name for e in os.scandir(refs_dir) if e.is_dir()]
+        except OSError:
+            return set()
+        return {digest for ns in namespaces for digest in self.refs(ns).values()}
+
+    def stats(self):
+        return dict(self._counters.snapshot(), backend=self.backend, root=self.root)
+
+
+# =================================================
+# S3-COMPATIBLE
+# =================================================
+def _not_found(exc):
+    code = str(((getattr(exc, "response", None) or {}).get("Error") or {}).get("Code", ""))
+    return code in ("404", "NoSuchKey", "NotFound")
+
+
+class S3BlobStore:
+    """
+    Blobs as s3://bucket/<prefix>blobs/<digest>, refs as <prefix>refs/<namespace>/<name>
+    (the digest as the object body). Blobs are read through cache_dir/<digest>; ref bodies
+    are remembered by ETag.
+    """
+
+    backend = "s3"
+
+    def __init__(self, bucket, prefix="", cache_dir="blob_cache", endpoint_url=None, client=None):
+        if client is None:
+            b3 = boto3()
+            if b3 is None:
+                raise RuntimeError("BMS_BLOB_STORE=s3://... needs boto3: pip install boto3")
+            client = b3.client("s3", endpoint_url=endpoint_url or None)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+        self.cache_dir = cache_dir
+        self._counters = _Counters()
+        self._known = set()   # digests seen in the bucket by this process (blobs are never rewritten)
+        self._ref_bodies = {}  # ref key -> (ETag, digest), so a listing only fetches refs that changed
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _key(self, digest):
+        return "%sblobs/%s" % (self.prefix, _check_digest(digest))
+
+    def _ref_key(self, namespace, name=""):
+        return "%srefs/%s/%s" % (self.prefix, namespace, name)
+
+    def _cache_path(self, digest):
+        return os.path.join(self.cache_dir, _check_digest(digest))
+
+    # ---------- blobs ----------
+    def exists(self, digest):
+        if digest in self._known:
+            return True
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._key(digest))
+        except Exception as e:
+            if _not_found(e):
+                return False
+            raise
+        with self._lock:
+            self._known.add(digest)
+        return True
+
+    def _upload(self, digest, path, size):
+        if self.exists(digest):
+            self._counters.add(puts=1, deduplicated=1)
+            return
+        self.client.upload_file(path, self.bucket, self._key(digest))
+        with self._lock:
+            self._known.add(digest)
+        self._counters.add(puts=1, stored_bytes=size)
+
+    def put_upload(self, upload):
+        """Store a SpooledUpload under its digest (kept in the cache too). Returns the digest."""
+        cached = self._cache_path(upload.digest)
+        if os.path.isfile(cached):
+            _touch(cached)
+        else:
+            _copy_atomic(upload.open(), cached)
+        self._upload(upload.digest, cached, upload.size)
+        return upload.digest
+
+    def put_file(self, path, move=False):
+        """Store the file at path (kept in the cache; move=True moves it there). Returns the digest."""
+        digest = file_digest(path)
+        cached = self._cache_path(digest)
+        if os.path.isfile(cached):
+            _touch(cached)
+            if move:
+                os.remove(path)
+        elif move:
+            os.replace(path, cached)
+        else:
+            with open(path, "rb") as src:
+                _copy_atomic(src, cached)
+        self._upload(digest, cached, os.path.getsize(cached))
+        return digest
+
+    def local_path(self, digest):
+        """A cached copy of the blob, downloaded (and checked) on a miss. FileNotFoundError if not stored."""
+        cached = self._cache_path(digest)
+        if os.path.isfile(cached):
+            _touch(cached)
+            self._counters.add(cache_hits=1)
+            return cached
+        tmp = "%s.%s%s" % (cached, uuid.uuid4().hex, _PARTIAL_SUFFIX)
+        try:
+            try:
+                self.client.download_file(self.bucket, self._key(digest), tmp)
+            except Exception as e:
+                if _not_found(e):
+                    raise FileNotFoundError("blob %s is not stored" % digest)
+                raise
+            if file_digest(tmp) != digest:
+                raise IOError("blob %s: downloaded bytes do not match the digest" % digest)
+            size = os.path.getsize(tmp)
+            os.replace(tmp, cached)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        self._counters.add(cache_misses=1, downloaded_bytes=size)
+        return cached
+
+    # ---------- refs ----------
+    def set_ref(self, namespace, name, digest):
+        _check_ref(namespace, name)
+        self.client.put_object(Bucket=self.bucket, Key=self._ref_key(namespace, name),
+                               Body=_check_digest(digest).encode("ascii"))
+
+    def _ref_digest(self, key, etag):
+        """The digest a ref object holds; fetched only when its ETag is not the one seen last."""
+        seen = self._ref_bodies.get(key)
+        if etag and seen is not None and seen[0] == etag:
+            return seen[1]
+        body = self.client.get_object(Bucket=self.bucket, Key=key)["Body"].read()
+        digest = body.decode("ascii", "replace").strip()
+        with self._lock:
+            self._ref_bodies[key] = (etag, digest)
+        return digest
+
+    def refs(self, namespace):
+        """{name: digest} of the refs in namespace (one listing; bodies fetched when they changed)."""
+        out = {}
+        prefix = self._ref_key(namespace)
+        listed = set()
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for item in page.get("Contents", ()):
+                name = item["Key"][len(prefix):]
+                listed.add(item["Key"])
+                try:
+                    digest = self._ref_digest(item["Key"], item.get("ETag"))
+                except Exception as e:
+                    if _not_found(e):
+                        continue   # deleted since it was listed
+                    raise
+                if name and _DIGEST_RE.match(digest):
+                    out[name] = digest
+        with self._lock:
+            for key in [k for k in self._ref_bodies if k.startswith(prefix) and k not in listed]:
+                del self._ref_bodies[key]
+        return out
+
+    def delete_ref(self, namespace, name):
+        _check_ref(namespace, name)
+        self.client.delete_object(Bucket=self.bucket, Key=self._ref_key(namespace, name))
+
+    # ---------- lifecycle ----------
+    def swept_dirs(self):
+        """The cache: evicted copies are downloaded again when needed (the bucket is not swept)."""
+        return [self.cache_dir]
+
+    def pinned_keys(self):
+        return set()
+
+    def stats(self):
+        return dict(self._counters.snapshot(), backend=self.backend, bucket=self.bucket, prefix=self.prefix,
+                    cache_dir=self.cache_dir)
+
+
+def open_store(spec, local_root, cache_dir):
+    """
+    The store for a BMS_BLOB_STORE value: "" / "local" (local_root), "local:<dir>", or
+    "s3://bucket/prefix" (cached in cache_dir; endpoint from BMS_S3_ENDPOINT_URL).
+    """
+    spec = (spec or "").strip()
+    if spec in ("", "local"):
+        return LocalBlobStore(local_root)
+    if spec.startswith("local:"):
+        return LocalBlobStore(spec[len("local:"):])
+    if spec.startswith("s3://"):
+        bucket, _slash, prefix = spec[len("s3://"):].partition("/")
+        if not bucket:
+            raise ValueError("BMS_BLOB_STORE=%s: no bucket" % spec)
+        return S3BlobStore(bucket, prefix, cache_dir, endpoint_url=os.environ.get("BMS_S3_ENDPOINT_URL", "").strip())
+    raise ValueError("BMS_BLOB_STORE=%s: expected local, local:<dir> or s3://bucket/prefix" % spec)
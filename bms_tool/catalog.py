@@ -0,0 +1,235 @@
+"""
+SQLite catalog of generated artifacts: tables, merge outputs and saved templates, with
+their digests, sizes and owning sessions.
+
+    catalog = Catalog("uploads/catalog.sqlite3", on_create=backfill)
+    catalog.add(table_id, "table", key=table_id, digest=version, size=n, rows=len(df))
+    catalog.set_session_tables(session_id, [table_id, ...])   # what step 1 lists for the session
+    catalog.session_tables(session_id)
+    catalog.get(table_id, "table")                            # None: unknown id, no file probing
+
+Every lookup goes through an index (id, session, kind, digest, file key). The database is
+opened on first use, one connection per thread and process, in WAL mode so gunicorn
+workers read while one writes. on_create(catalog) runs once, when the file is created,
+to register artifacts that already exist on disk.
+
+key is the artifact key of the files (bms_tool.lifecycle.artifact_key), so the
+sweeper can forget an artifact when it deletes its files.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+ARTIFACT_KINDS = ("table", "output", "template")
+SCHEMA_VERSION = 1
+# Session last-seen times are rewritten at most this often (seconds)
+_SESSION_TOUCH_INTERVAL = 30
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS artifacts (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    key TEXT,
+    session_id TEXT,
+    listed INTEGER NOT NULL DEFAULT 0,
+    seq INTEGER NOT NULL DEFAULT 0,
+    digest TEXT,
+    bytes INTEGER,
+    rows INTEGER,
+    created REAL NOT NULL,
+    meta TEXT
+);
+CREATE INDEX IF NOT EXISTS artifacts_session ON artifacts (session_id, listed, seq);
+CREATE INDEX IF NOT EXISTS artifacts_kind ON artifacts (kind, created);
+CREATE INDEX IF NOT EXISTS artifacts_digest ON artifacts (digest);
+CREATE INDEX IF NOT EXISTS artifacts_key ON artifacts (key);
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    last_seen REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_last_seen ON sessions (last_seen);
+"""
+
+_COLUMNS = ("id", "kind", "key", "session_id", "listed", "seq", "digest", "bytes", "rows", "created", "meta")
+
+
+def _row(values):
+    if values is None:
+        return None
+    row = dict(zip(_COLUMNS, values))
+    row["meta"] = json.loads(row["meta"]) if row["meta"] else {}
+    return row
+
+
+class Catalog:
+    """The catalog database at path (safe to share between threads and forked processes)."""
+
+    def __init__(self, path, on_create=None):
+        self.path = path
+        self.on_create = on_create
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._ready_pid = None
+
+    # ---------- connection ----------
+    def _conn(self):
+        local = self._local
+        if getattr(local, "pid", None) != os.getpid():
+            # First use in this thread, or in a process forked after the parent connected
+            local.conn = self._connect()
+            local.pid = os.getpid()
+        return local.conn
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        with self._init_lock:
+            if self._ready_pid != os.getpid():
+                self._create(conn)
+                self._ready_pid = os.getpid()
+        return conn
+
+    def _create(self, conn):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            created = conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION
+            if created:
+                for statement in _SCHEMA.split(";"):
+                    if statement.strip():
+                        conn.execute(statement)
+                conn.execute("PRAGMA user_version = %d" % SCHEMA_VERSION)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if created and self.on_create is not None:
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+            self.on_create(self)
+
+    def _write(self, statements):
+        """Run [(sql, params)] in one write transaction."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for sql, params in statements:
+                conn.execute(sql, params)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    # ---------- artifacts ----------
+    def add(self, artifact_id, kind, key=None, session_id=None, digest=None, size=None, rows=None, meta=None):
+        """
+        Record an artifact, or update the digest, size, rows and meta of a known one (its session
+        and place in the session's list stay). Returns artifact_id.
+        """
+        self._write([(
+            "INSERT INTO artifacts (id, kind, key, session_id, digest, bytes, rows, created, meta)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT (id) DO UPDATE SET digest = excluded.digest, bytes = excluded.bytes,"
+            " rows = excluded.rows, meta = excluded.meta",
+            (artifact_id, kind, key, session_id, digest, size, rows, time.time(),
+             json.dumps(meta) if meta else None),
+        )])
+        return artifact_id
+
+    def add_many(self, items):
+        """add() without updates for many artifacts at once: items of (id, kind, key, digest, size)."""
+        now = time.time()
+        self._write([
+            ("INSERT OR IGNORE INTO artifacts (id, kind, key, digest, bytes, created) VALUES (?, ?, ?, ?, ?, ?)",
+             (artifact_id, kind, key, digest, size, now))
+            for artifact_id, kind, key, digest, size in items
+        ])
+
+    def get(self, artifact_id, kind=None):
+        """The artifact as a dict (meta decoded), or None when unknown (or of another kind)."""
+        if not artifact_id:
+            return None
+        row = _row(self._conn().execute(
+            "SELECT %s FROM artifacts WHERE id = ?" % ", ".join(_COLUMNS), (str(artifact_id),)).fetchone())
+        if row is None or (kind is not None and row["kind"] != kind):
+            return None
+        return row
+
+    def find_digest(self, kind, digest):
+        """ids of the artifacts of kind with this digest, oldest first."""
+        return [r[0] for r in self._conn().execute(
+            "SELECT id FROM artifacts WHERE digest = ? AND kind = ? ORDER BY created", (digest, kind))]
+
+    def forget(self, artifact_id):
+        self._write([("DELETE FROM artifacts WHERE id = ?", (artifact_id,))])
+
+    def forget_key(self, key):
+        """Drop the artifacts whose files (artifact key) were deleted."""
+        self._write([("DELETE FROM artifacts WHERE key = ?", (key,))])
+
+    # ---------- sessions ----------
+    def set_session_tables(self, session_id, table_ids):
+        """The session now lists exactly these tables, in this order (unknown ids are ignored)."""
+        statements = [
+            ("UPDATE artifacts SET listed = 0 WHERE session_id = ? AND listed = 1", (session_id,)),
+            ("INSERT INTO sessions (id, last_seen) VALUES (?, ?)"
+             " ON CONFLICT (id) DO UPDATE SET last_seen = excluded.last_seen", (session_id, time.time())),
+        ]
+        for seq, table_id in enumerate(table_ids):
+            statements.append(("UPDATE artifacts SET session_id = ?, listed = 1, seq = ? WHERE id = ? AND kind = 'table'",
+                               (session_id, seq, table_id)))
+        self._write(statements)
+
+    def add_session_table(self, session_id, table_id):
+        """Append a table to the session's list."""
+        seq = self._conn().execute("SELECT COALESCE(MAX(seq) + 1, 0) FROM artifacts WHERE session_id = ? AND listed = 1",
+                                   (session_id,)).fetchone()[0]
+        self._write([
+            ("UPDATE artifacts SET session_id = ?, listed = 1, seq = ? WHERE id = ? AND kind = 'table'",
+             (session_id, seq, table_id)),
+            ("INSERT INTO sessions (id, last_seen) VALUES (?, ?)"
+             " ON CONFLICT (id) DO UPDATE SET last_seen = excluded.last_seen", (session_id, time.time())),
+        ])
+
+    def session_tables(self, session_id):
+        """ids of the tables the session lists, in order."""
+        return [r[0] for r in self._conn().execute(
+            "SELECT id FROM artifacts WHERE session_id = ? AND listed = 1 AND kind = 'table' ORDER BY seq",
+            (session_id,))]
+
+    def touch_session(self, session_id):
+        """The session is alive (rewritten at most every _SESSION_TOUCH_INTERVAL seconds)."""
+        now = time.time()
+        self._write([(
+            "INSERT INTO sessions (id, last_seen) VALUES (?, ?)"
+            " ON CONFLICT (id) DO UPDATE SET last_seen = excluded.last_seen WHERE last_seen < ?",
+            (session_id, now, now - _SESSION_TOUCH_INTERVAL),
+        )])
+
+    def pinned_keys(self, seen_since):
+        """Artifact keys listed by sessions seen at or after seen_since (never evicted)."""
+        return {r[0] for r in self._conn().execute(
+            "SELECT a.key FROM sessions s JOIN artifacts a ON a.session_id = s.id"
+            " WHERE s.last_seen >= ? AND a.listed = 1", (seen_since,))}
+
+    def expire_sessions(self, seen_before):
+        """Forget sessions not seen since seen_before (their tables are no longer pinned, their lists stay)."""
+        self._write([("DELETE FROM sessions WHERE last_seen < ?", (seen_before,))])
+
+    def live_sessions(self, seen_since):
+        return self._conn().execute("SELECT COUNT(*) FROM sessions WHERE last_seen >= ?", (seen_since,)).fetchone()[0]
+
+    # ---------- stats ----------
+    def stats(self):
+        """Artifacts and bytes per kind, sessions, and artifacts that share a digest."""
+        conn = self._conn()
+        kinds = {kind: {"artifacts": n, "bytes": size or 0} for kind, n, size in conn.execute(
+            "SELECT kind, COUNT(*), SUM(bytes) FROM artifacts GROUP BY kind")}
+        duplicates = conn.execute(
+            "SELECT COALESCE(SUM(n - 1), 0) FROM (SELECT COUNT(*) AS n FROM artifacts"
+            " WHERE digest IS NOT NULL GROUP BY kind, digest HAVING n > 1)").fetchone()[0]
+        sessions = conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        return {"kinds": kinds, "sessions": sessions, "duplicate_artifacts": duplicates}
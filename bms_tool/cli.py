@@ -0,0 +1,324 @@
+"""
+Headless command line for batch jobs (no web server):
+
+    python -m bms_tool extract "schedules/*.xlsx" -o tables --jobs 4
+    python -m bms_tool merge --drawing "drawings/*.svg" --table tables/AHU1_t1.xlsx -o merged --left-column SYSTEM
+    python -m bms_tool delta merged/AHU1.svg --old-table tables/AHU1_t1.xlsx --table AHU1_rev2.xlsx -o AHU1_rev2.svg --left-column SYSTEM
+    python -m bms_tool loadtest --workers 1,2,4 --users 16
+    python -m bms_tool watch inbox -o outbox --jobs 4 --left-column SYSTEM
+    python -m bms_tool svgdiff reference.svg candidate.svg
+    python -m bms_tool regress --check baseline
+
+On Windows, bms-tool.bat in the repo root runs the same thing (bms-tool extract ...).
+
+extract writes <workbook>_t<N>.svg and <workbook>_t<N>.xlsx for every table found.
+merge pairs drawings with tables: one table is merged into every drawing, one drawing
+gets every table, otherwise drawings and tables are paired by file name stem
+(AHU1.svg + AHU1.xlsx, or AHU1_t1.xlsx for the first table of AHU1). With --pair points
+each table goes to the drawing sharing the most point ids with it instead. Each file is
+timed; --jobs runs files in parallel processes. delta updates one merged drawing for a
+revised table and prints the added / removed / changed points. loadtest drives the web
+routes with concurrent simulated users (see bms_tool.loadtest). watch processes workbooks
+and drawings as they are dropped into an inbox folder (see bms_tool.watch). svgdiff
+compares two drawings after normalizing how they are written (see bms_tool.svgdiff);
+regress merges the drawings of uploads/ through every merge path and compares the
+outputs (see bms_tool.regress).
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+def _expand(patterns):
+    """Files matching the glob patterns, in order, without duplicates."""
+    seen = set()
+    out = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True)) or ([pattern] if os.path.isfile(pattern) else [])
+        if not matches:
+            print("warning: no files match %s" % pattern, file=sys.stderr)
+        for path in matches:
+            key = os.path.abspath(path)
+            if key not in seen and os.path.isfile(path):
+                seen.add(key)
+                out.append(path)
+    return out
+
+
+def _stem(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+# ---------- jobs (module level so they pickle for --jobs) ----------
+def _extract_job(path, out_dir, sheet, excel, grid=False):
+    from bms_tool import api
+    started = time.perf_counter()
+    tables = api.extract_tables(path, sheet=sheet)
+    written = []
+    for i, df in enumerate(tables, start=1):
+        written.extend(api.write_table(df, out_dir, "%s_t%d" % (_stem(path), i), excel=excel, grid=grid))
+    return "%d tables, %d files" % (len(tables), len(written)), time.perf_counter() - started
+
+
+def _merge_job(drawing, table, output, options):
+    from bms_tool import api
+    started = time.perf_counter()
+    report = api.merge(drawing, table, output, **options)
+    return "-> %s (%d bytes)" % (output, report["bytes"]), time.perf_counter() - started
+
+
+def _run(jobs, workers):
+    """Run (label, fn, args) jobs, printing one timing line per job. Returns the number that failed."""
+    started = time.perf_counter()
+    failed = 0
+
+    def report(label, result=None, error=None):
+        if error is None:
+            detail, seconds = result
+            print("%8.2fs  ok    %s %s" % (seconds, label, detail))
+        else:
+            print("          FAIL  %s: %s" % (label, error))
+
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(fn, *args): label for label, fn, args in jobs}
+            for fut in as_completed(futures):
+                try:
+                    report(futures[fut], fut.result())
+                except Exception as e:
+                    failed += 1
+                    report(futures[fut], error=e)
+    else:
+        for label, fn, args in jobs:
+            try:
+                report(label, fn(*args))
+            except Exception as e:
+                failed += 1
+                report(label, error=e)
+    print("%d files, %d failed, %.2fs total" % (len(jobs), failed, time.perf_counter() - started))
+    return failed
+
+
+# ---------- commands ----------
+def cmd_extract(args):
+    paths = _expand(args.workbooks)
+    if not paths:
+        print("error: no workbooks", file=sys.stderr)
+        return 2
+    sheet = int(args.sheet) if str(args.sheet).isdigit() else args.sheet
+    jobs = [(p, _extract_job, (p, args.output, sheet, not args.no_excel, args.table_grid)) for p in paths]
+    return 1 if _run(jobs, args.jobs) else 0
+
+
+def _pair(drawings, tables):
+    """[(drawing, table)] for the merge command; unmatched drawings are reported and skipped."""
+    if len(tables) == 1:
+        return [(d, tables[0]) for d in drawings]
+    if len(drawings) == 1:
+        return [(drawings[0], t) for t in tables]
+    by_stem = {}
+    for t in tables:
+        by_stem.setdefault(_stem(t), t)
+        by_stem.setdefault(_stem(t).rsplit("_t", 1)[0], t)
+    pairs = []
+    for d in drawings:
+        t = by_stem.get(_stem(d))
+        if t is None:
+            print("warning: no table for %s" % d, file=sys.stderr)
+            continue
+        pairs.append((d, t))
+    return pairs
+
+
+def _pair_by_points(drawings, tables, point_column):
+    """[(drawing, table)]: each table with the drawing that shares the most point ids (see template_index)."""
+    from bms_tool import api
+    from bms_tool.drawing import table_point_ids
+    from bms_tool.template_index import invert, rank_templates, scan_template
+    entries = {d: scan_template(d) for d in drawings}
+    inverted = invert(entries)
+    pairs = []
+    for t in tables:
+        ranked = rank_templates(entries, inverted, table_point_ids(api.load_table(t), point_column))
+        if not ranked:
+            print("warning: no drawing shares a point with %s" % t, file=sys.stderr)
+            continue
+        best = ranked[0]
+        print("pair     %s -> %s (%d/%d points)" % (t, best["template"], best["matched"], best["table_points"]))
+        pairs.append((best["template"], t))
+    return pairs
+
+
+def cmd_merge(args):
+    from bms_tool.prune import prune_kinds
+    drawings = _expand(args.drawing)
+    tables = _expand(args.table)
+    if args.pair == "points":
+        pairs = _pair_by_points(drawings, tables, args.point_column)
+    else:
+        pairs = _pair(drawings, tables)
+    if not pairs:
+        print("error: nothing to merge", file=sys.stderr)
+        return 2
+    os.makedirs(args.output, exist_ok=True)
+    options = {
+        "point_column": args.point_column,
+        "display_column": args.display_column,
+        "left_column": args.left_column,
+        "right_column": args.right_column,
+        "compact": args.compact,
+        "table_grid": args.table_grid,
+        "prune": prune_kinds(args.prune),
+    }
+    jobs = []
+    for d, t in pairs:
+        name = _stem(d) if len(tables) == 1 and args.pair == "name" else "%s__%s" % (_stem(d), _stem(t))
+        output = os.path.join(args.output, name + ".svg")
+        jobs.append(("%s + %s" % (d, t), _merge_job, (d, t, output, options)))
+    return 1 if _run(jobs, args.jobs) else 0
+
+
+def cmd_delta(args):
+    from bms_tool import api
+    from bms_tool.prune import prune_kinds
+    started = time.perf_counter()
+    report = api.merge_delta(args.previous, args.old_table, args.table, args.output,
+                             point_column=args.point_column, display_column=args.display_column,
+                             left_column=args.left_column, right_column=args.right_column, compact=args.compact,
+                             table_grid=args.table_grid, prune=prune_kinds(args.prune))
+    changes = report["changes"]
+    for label in ("added", "removed"):
+        if changes[label]:
+            print("%-8s %s" % (label, ", ".join(changes[label])))
+    for item in changes["changed"]:
+        print("changed  %s: %s" % (item["point"], "; ".join(
+            "%s %r -> %r" % (col, old, new) for col, (old, new) in item["columns"].items())))
+    print("%d point groups, %d images updated, table %s; %d unchanged points" % (
+        report["groups_updated"], report["images_updated"],
+        "rewritten" if report["table_updated"] else "unchanged", changes["unchanged"]))
+    print("%.2fs  -> %s (%d bytes)" % (time.perf_counter() - started, args.output, report["bytes"]))
+    return 0
+
+
+def cmd_loadtest(args):
+    from bms_tool import loadtest
+    return loadtest.main(args)
+
+
+def cmd_watch(args):
+    from bms_tool import watch
+    return watch.main(args)
+
+
+def cmd_svgdiff(args):
+    from bms_tool import svgdiff
+    return svgdiff.main(args)
+
+
+def cmd_regress(args):
+    from bms_tool import regress
+    return regress.main(args)
+
+
+def _add_column_options(p):
+    p.add_argument("--point-column", default="POINT")
+    p.add_argument("--display-column")
+    p.add_argument("--left-column")
+    p.add_argument("--right-column")
+    p.add_argument("--compact", action="store_true", help="compact SVG output (see BMS_COMPACT_OUTPUT)")
+    p.add_argument("--table-grid", action="store_true", help="draw the table as grid paths (see BMS_TABLE_GRID)")
+    p.add_argument("--prune", default="", metavar="KINDS",
+                   help="leave out hidden,defs,groups (comma-separated, or all; see BMS_PRUNE)")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="bms-tool", description="BMS Point Tool without the web server.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("extract", help="split workbooks into table SVG/XLSX files")
+    p.add_argument("workbooks", nargs="+", help="Excel files or glob patterns")
+    p.add_argument("-o", "--output", default="tables", help="output directory (default: tables)")
+    p.add_argument("--sheet", default="0", help="sheet index or name (default: 0)")
+    p.add_argument("--no-excel", action="store_true", help="write only the table SVGs")
+    p.add_argument("--table-grid", action="store_true", help="draw the tables as grid paths (see BMS_TABLE_GRID)")
+    p.add_argument("--jobs", type=int, default=1, help="parallel processes (default: 1)")
+    p.set_defaults(func=cmd_extract)
+
+    p = sub.add_parser("merge", help="merge tables into drawings")
+    p.add_argument("--drawing", nargs="+", required=True, help="SVG drawings or glob patterns")
+    p.add_argument("--table", nargs="+", required=True, help="table .xlsx/.csv/.json files or glob patterns")
+    p.add_argument("-o", "--output", default="merged", help="output directory (default: merged)")
+    p.add_argument("--pair", choices=("name", "points"), default="name",
+                   help="pair drawings and tables by file name (default) or by shared point ids")
+    _add_column_options(p)
+    p.add_argument("--jobs", type=int, default=1, help="parallel processes (default: 1)")
+    p.set_defaults(func=cmd_merge)
+
+    p = sub.add_parser("delta", help="update a merged drawing for a revised table")
+    p.add_argument("previous", help="merged drawing (output of merge)")
+    p.add_argument("--old-table", required=True, help="table the previous drawing was merged with")
+    p.add_argument("--table", required=True, help="revised table")
+    p.add_argument("-o", "--output", required=True, help="output SVG file")
+    _add_column_options(p)
+    p.set_defaults(func=cmd_delta)
+
+    p = sub.add_parser("loadtest", help="drive the web routes with concurrent simulated users")
+    target = p.add_mutually_exclusive_group()
+    target.add_argument("--url", help="server to test (default: the app in this process, via the test client)")
+    target.add_argument("--workers", metavar="N,N,...", help="start the server with each worker count in turn")
+    p.add_argument("--server-cmd", default=None,
+                   help="command that starts the server, with {workers} and {port} (default: gunicorn)")
+    p.add_argument("--users", type=int, default=8, help="simulated users at once (default: 8)")
+    p.add_argument("--rounds", type=int, default=3, help="upload/preview/edit/merge rounds per user (default: 3)")
+    p.add_argument("--merges", type=int, default=1, help="merges per round (default: 1)")
+    p.add_argument("--points", type=int, default=12, help="rows per synthetic table (default: 12)")
+    p.add_argument("--tables", type=int, default=2, help="tables per synthetic workbook (default: 2)")
+    p.add_argument("--template", help="merge into this saved template instead of uploading a drawing")
+    p.add_argument("--json", help="also write the reports to this JSON file")
+    p.set_defaults(func=cmd_loadtest)
+
+    p = sub.add_parser("watch", help="process workbooks and drawings dropped into an inbox folder")
+    p.add_argument("inbox", help="folder to watch")
+    p.add_argument("-o", "--output", default="outbox", help="output directory (default: outbox)")
+    p.add_argument("--templates", metavar="DIR",
+                   help="merge workbooks without a drawing into the best-matching template of DIR")
+    p.add_argument("--sheet", default="0", help="sheet index or name (default: 0)")
+    p.add_argument("--jobs", type=int, default=1, help="parallel processes (default: 1)")
+    p.add_argument("--settle", type=float, default=2.0,
+                   help="seconds a file must stay unchanged before it is read (default: 2)")
+    p.add_argument("--interval", type=float, default=2.0, help="seconds between inbox scans (default: 2)")
+    p.add_argument("--once", action="store_true", help="process what is in the inbox, then exit")
+    _add_column_options(p)
+    p.set_defaults(func=cmd_watch)
+
+    p = sub.add_parser("svgdiff", help="compare two SVG files, ignoring how they are written")
+    p.add_argument("reference")
+    p.add_argument("candidate")
+    p.add_argument("--places", type=int, default=3, help="decimals numbers are compared to (default: 3)")
+    p.add_argument("--limit", type=int, default=50, help="differences to report, 0 = all (default: 50)")
+    p.set_defaults(func=cmd_svgdiff)
+
+    p = sub.add_parser("regress", help="merge the drawings of uploads/ through every merge path and compare")
+    p.add_argument("--uploads", default="uploads", help="folder with the corpus drawings (default: uploads)")
+    p.add_argument("--paths", default="reference,streaming,compiled",
+                   help="merge paths to run (default: reference,streaming,compiled)")
+    record = p.add_mutually_exclusive_group()
+    record.add_argument("--record", metavar="DIR", help="keep this tree's reference outputs in DIR")
+    record.add_argument("--check", metavar="DIR", help="compare every path with the outputs recorded in DIR")
+    p.add_argument("--only", metavar="REGEX", help="only the cases whose name matches")
+    p.add_argument("--places", type=int, default=3, help="decimals numbers are compared to (default: 3)")
+    p.add_argument("--json", help="also write the results to this JSON file")
+    p.set_defaults(func=cmd_regress)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,335 @@
+"""
+Compiled templates: a saved drawing turned once into Visio-ready output bytes with slots,
+so a merge only fills the slots and appends the table.
+
+    merge_template("uploads/svg_templates/AHU_1.svg", df, "out.svg", left_column="SYSTEM")
+
+compile_template() runs update_svg's pipeline on the drawing without a table. Everything
+a table cannot change is serialized once, with the Visio fixups applied and embedded SVG
+images already converted. What a table can change becomes a slot:
+
+    label    a point label group (data-ui1 / data-ui2): copied, filled and serialized per merge
+    image    an image in a point group: its visible and hidden forms are prepared when compiling
+             (as <use> when compact output shares its payload); a merge picks one
+    table    the appended table
+
+merge_template() keeps up to COMPILED_TEMPLATES compiled drawings per process and compiles
+a drawing again when its file changes; precompile() fills that cache ahead of time. The
+output is the same as update_svg's. Merges with prune, and drawings large enough to be
+streamed, go through update_svg.
+"""
+import collections
+import io
+import os
+import re
+import threading
+import uuid
+import xml.etree.ElementTree as ET
+
+from bms_tool.drawing import (
+    DRAWING_TRANSFORM,
+    _fill_point_labels,
+    _is_group,
+    _is_point_image,
+    _is_point_label_group,
+    _normalize_point_id,
+    _point_maps,
+    _set_point_image,
+    append_full_excel_table,
+    update_svg,
+)
+from bms_tool.guard import parse_svg
+from bms_tool.prune import prune_kinds
+from bms_tool.stream import STREAMING_MIN_BYTES, _point_id
+from bms_tool.svg import svg_tag
+from bms_tool.visio import (
+    SHARED_IMAGE_ID_PREFIX,
+    XML_DECLARATION,
+    _dedupe_images,
+    _serialize_visio_svg,
+    _used_namespaces,
+    apply_visio_fixups,
+    declare_namespaces,
+    image_use,
+    prepare_visio_root,
+    repeated_images,
+    size_report,
+    style_element_css,
+    write_element,
+)
+
+# Compiled drawings kept per process, least recently used dropped first (env: BMS_COMPILED_TEMPLATES, 0 = off)
+COMPILED_TEMPLATES = int(os.environ.get("BMS_COMPILED_TEMPLATES", "").strip() or 8)
+
+# Placeholder elements standing in for the slots while the static parts are serialized
+_MARKER = "bms-slot-%s-" % uuid.uuid4().hex[:12]
+_MARKER_RE = re.compile(b"<" + _MARKER.encode("ascii") + rb"(\d+)/>")
+
+
+def _local(el):
+    return el.tag.split("}")[-1]
+
+
+def _is_image(el):
+    return _local(el) == "image" or _is_point_image(el)
+
+
+def _copy(el, variants, images):
+    """Copy of the subtree el (attribute values shared); images with prepared forms are noted in images."""
+    new = ET.Element(el.tag, dict(el.attrib))
+    new.text = el.text
+    new.tail = el.tail
+    if el in variants:
+        images[new] = variants[el]
+    for child in el:
+        new.append(_copy(child, variants, images))
+    return new
+
+
+def _show_images(el, point, maps):
+    # As update_svg: an image takes the state of its innermost point group
+    point = _point_id(el) or point
+    if point is not None and _is_point_image(el):
+        _set_point_image(el, point, maps)
+    for child in el:
+        _show_images(child, point, maps)
+
+
+class _Slot:
+    __slots__ = ("indent", "el", "point", "variants")
+
+    def __init__(self, indent, el=None, point=None, variants=None):
+        self.indent = indent
+        self.el = el                    # the subtree before fixups (None: the table)
+        self.point = point              # innermost point group around it
+        self.variants = variants or {}  # image in el -> {visibility: (element to write, compact saving)}
+
+
+class CompiledTemplate:
+    """A drawing compiled by compile_template(); render() writes one merge."""
+
+    def __init__(self, segments, slots, stats, css_map):
+        self.segments = segments   # static bytes; slot i goes between segments[i] and segments[i + 1]
+        self.slots = slots
+        self.stats = stats         # compact counters of the static parts, or None
+        self.css_map = css_map
+
+    def render(self, df, output_svg, point_column="POINT", display_column=None,
+               left_column=None, right_column=None, table_grid=False):
+        """Write the merge of df (update_svg's output); returns its size report."""
+        maps = _point_maps(df, point_column, display_column, left_column, right_column)
+        stats = dict(self.stats) if self.stats is not None else None
+        with open(output_svg, "wb") as f:
+            f.write(self.segments[0])
+            for slot, segment in zip(self.slots, self.segments[1:]):
+                if slot.el is None:
+                    el = append_full_excel_table(ET.Element(svg_tag("svg")), df, grid=table_grid)
+                    if el is not None:
+                        for node in el.iter():
+                            apply_visio_fixups(node, self.css_map)
+                else:
+                    el = self._fill(slot, maps, stats)
+                if el is not None:
+                    write_element(el, f, slot.indent, stats)
+                f.write(segment)
+            size = f.tell()
+        return size_report(size, stats)
+
+    def _fill(self, slot, maps, stats):
+        images = {}
+        el = _copy(slot.el, slot.variants, images)
+        for g in el.iter():
+            if _is_group(g) and _is_point_label_group(g):
+                _fill_point_labels(g, _normalize_point_id(g.get("id").strip().upper()), maps)
+        _show_images(el, slot.point, maps)
+        for node in el.iter():
+            if node not in images:
+                apply_visio_fixups(node, self.css_map)
+
+        def prepared(image):
+            out, saving = images[image][image.get("visibility")]
+            if stats is not None:
+                stats["images"] += saving
+            return out
+
+        if el in images:
+            return prepared(el)
+        for parent in list(el.iter()):
+            for index, child in enumerate(parent):
+                if child in images:
+                    parent[index] = prepared(child)
+        return el
+
+
+def _find_slots(parent, point, depth, found):
+    """(parent, index, element, point, depth) of the label groups and point images, outermost only."""
+    for index, child in enumerate(parent):
+        child_point = _point_id(child) or point
+        if (_is_group(child) and _is_point_label_group(child)) or (child_point is not None and _is_point_image(child)):
+            found.append((parent, index, child, point, depth + 1))
+        else:
+            _find_slots(child, child_point, depth + 1, found)
+
+
+def _image_points(el, point, out):
+    """{image in el: its innermost point group (None outside point groups)}."""
+    point = _point_id(el) or point
+    if _is_image(el):
+        out[el] = point if _is_point_image(el) else None
+    for child in el:
+        _image_points(child, point, out)
+    return out
+
+
+def compile_template(svg_path, compact=False):
+    """Compile the drawing at svg_path for merges with the given compact setting."""
+    src = parse_svg(svg_path).getroot()
+    # update_svg empties the drawing's root and moves its children under one transformed group
+    root = ET.Element(src.tag)
+    drawing_group = ET.SubElement(root, svg_tag("g"), {"transform": DRAWING_TRANSFORM})
+    for child in list(src):
+        drawing_group.append(child)
+    prepare_visio_root(root)
+    css_map = {}
+    for el in root.iter():
+        if _local(el) == "style":
+            css_map = style_element_css(el)
+            break
+    namespaces = _used_namespaces(root)
+
+    found = []
+    _find_slots(drawing_group, None, 1, found)
+    png_cache = {}
+    slots = []
+    in_tree = {}   # image in the compiled tree -> (slot, image in slot.el)
+    for _parent, _index, el, point, depth in found:
+        raw = _copy(el, {}, {})
+        slot = _Slot(depth, raw, point)
+        for image, image_point in _image_points(raw, point, {}).items():
+            if image_point is None:
+                values = (image.get("visibility"),)
+            else:
+                values = ("visible", "hidden")
+            forms = {}
+            for value in values:
+                probe = ET.Element(image.tag, dict(image.attrib))
+                if image_point is not None:
+                    probe.set("visibility", value)
+                apply_visio_fixups(probe, css_map, png_cache)
+                probe.tail = image.tail
+                for k, v in probe.attrib.items():
+                    # The visible and hidden forms share one copy of the payload
+                    for other, _saving in forms.values():
+                        if other.attrib.get(k) == v:
+                            probe.attrib[k] = other.attrib[k]
+                forms[value] = (probe, 0)
+            slot.variants[image] = forms
+        for tree_node, raw_node in zip(el.iter(), raw.iter()):
+            if raw_node in slot.variants:
+                in_tree[tree_node] = (slot, raw_node)
+        slots.append(slot)
+
+    for el in root.iter():
+        apply_visio_fixups(el, css_map, png_cache)
+    declare_namespaces(root, *namespaces)
+
+    stats = None
+    if compact:
+        stats = {"whitespace": 0, "numbers": 0, "images": 0}
+        for n, items in enumerate(repeated_images(root)):
+            ref_id = f"{SHARED_IMAGE_ID_PREFIX}{n + 1}"
+            for _parent, _index, image, href_keys in items:
+                if image not in in_tree:
+                    continue
+                # A slot image's saving depends on its form; it is counted when rendered
+                scratch = {"images": 0}
+                image_use(image, href_keys, ref_id, scratch)
+                stats["images"] -= scratch["images"]
+                slot, raw_image = in_tree[image]
+                forms = slot.variants[raw_image]
+                for value, (form, _saving) in list(forms.items()):
+                    scratch = {"images": 0}
+                    use = image_use(form, href_keys, ref_id, scratch)
+                    forms[value] = (use, scratch["images"])
+        _dedupe_images(root, stats)
+
+    for i, (parent, index, _el, _point, _depth) in enumerate(found):
+        marker = ET.Element(_MARKER + str(i))
+        marker.tail = parent[index].tail
+        parent[index] = marker
+    root.append(ET.Element(_MARKER + str(len(found))))
+    slots.append(_Slot(1))
+
+    buf = io.BytesIO()
+    buf.write(XML_DECLARATION)
+    _serialize_visio_svg(root, buf, is_root=True, compact=stats)
+    parts = _MARKER_RE.split(buf.getvalue())
+    segments = parts[0::2]
+    assert [int(i) for i in parts[1::2]] == list(range(len(slots)))
+    for i, slot in enumerate(slots):
+        # The markers' own indentation and newline are written by the slots
+        indent = "  " * slot.indent
+        if stats is None:
+            segments[i] = segments[i][:len(segments[i]) - len(indent)]
+            segments[i + 1] = segments[i + 1][1:]
+        else:
+            stats["whitespace"] -= len(indent) + 1
+    return CompiledTemplate(segments, slots, stats, css_map)
+
+
+class _Cache:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()   # (path, compact) -> ((size, mtime), CompiledTemplate)
+        self._lock = threading.Lock()
+
+    def get(self, svg_path, compact):
+        st = os.stat(svg_path)
+        key = (os.path.abspath(svg_path), bool(compact))
+        stamp = (st.st_size, st.st_mtime_ns)
+        with self._lock:
+            hit = self._entries.get(key)
+            if hit is not None and hit[0] == stamp:
+                self._entries.move_to_end(key)
+                return hit[1]
+        compiled = compile_template(svg_path, compact)
+        with self._lock:
+            self._entries[key] = (stamp, compiled)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return compiled
+
+
+_cache = _Cache(COMPILED_TEMPLATES)
+
+
+def precompile(svg_paths, compact=False):
+    """
+    Compile drawings into this process's cache now, e.g. before a server forks its workers
+    (up to COMPILED_TEMPLATES; drawings that would be streamed or do not parse are skipped).
+    Returns how many were compiled.
+    """
+    done = 0
+    for path in svg_paths:
+        if done >= COMPILED_TEMPLATES:
+            break
+        try:
+            if os.path.getsize(path) >= STREAMING_MIN_BYTES:
+                continue
+            _cache.get(path, compact)
+        except (OSError, ET.ParseError):
+            continue
+        done += 1
+    return done
+
+
+def merge_template(svg_path, df, output_svg, point_column="POINT", display_column=None,
+                   left_column=None, right_column=None, compact=False, table_grid=False, prune=()):
+    """update_svg for a saved template, from its compiled form; same output and size report."""
+    if prune_kinds(prune) or COMPILED_TEMPLATES <= 0 or os.path.getsize(svg_path) >= STREAMING_MIN_BYTES:
+        return update_svg(svg_path, df, output_svg, point_column=point_column, display_column=display_column,
+                          left_column=left_column, right_column=right_column, compact=compact,
+                          table_grid=table_grid, prune=prune)
+    compiled = _cache.get(svg_path, compact)
+    return compiled.render(df, output_svg, point_column, display_column, left_column, right_column, table_grid)
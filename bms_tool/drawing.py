@@ -0,0 +1,634 @@
+"""
+Merge a point table into a drawing: match point groups by id, fill the data-ui1 /
+data-ui2 labels (or SPARE), show 24Vac images by SIGNAL, append the Excel table.
+update_svg_delta applies a revised table to a previous output instead of starting
+from the blank drawing.
+"""
+import math
+import os
+import re
+import xml.etree.ElementTree as ET
+
+from bms_tool.guard import parse_svg
+from bms_tool.lazy import pandas
+from bms_tool.svg import SVG_NS
+from bms_tool.visio import SHARED_IMAGE_ID_PREFIX, convert_to_visio_svg, ensure_stroke, hidden_to_display, write_visio_svg
+
+# =================================================
+# COMPACT EXCEL TABLE (merge into drawing)
+# =================================================
+# id of the table group, so a delta merge can find and replace it
+TABLE_GROUP_ID = "bms-excel-table"
+
+
+def append_full_excel_table(root, df, grid=False):
+    """
+    Append the table group (TABLE_GROUP_ID) beside the drawing; None for an empty df.
+    grid=True: grid lines as two <path>s and one <text> per column, instead of a <line>
+    per row and column and a <text> per cell (same look, far fewer elements).
+    """
+    pd = pandas()
+    if df.empty:
+        return None
+    if "viewBox" in root.attrib:
+        vb = list(map(float, root.attrib["viewBox"].split()))
+        svg_width = vb[2]
+    else:
+        svg_width = float(root.attrib.get("width", 1600))
+    row_height = 18
+    header_height = 20
+    title_height = 22
+    padding = 4
+    columns = list(df.columns)
+    col_widths = []
+    for col in columns:
+        max_len = max(
+            [len(str(col))] + [len(str(v)) for v in df[col].astype(str)]
+        )
+        width = max(70, min(max_len * 5, 160))
+        col_widths.append(width)
+    table_width = sum(col_widths)
+    table_height = title_height + header_height + (len(df) * row_height)
+    start_x = svg_width - table_width - 40
+    start_y = 50
+    table = ET.SubElement(root, f"{{{SVG_NS}}}g", {
+        "id": TABLE_GROUP_ID,
+        "transform": f"translate({start_x},{start_y})"
+    })
+    ET.SubElement(table, f"{{{SVG_NS}}}rect", {
+        "x": "0", "y": "0", "width": str(table_width), "height": str(table_height),
+        "fill": "#fff", "stroke": "#000", "stroke-width": "1"
+    })
+    ET.SubElement(table, f"{{{SVG_NS}}}text", {
+        "x": str(table_width / 2), "y": "14", "text-anchor": "middle",
+        "font-size": "9", "font-family": "Arial", "font-weight": "bold"
+    }).text = "Excel Data"
+    ET.SubElement(table, f"{{{SVG_NS}}}rect", {
+        "x": "0", "y": str(title_height), "width": str(table_width),
+        "height": str(header_height), "fill": "#f2f2f2", "stroke": "#000"
+    })
+    if grid:
+        _append_grid_cells(table, df, columns, col_widths, table_width, table_height,
+                           title_height, header_height, row_height, padding)
+        return table
+    x_cursor = 0
+    for i, col in enumerate(columns):
+        ET.SubElement(table, f"{{{SVG_NS}}}line", {
+            "x1": str(x_cursor), "y1": str(title_height),
+            "x2": str(x_cursor), "y2": str(table_height),
+            "stroke": "#000", "stroke-width": "0.8"
+        })
+        ET.SubElement(table, f"{{{SVG_NS}}}text", {
+            "x": str(x_cursor + padding), "y": str(title_height + 14),
+            "font-size": "8", "font-family": "Arial", "font-weight": "bold"
+        }).text = str(col)[:15]
+        x_cursor += col_widths[i]
+    for row_index, row in df.iterrows():
+        y = title_height + header_height + (row_index * row_height)
+        ET.SubElement(table, f"{{{SVG_NS}}}line", {
+            "x1": "0", "y1": str(y), "x2": str(table_width), "y2": str(y),
+            "stroke": "#000", "stroke-width": "0.5"
+        })
+        x_cursor = 0
+        for col_index, col in enumerate(columns):
+            value = str(row[col]) if pd.notna(row[col]) else ""
+            value = value[:18]
+            ET.SubElement(table, f"{{{SVG_NS}}}text", {
+                "x": str(x_cursor + padding), "y": str(y + 12),
+                "font-size": "8", "font-family": "Arial"
+            }).text = value
+            x_cursor += col_widths[col_index]
+    return table
+
+
+def _append_grid_cells(table, df, columns, col_widths, table_width, table_height,
+                       title_height, header_height, row_height, padding):
+    """Column lines, row lines and cell text of append_full_excel_table(grid=True)."""
+    pd = pandas()
+    col_x = [sum(col_widths[:i]) for i in range(len(columns))]
+    row_ys = [title_height + header_height + (row_index * row_height) for row_index in df.index]
+    ET.SubElement(table, f"{{{SVG_NS}}}path", {
+        "d": " ".join(f"M{x} {title_height}V{table_height}" for x in col_x),
+        "fill": "none", "stroke": "#000", "stroke-width": "0.8"
+    })
+    header = ET.SubElement(table, f"{{{SVG_NS}}}text", {
+        "font-size": "8", "font-family": "Arial", "font-weight": "bold"
+    })
+    for x, col in zip(col_x, columns):
+        ET.SubElement(header, f"{{{SVG_NS}}}tspan", {
+            "x": str(x + padding), "y": str(title_height + 14)
+        }).text = str(col)[:15]
+    if row_ys:
+        ET.SubElement(table, f"{{{SVG_NS}}}path", {
+            "d": " ".join(f"M0 {y}H{table_width}" for y in row_ys),
+            "fill": "none", "stroke": "#000", "stroke-width": "0.5"
+        })
+    for x, col in zip(col_x, columns):
+        text = None
+        for y, value in zip(row_ys, df[col]):
+            value = str(value)[:18] if pd.notna(value) else ""
+            if not value.strip():
+                continue
+            if text is None:
+                text = ET.SubElement(table, f"{{{SVG_NS}}}text", {"font-size": "8", "font-family": "Arial"})
+            # Strip: a leading space inside a shared <text> would shift the cell (a lone <text> drops it)
+            ET.SubElement(text, f"{{{SVG_NS}}}tspan", {"x": str(x + padding), "y": str(y + 12)}).text = value.strip()
+
+# =================================================
+# UPDATE SVG: point matching + table merge + optional column value at point
+# =================================================
+def _point_to_value_map(df, point_column, display_column):
+    """Map normalized point id -> value from display_column for that row."""
+    pd = pandas()
+    if not display_column or display_column not in df.columns:
+        return {}
+    pc = point_column if point_column in df.columns else df.columns[0]
+    out = {}
+    for _, row in df.iterrows():
+        pt = str(row.get(pc, "")).strip().upper()
+        if not pt:
+            continue
+        pt_norm = _normalize_point_id(pt)
+        if not pt_norm:
+            continue
+        val = row[display_column]
+        out[pt_norm] = "" if pd.isna(val) else str(val).strip()
+    return out
+
+
+def _normalize_point_id(pid):
+    """Normalize for matching: remove spaces/dashes so BI 1, BI-1, BI1 all match."""
+    if pid is None or (isinstance(pid, float) and math.isnan(pid)):
+        return ""
+    s = str(pid).strip().upper()
+    s = re.sub(r"[\s\-]+", "", s)
+    return s
+
+
+def _point_to_left_right_map(df, point_column, left_column, right_column):
+    """Maps normalized point id -> (left_value, right_value) for matching rows."""
+    pd = pandas()
+    pc = point_column if point_column in df.columns else df.columns[0]
+    left_col = left_column if left_column and left_column in df.columns else None
+    right_col = right_column if right_column and right_column in df.columns else None
+    if not left_col and not right_col:
+        return {}
+    out = {}
+    for _, row in df.iterrows():
+        pt = str(row.get(pc, "")).strip().upper()
+        if not pt:
+            continue
+        pt_norm = _normalize_point_id(pt)
+        if not pt_norm:
+            continue
+        lv = "" if not left_col or pd.isna(row.get(left_col)) else str(row[left_col]).strip()
+        rv = "" if not right_col or pd.isna(row.get(right_col)) else str(row[right_col]).strip()
+        out[pt_norm] = (lv, rv)
+    return out
+
+
+# Fixed IDs for left/right data placement (user-specified)
+LEFT_DATA_ID = "data-ui1"
+RIGHT_DATA_ID = "data-ui2"
+# Image (e.g. id="24Vac" or "bo1-image") visible only when point matches AND SIGNAL has 24Vac
+
+
+def _row_contains_24vac(row):
+    """True if any cell in the row contains '24' and 'vac' (case-insensitive)."""
+    pd = pandas()
+    for v in row.values:
+        s = str(v).strip().lower() if pd.notna(v) else ""
+        if "24" in s and "vac" in s:
+            return True
+    return False
+
+
+def _signal_has_24vac(signal_val):
+    """True if signal value contains '24' and 'vac' (case-insensitive)."""
+    s = (str(signal_val or "").strip()).lower()
+    return "24" in s and "vac" in s
+
+
+def _normalize_signal_for_match(s):
+    """Normalize signal string for matching with image id: lower, strip, remove spaces."""
+    if s is None or (isinstance(s, float) and math.isnan(s)):
+        return ""
+    return str(s).strip().lower().replace(" ", "")
+
+
+def _signal_matches_image_id(signal_val, image_id):
+    """True when signal value matches the image id (e.g. '24Vac' matches '24Vac' or '24 VAC'); '0-10V' does not."""
+    sig = _normalize_signal_for_match(signal_val)
+    img = _normalize_signal_for_match(image_id)
+    if not sig or not img:
+        return False
+    if sig == img or img in sig or sig in img:
+        return True
+    # Image id "24Vac": show when signal contains 24 and vac
+    if "24" in img and "vac" in img and "24" in sig and "vac" in sig:
+        return True
+    # Image id like "bo1-image" or "bo2-image": treat as 24Vac symbol, show when signal has 24Vac
+    if img.endswith("image") and "24" in sig and "vac" in sig:
+        return True
+    return False
+
+
+def _get_signal_column(df):
+    """Return SIGNAL column name if present (case-insensitive)."""
+    for col in df.columns:
+        if str(col).strip().upper() == "SIGNAL":
+            return col
+    return None
+
+
+def _point_to_signal_map(df, point_column):
+    """Maps normalized point id -> SIGNAL column value (string). Only when SIGNAL column exists."""
+    pc = point_column if point_column in df.columns else df.columns[0]
+    signal_col = _get_signal_column(df)
+    if signal_col is None:
+        return {}
+    out = {}
+    for _, row in df.iterrows():
+        pt = str(row.get(pc, "")).strip()
+        if not pt:
+            continue
+        pt_norm = _normalize_point_id(pt)
+        if not pt_norm:
+            continue
+        out[pt_norm] = row.get(signal_col)
+    return out
+
+
+def _point_has_24vac_map(df, point_column):
+    """Maps normalized point id -> True if that row contains '24 VAC' in any column."""
+    pc = point_column if point_column in df.columns else df.columns[0]
+    out = {}
+    for _, row in df.iterrows():
+        pt = str(row.get(pc, "")).strip()
+        if not pt:
+            continue
+        pt_norm = _normalize_point_id(pt)
+        if not pt_norm:
+            continue
+        if _row_contains_24vac(row):
+            out[pt_norm] = True
+    return out
+
+
+def _find_by_id(container, id_val):
+    """Return first element under container (self or descendant) with id attribute == id_val."""
+    id_val = (id_val or "").strip()
+    if not id_val:
+        return None
+    for el in container.iter():
+        if (el.get("id") or "").strip() == id_val:
+            return el
+    return None
+
+
+def _get_label_text_elements(g):
+    """Return list of text elements in g that are labels (not - or +), sorted by x position (left to right)."""
+    candidates = []
+    for text_el in g.findall(".//{%s}text" % SVG_NS):
+        cur = (text_el.text or "").strip()
+        if cur in ("-", "+"):
+            continue
+        x = float(text_el.get("x", 0))
+        candidates.append((x, text_el))
+    candidates.sort(key=lambda x: x[0])
+    return [t for _, t in candidates]
+
+
+def _get_point_name_and_left_right_slots(g):
+    """
+    Point name = text with text-anchor="middle" (inside the box) – never touch.
+    Left slots = non–point-name texts with x < point_name_x (1). Right slots = x > point_name_x (1).
+    Returns (point_name_el or None, left_slots_list, right_slots_list).
+    """
+    texts = _get_label_text_elements(g)
+    if not texts:
+        return None, [], []
+    middle = None
+    others = []
+    for t in texts:
+        if (t.get("text-anchor") or "").lower() == "middle":
+            middle = t
+        else:
+            others.append(t)
+    if not others:
+        return middle, [], []
+    others_sorted = sorted(others, key=lambda t: float(t.get("x", 0)))
+    mid_x = float(middle.get("x", 0)) if middle is not None else None
+    if mid_x is not None:
+        left_slots = [t for t in others_sorted if float(t.get("x", 0)) < mid_x][:1]
+        right_slots = [t for t in others_sorted if float(t.get("x", 0)) > mid_x][:1]
+    else:
+        n = len(others_sorted)
+        left_slots = others_sorted[:1]
+        right_slots = others_sorted[-1:] if n > 1 and others_sorted[-1] is not others_sorted[0] else []
+    return middle, left_slots, right_slots
+
+
+def _set_point_label_left_right(g, left_value, right_value):
+    """Set left value in id=data-ui1, right value in id=data-ui2. Fallback to position-based slots if IDs not found."""
+    left_val = (left_value or "").strip()
+    right_val = (right_value or "").strip()
+    left_el = _find_by_id(g, LEFT_DATA_ID)
+    right_el = _find_by_id(g, RIGHT_DATA_ID)
+    if left_el is not None:
+        left_el.text = left_val
+    if right_el is not None:
+        right_el.text = right_val
+    if left_el is not None and right_el is not None:
+        return
+    _point_name_el, left_slots, right_slots = _get_point_name_and_left_right_slots(g)
+    for el in left_slots:
+        el.text = left_val
+    for el in right_slots:
+        el.text = right_val
+    if not left_slots and not right_slots:
+        pass
+    elif not left_slots and right_slots:
+        if left_val and right_val:
+            right_slots[0].text = (left_val + "  " + right_val).strip()
+        elif left_val:
+            right_slots[0].text = left_val
+    elif left_slots and not right_slots:
+        if left_val and right_val:
+            left_slots[0].text = (left_val + "  " + right_val).strip()
+        elif right_val:
+            left_slots[0].text = right_val
+
+
+def _set_point_label_spare(g):
+    """If point name does not match Excel: find id=data-ui1 and id=data-ui2 in this <g>, replace their text with SPARE."""
+    spare = "SPARE"
+    for el in g.iter():
+        eid = (el.get("id") or "").strip()
+        if eid != LEFT_DATA_ID and eid != RIGHT_DATA_ID:
+            continue
+        el.text = spare
+        for child in list(el):
+            el.remove(child)
+
+
+def _is_group(el):
+    tag = el.tag if hasattr(el.tag, "endswith") else str(el.tag)
+    return tag == "g" or tag.endswith("}g")
+
+
+def _group_has_data_ui(grp):
+    return any(
+        (el.get("id") or "").strip() in (LEFT_DATA_ID, RIGHT_DATA_ID)
+        for el in grp.iter()
+    )
+
+
+def _is_point_label_group(g):
+    """<g id> with data-ui1/data-ui2 and no nested <g id> that also has them (leaf point group)."""
+    if not g.get("id") or not _group_has_data_ui(g):
+        return False
+    for child in g:
+        if _is_group(child) and child.get("id") and _group_has_data_ui(child):
+            return False
+    return True
+
+
+# The original drawing is placed under one <g> with this transform, the table beside it
+DRAWING_TRANSFORM = "translate(40,120) scale(0.7)"
+POINT_PATTERN = re.compile(r"^(UI|AI|DI|AO|DO|BO|BI|NODE)[\w\-]+$", re.IGNORECASE)
+
+
+def table_point_ids(df, point_column="POINT"):
+    """Normalized point ids of a table (point_column, else its first column)."""
+    # Match point ID with Excel (normalized: BI 1, BI-1, BI1 all match)
+    pc = point_column if point_column in df.columns else df.columns[0]
+    ids = set(_normalize_point_id(v) for v in df[pc].dropna().astype(str))
+    ids.discard("")
+    return ids
+
+
+def _point_maps(df, point_column, display_column, left_column, right_column):
+    """Everything the drawing needs from the table, keyed by normalized point id."""
+    pc = point_column if point_column in df.columns else df.columns[0]
+    return {
+        "ids": table_point_ids(df, point_column),
+        "left_right": _point_to_left_right_map(df, point_column, left_column, right_column),
+        "value": _point_to_value_map(df, point_column, display_column) if display_column else {},
+        # Image visible only when: point name matches AND row SIGNAL value matches the image id (e.g. "24Vac")
+        "signal": _point_to_signal_map(df, pc),
+    }
+
+
+def _fill_point_labels(g, gid_norm, maps):
+    """Point in the table: print its column data in data-ui1/data-ui2; else SPARE."""
+    if gid_norm in maps["ids"]:
+        if gid_norm in maps["left_right"]:
+            left_val, right_val = maps["left_right"][gid_norm]
+            _set_point_label_left_right(g, left_val, right_val)
+        elif gid_norm in maps["value"]:
+            _set_point_label_left_right(g, maps["value"][gid_norm], "")
+        else:
+            _set_point_label_left_right(g, "", "")
+    else:
+        _set_point_label_spare(g)
+
+
+def _is_point_image(el):
+    tag = el.tag if hasattr(el.tag, "endswith") else str(el.tag)
+    if tag == "image" or tag.endswith("}image"):
+        return True
+    # Compact output replaces repeated images with <use> of a shared one (same id and attributes)
+    if tag != "use" and not tag.endswith("}use"):
+        return False
+    href = next((v for k, v in el.attrib.items() if k.split("}")[-1] == "href"), "")
+    return href.startswith("#" + SHARED_IMAGE_ID_PREFIX)
+
+
+def _set_point_image(img_el, gid_norm, maps):
+    """Show an image of point group gid_norm only when the point's SIGNAL matches the image id."""
+    point_signal = maps["signal"].get(gid_norm) if gid_norm in maps["ids"] else None
+    image_id = (img_el.get("id") or "").strip()
+    show_image = (
+        gid_norm in maps["ids"]
+        and _signal_matches_image_id(point_signal, image_id)
+    )
+    img_el.set("visibility", "visible" if show_image else "hidden")
+
+
+def _set_point_images(g, gid_norm, maps):
+    """_set_point_image for every image in a point group. Returns the images."""
+    images = [el for el in g.iter() if _is_point_image(el)]
+    for img_el in images:
+        _set_point_image(img_el, gid_norm, maps)
+    return images
+
+
+def update_svg(svg_path, df, output_svg, point_column="POINT", display_column=None,
+               left_column=None, right_column=None, compact=False, table_grid=False, prune=(), streaming=None):
+    """
+    Merge df into the drawing at svg_path and write output_svg; returns convert_to_visio_svg's size report.
+    table_grid: compact table markup (see append_full_excel_table).
+    prune: what to drop from the output (bms_tool.prune kinds, e.g. ("hidden",) for unmatched images).
+    streaming: None = stream drawings of bms_tool.stream.STREAMING_MIN_BYTES or more; True/False to force.
+    """
+    from bms_tool import stream
+    if streaming is None:
+        streaming = os.path.getsize(svg_path) >= stream.STREAMING_MIN_BYTES
+    if streaming:
+        return stream.stream_update_svg(svg_path, df, output_svg, point_column, display_column,
+                                        left_column, right_column, compact, table_grid, prune)
+    tree = parse_svg(svg_path)
+    root = tree.getroot()
+    maps = _point_maps(df, point_column, display_column, left_column, right_column)
+
+    # 1) Every leaf <g> with id that has data-ui1/data-ui2: match id with Excel point → print column data; else SPARE
+    for g in root.iter():
+        if not _is_group(g) or not _is_point_label_group(g):
+            continue
+        _fill_point_labels(g, _normalize_point_id(g.get("id").strip().upper()), maps)
+
+    # 2) Image visibility (24Vac): only for groups matching point pattern
+    for g in root.findall(".//{%s}g" % SVG_NS):
+        gid = g.get("id")
+        if not gid:
+            continue
+        gid_clean = (gid or "").strip().upper()
+        if not POINT_PATTERN.match(gid_clean):
+            continue
+        _set_point_images(g, _normalize_point_id(gid_clean), maps)
+    if "viewBox" in root.attrib:
+        vb = list(map(float, root.attrib["viewBox"].split()))
+        width, height = vb[2], vb[3]
+    else:
+        width = float(root.attrib.get("width", 1600))
+        height = float(root.attrib.get("height", 1000))
+    new_width = width + 350
+    new_height = height + 120
+    root.set("viewBox", f"0 0 {new_width} {new_height}")
+    root.set("width", str(new_width))
+    root.set("height", str(new_height))
+    drawing_group = ET.Element(f"{{{SVG_NS}}}g", {
+        "transform": DRAWING_TRANSFORM
+    })
+    for child in list(root):
+        drawing_group.append(child)
+    root.clear()
+    root.append(drawing_group)
+    append_full_excel_table(root, df, grid=table_grid)
+    tree.write(output_svg, encoding="utf-8", xml_declaration=True)
+    return convert_to_visio_svg(output_svg, output_svg, compact=compact, prune=prune)
+
+
+# =================================================
+# DELTA MERGE: apply a revised table to a previous output
+# =================================================
+def _table_records(df, point_column):
+    """{normalized point id: {column: value}}; a later row for the same point wins, as in the merge maps."""
+    pd = pandas()
+    pc = str(point_column if point_column in df.columns else df.columns[0])
+    cols = [str(c) for c in df.columns]
+    out = {}
+    for values in df.itertuples(index=False, name=None):
+        rec = {c: ("" if pd.isna(v) else str(v).strip()) for c, v in zip(cols, values)}
+        pid = _normalize_point_id(rec.get(pc, ""))
+        if pid:
+            out[pid] = rec
+    return out
+
+
+def diff_tables(old_df, new_df, point_column="POINT"):
+    """Points added, removed and changed (with old/new value per column) between two tables."""
+    old = _table_records(old_df, point_column)
+    new = _table_records(new_df, point_column)
+    changed = []
+    for pid in sorted(old.keys() & new.keys()):
+        columns = {
+            c: [old[pid].get(c, ""), new[pid].get(c, "")]
+            for c in sorted(old[pid].keys() | new[pid].keys())
+            if old[pid].get(c, "") != new[pid].get(c, "")
+        }
+        if columns:
+            changed.append({"point": pid, "columns": columns})
+    return {
+        "added": sorted(new.keys() - old.keys()),
+        "removed": sorted(old.keys() - new.keys()),
+        "changed": changed,
+        "unchanged": len(old.keys() & new.keys()) - len(changed),
+    }
+
+
+def _same_table(old_df, new_df):
+    pd = pandas()
+    if [str(c) for c in old_df.columns] != [str(c) for c in new_df.columns] or len(old_df) != len(new_df):
+        return False
+    a = old_df.astype(object).where(pd.notna(old_df), "").astype(str).values.tolist()
+    b = new_df.astype(object).where(pd.notna(new_df), "").astype(str).values.tolist()
+    return a == b
+
+
+def _find_table_group(root):
+    """The table group appended by update_svg: by TABLE_GROUP_ID, else (older outputs) the last top-level <g>."""
+    groups = [child for child in root if _is_group(child)]
+    for g in groups:
+        if g.get("id") == TABLE_GROUP_ID:
+            return g
+    # update_svg writes [drawing group, table group]; with one group there is no table
+    return groups[-1] if len(groups) > 1 else None
+
+
+def update_svg_delta(previous_svg, old_df, new_df, output_svg, point_column="POINT", display_column=None,
+                     left_column=None, right_column=None, compact=False, table_grid=False, prune=()):
+    """
+    Apply a revised table (new_df) to previous_svg, an output of update_svg for old_df made
+    with the same column options, and write output_svg. Only the point groups of added,
+    removed and changed points and the appended table are rewritten; the rest of the
+    document is serialized as it was (no CSS inlining or image conversion again).
+    previous_svg must not have been pruned with "hidden": its hidden images are gone.
+    Returns the size report plus "changes" (diff_tables) and what was updated.
+    """
+    changes = diff_tables(old_df, new_df, point_column)
+    affected = set(changes["added"]) | set(changes["removed"]) | {c["point"] for c in changes["changed"]}
+    tree = parse_svg(previous_svg)
+    root = tree.getroot()
+    maps = _point_maps(new_df, point_column, display_column, left_column, right_column)
+    counts = {"groups_updated": 0, "images_updated": 0}
+
+    def walk(el, in_affected):
+        # Images take the state of their innermost point group (update_svg sets them in document
+        # order), so groups nested in an affected point group are redone too
+        for child in el:
+            if not _is_group(child):
+                walk(child, in_affected)
+                continue
+            gid_clean = (child.get("id") or "").strip().upper()
+            gid_norm = _normalize_point_id(gid_clean)
+            is_affected = bool(gid_norm) and gid_norm in affected
+            if is_affected and _is_point_label_group(child):
+                _fill_point_labels(child, gid_norm, maps)
+                counts["groups_updated"] += 1
+            is_point = bool(gid_clean) and POINT_PATTERN.match(gid_clean) is not None
+            if is_point and (is_affected or in_affected):
+                for img_el in _set_point_images(child, gid_norm, maps):
+                    # The previous output stores hidden images as display="none"
+                    img_el.attrib.pop("display", None)
+                    hidden_to_display(img_el)
+                    counts["images_updated"] += 1
+            walk(child, in_affected or (is_point and is_affected))
+
+    if affected:
+        walk(root, False)
+
+    table_updated = not _same_table(old_df, new_df)
+    if table_updated:
+        old_table = _find_table_group(root)
+        if old_table is not None:
+            root.remove(old_table)
+        table = append_full_excel_table(root, new_df, grid=table_grid)
+        if table is not None:
+            for el in table.iter():
+                ensure_stroke(el)
+
+    report = write_visio_svg(root, output_svg, compact=compact, prune=prune)
+    report.update(counts, changes=changes, table_updated=table_updated)
+    return report
@@ -0,0 +1,303 @@
+"""
+Parsing with budgets for uploaded drawings and workbooks: one pathological file fails fast
+with a clear error instead of pinning a worker's CPU or memory.
+
+    tree = parse_svg(path_or_file)                            # ET.parse, checked while it reads
+    for event, el in iterparse_svg(path, ("start", "end")):   # ET.iterparse, same checks
+        ...
+    raw = read_excel(path_or_file, sheet_name=0, header=None) # pd.read_excel, same result
+
+Budgets (env, 0 = no limit):
+
+    BMS_MAX_SVG_BYTES            drawing file size (default 50 MB, also the upload cap)
+    BMS_MAX_SVG_ELEMENTS         elements in a drawing (default 2,000,000)
+    BMS_MAX_SVG_DEPTH            element nesting depth (default 256)
+    BMS_MAX_IMAGE_BYTES          one embedded image as written in the file (default 20 MB)
+    BMS_MAX_PARSE_SECONDS        reading one drawing (default 60)
+    BMS_MAX_EXCEL_BYTES          workbook file size (default 25 MB, also the upload cap)
+    BMS_MAX_XLSX_UNPACKED_BYTES  an .xlsx once unzipped (default 256 MB)
+    BMS_MAX_SHEET_ROWS           rows of a sheet (default 100,000)
+    BMS_MAX_SHEET_COLUMNS        columns of a sheet (default 1,024)
+
+Drawings may declare plain internal entities (Illustrator declares its namespaces that
+way), but not external entities or entities built from other entities, which is how
+"billion laughs" files expand. The prolog is checked before the drawing is parsed. The
+time budget is checked while a drawing is read; a workbook read cannot be interrupted, so
+its unpacked size and rows bound it instead (pandas stops reading after the row budget).
+
+A broken budget raises ParseLimitExceeded (a ValueError) naming it. stats() counts the
+parses and refusals of this process and the largest value seen per budget (/parse-stats).
+"""
+import os
+import re
+import threading
+import time
+import xml.etree.ElementTree as ET
+import zipfile
+from xml.parsers import expat
+
+
+def _env_number(name, default):
+    try:
+        value = float(os.environ.get(name, "").strip() or default)
+    except (ValueError, TypeError):
+        return default
+    return int(value) if value.is_integer() else value
+
+
+LIMITS = {
+    "svg_bytes": _env_number("BMS_MAX_SVG_BYTES", 50 * 1024 * 1024),
+    "svg_elements": _env_number("BMS_MAX_SVG_ELEMENTS", 2000000),
+    "svg_depth": _env_number("BMS_MAX_SVG_DEPTH", 256),
+    "image_bytes": _env_number("BMS_MAX_IMAGE_BYTES", 20 * 1024 * 1024),
+    "parse_seconds": _env_number("BMS_MAX_PARSE_SECONDS", 60),
+    "excel_bytes": _env_number("BMS_MAX_EXCEL_BYTES", 25 * 1024 * 1024),
+    "xlsx_unpacked_bytes": _env_number("BMS_MAX_XLSX_UNPACKED_BYTES", 256 * 1024 * 1024),
+    "sheet_rows": _env_number("BMS_MAX_SHEET_ROWS", 100000),
+    "sheet_columns": _env_number("BMS_MAX_SHEET_COLUMNS", 1024),
+}
+
+_DESCRIPTIONS = {
+    "svg_bytes": "bytes",
+    "svg_elements": "elements",
+    "svg_depth": "levels of nesting",
+    "image_bytes": "bytes in one embedded image",
+    "parse_seconds": "seconds to read",
+    "excel_bytes": "bytes",
+    "xlsx_unpacked_bytes": "bytes unpacked",
+    "sheet_rows": "rows",
+    "sheet_columns": "columns",
+    "entities": "entity declarations it may not use (external, or built from other entities)",
+}
+# The time budget is checked every this many elements
+_CLOCK_EVERY = 1024
+_ENTITY_REFERENCE = re.compile(r"[&%][A-Za-z_:]")
+
+
+class ParseLimitExceeded(ValueError):
+    """A drawing or workbook broke a parsing budget (limit: a LIMITS key, or "entities")."""
+
+    def __init__(self, filename, limit, value=None, budget=None):
+        self.filename = filename
+        self.limit = limit
+        self.value = value
+        self.budget = budget
+        what = _DESCRIPTIONS.get(limit, limit)
+        if budget is None:
+            message = "%s has %s." % (filename or "The file", what)
+        else:
+            message = "%s has more than %s %s (BMS_MAX_%s)." % (filename or "The file", budget, what, limit.upper())
+        super().__init__(message)
+
+    def __reduce__(self):
+        # Crosses the heavy-work process pool (app.run_heavy)
+        return (type(self), (self.filename, self.limit, self.value, self.budget))
+
+
+# =================================================
+# METRICS
+# =================================================
+_lock = threading.Lock()
+_parsed = {"svg": 0, "excel": 0}
+_refused = {}
+_largest = {}
+
+
+def _observe(kind, **values):
+    with _lock:
+        _parsed[kind] += 1
+        for name, value in values.items():
+            if value > _largest.get(name, 0):
+                _largest[name] = value
+
+
+def _refuse(filename, limit, value=None):
+    with _lock:
+        _refused[limit] = _refused.get(limit, 0) + 1
+    raise ParseLimitExceeded(filename, limit, value, LIMITS.get(limit))
+
+
+def stats():
+    """Budgets, parses and refusals per budget of this process, and the largest value seen per budget."""
+    with _lock:
+        return {
+            "limits": dict(LIMITS),
+            "parsed": dict(_parsed),
+            "refused": dict(_refused),
+            "largest": dict(_largest),
+        }
+
+
+# =================================================
+# SOURCES (path or binary file object)
+# =================================================
+def _name(source, name):
+    if name:
+        return name
+    if isinstance(source, (str, os.PathLike)):
+        return os.path.basename(source)
+    return os.path.basename(str(getattr(source, "name", "") or "")) or None
+
+
+def _size(source):
+    if isinstance(source, (str, os.PathLike)):
+        return os.path.getsize(source)
+    position = source.tell()
+    size = source.seek(0, os.SEEK_END)
+    source.seek(position)
+    return size - position
+
+
+def _chunks(source, chunk_size=64 * 1024):
+    """The bytes of source in chunks; a file object is put back where it was."""
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+    position = source.tell()
+    try:
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+    finally:
+        source.seek(position)
+
+
+def _check_bytes(source, filename, limit):
+    size = _size(source)
+    if LIMITS[limit] and size > LIMITS[limit]:
+        _refuse(filename, limit, size)
+    return size
+
+
+# =================================================
+# SVG
+# =================================================
+class _RootReached(Exception):
+    pass
+
+
+def _check_prolog(source, filename):
+    """Refuse external entities and entities that reference others (parses up to the root element)."""
+    parser = expat.ParserCreate()
+
+    def entity(name, is_parameter, value, base, system_id, public_id, notation):
+        if is_parameter or system_id or public_id or notation or _ENTITY_REFERENCE.search(value or ""):
+            _refuse(filename, "entities")
+
+    def root(name, attrs):
+        raise _RootReached()
+
+    parser.EntityDeclHandler = entity
+    parser.StartElementHandler = root
+    chunks = _chunks(source)
+    try:
+        for chunk in chunks:
+            parser.Parse(chunk, False)
+        parser.Parse(b"", True)
+    except _RootReached:
+        pass
+    except expat.ExpatError:
+        pass   # malformed files fail in the real parse, with its error
+    finally:
+        chunks.close()   # puts a file object back at its start
+
+
+def iterparse_svg(source, events=("end",), name=None):
+    """ET.iterparse(source, events) that raises ParseLimitExceeded when the drawing breaks a budget."""
+    filename = _name(source, name)
+    size = _check_bytes(source, filename, "svg_bytes")
+    _check_prolog(source, filename)
+    max_elements, max_depth = LIMITS["svg_elements"], LIMITS["svg_depth"]
+    max_image, max_seconds = LIMITS["image_bytes"], LIMITS["parse_seconds"]
+    want_start, want_end = "start" in events, "end" in events
+    started = time.monotonic()
+    elements = depth = deepest = largest_image = 0
+    for event, el in ET.iterparse(source, events=("start", "end")):
+        if event == "start":
+            elements += 1
+            depth += 1
+            if depth > deepest:
+                deepest = depth
+                if max_depth and depth > max_depth:
+                    _refuse(filename, "svg_depth", depth)
+            if max_elements and elements > max_elements:
+                _refuse(filename, "svg_elements", elements)
+            if el.tag.endswith("image"):
+                href = el.get("{http://www.w3.org/1999/xlink}href") or el.get("href") or ""
+                if len(href) > largest_image:
+                    largest_image = len(href)
+                    if max_image and largest_image > max_image:
+                        _refuse(filename, "image_bytes", largest_image)
+            if max_seconds and not elements % _CLOCK_EVERY and time.monotonic() - started > max_seconds:
+                _refuse(filename, "parse_seconds", round(time.monotonic() - started, 1))
+            if want_start:
+                yield event, el
+        else:
+            depth -= 1
+            if want_end:
+                yield event, el
+    _observe("svg", svg_bytes=size, svg_elements=elements, svg_depth=deepest, image_bytes=largest_image,
+             parse_seconds=round(time.monotonic() - started, 3))
+
+
+def parse_svg(source, name=None):
+    """ET.parse(source) within the budgets."""
+    root = None
+    for _event, el in iterparse_svg(source, ("start",), name=name):
+        if root is None:
+            root = el
+    return ET.ElementTree(root)
+
+
+def check_svg(source, name=None):
+    """Raise ParseLimitExceeded if the drawing breaks a budget (nothing is kept)."""
+    for _event, el in iterparse_svg(source, ("end",), name=name):
+        el.clear()
+
+
+# =================================================
+# EXCEL
+# =================================================
+def _unpacked_bytes(source):
+    """Total uncompressed size of an .xlsx (zip), or None for other formats (.xls)."""
+    try:
+        if isinstance(source, (str, os.PathLike)):
+            with zipfile.ZipFile(source) as z:
+                return sum(i.file_size for i in z.infolist())
+        position = source.tell()
+        try:
+            with zipfile.ZipFile(source) as z:
+                return sum(i.file_size for i in z.infolist())
+        finally:
+            source.seek(position)
+    except zipfile.BadZipFile:
+        return None
+
+
+def read_excel(source, name=None, **kwargs):
+    """pandas.read_excel(source, **kwargs) within the budgets (one sheet)."""
+    from bms_tool.lazy import pandas
+    filename = _name(source, name)
+    size = _check_bytes(source, filename, "excel_bytes")
+    unpacked = _unpacked_bytes(source)
+    if unpacked and LIMITS["xlsx_unpacked_bytes"] and unpacked > LIMITS["xlsx_unpacked_bytes"]:
+        _refuse(filename, "xlsx_unpacked_bytes", unpacked)
+    max_rows, max_columns = LIMITS["sheet_rows"], LIMITS["sheet_columns"]
+    if max_rows and kwargs.get("nrows") is None:
+        kwargs["nrows"] = max_rows + 1   # one more row tells a sheet at the budget from one over it
+    started = time.monotonic()
+    df = pandas().read_excel(source, **kwargs)
+    rows, columns = df.shape
+    if max_rows and rows > max_rows:
+        _refuse(filename, "sheet_rows", rows)
+    if max_columns and columns > max_columns:
+        _refuse(filename, "sheet_columns", columns)
+    _observe("excel", excel_bytes=size, xlsx_unpacked_bytes=unpacked or 0, sheet_rows=rows, sheet_columns=columns,
+             parse_seconds=round(time.monotonic() - started, 3))
+    return df
@@ -0,0 +1,90 @@
+"""
+Import-time budget check for worker boot.
+
+    python -m bms_tool.importtime                  # app, 400 ms budget
+    python -m bms_tool.importtime --budget-ms 250 --module app --runs 5
+
+Imports the module in a fresh interpreter with `python -X importtime`, prints the
+slowest imports, and exits with status 1 when the best run is over budget or a heavy
+dependency (pandas, openpyxl, cairosvg, lxml, ...) was imported at module load.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+# Must stay behind bms_tool.lazy accessors, never imported by `import app`
+HEAVY_MODULES = ("pandas", "numpy", "openpyxl", "cairosvg", "cairocffi", "lxml")
+BUDGET_MS = 400.0
+
+
+def measure(module, cwd=None):
+    """
+    One cold import of module. Returns (total_us, rows) where rows are
+    (cumulative_us, self_us, dotted_name) for every import, as reported by -X importtime.
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import %s" % module],
+        cwd=cwd, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError("import %s failed:\n%s" % (module, proc.stderr[-2000:]))
+    rows = []
+    total_us = None
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3:
+            continue
+        try:
+            self_us, cumulative_us = int(parts[0]), int(parts[1])
+        except ValueError:
+            continue
+        name = parts[2]
+        dotted = name.strip()
+        rows.append((cumulative_us, self_us, dotted))
+        # The requested module is the only top-level (least indented) line with its name
+        if dotted == module and name.startswith(" ") and not name.startswith("   "):
+            total_us = cumulative_us
+    if total_us is None:
+        total_us = max((r[0] for r in rows), default=0)
+    return total_us, rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fail when importing the app exceeds its time budget.")
+    parser.add_argument("--module", default="app", help="module to import (default: app)")
+    parser.add_argument("--budget-ms", type=float, default=BUDGET_MS,
+                        help="max import time in ms (default: %.0f)" % BUDGET_MS)
+    parser.add_argument("--runs", type=int, default=3, help="cold imports to run; the fastest counts (default: 3)")
+    parser.add_argument("--top", type=int, default=10, help="slowest imports to list (default: 10)")
+    args = parser.parse_args(argv)
+
+    cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    best = None
+    for _ in range(max(1, args.runs)):
+        total_us, rows = measure(args.module, cwd=cwd)
+        if best is None or total_us < best[0]:
+            best = (total_us, rows)
+    total_us, rows = best
+
+    print("import %s: %.1f ms (budget %.0f ms, best of %d)" % (args.module, total_us / 1000.0, args.budget_ms, args.runs))
+    for cumulative_us, self_us, name in sorted(rows, reverse=True)[: args.top]:
+        print("  %9.1f ms  %9.1f ms self  %s" % (cumulative_us / 1000.0, self_us / 1000.0, name))
+
+    failed = False
+    heavy = sorted({name.split(".")[0] for _, _, name in rows} & set(HEAVY_MODULES))
+    if heavy:
+        print("FAIL: heavy modules imported at load: %s (use bms_tool.lazy accessors)" % ", ".join(heavy))
+        failed = True
+    if total_us / 1000.0 > args.budget_ms:
+        print("FAIL: over budget by %.1f ms" % (total_us / 1000.0 - args.budget_ms))
+        failed = True
+    if not failed:
+        print("OK")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,83 @@
+"""
+Heavy dependencies loaded on first use, so a worker boots (and answers /health)
+without paying for pandas, openpyxl or cairosvg.
+
+    pd = pandas()          # imports pandas the first time, then returns the cached module
+    cs = cairosvg()        # None when cairosvg or the cairo library is missing
+
+warm_up() imports everything on a background thread, so the first real upload or
+merge does not wait for the imports either.
+"""
+import importlib
+import threading
+
+_lock = threading.Lock()   # guards _locks and the warm-up thread
+_locks = {}                # module name -> lock held while that module is imported
+_modules = {}
+_MISSING = object()
+_warm_up_thread = None
+
+# Imported by warm_up(), in this order
+WARM_UP_MODULES = ("pandas", "openpyxl", "cairosvg")
+
+
+def _module_lock(name):
+    with _lock:
+        return _locks.setdefault(name, threading.Lock())
+
+
+def _load(name):
+    mod = _modules.get(name)
+    if mod is None:
+        # One lock per module: a request needing pandas does not wait behind warm_up's other imports
+        with _module_lock(name):
+            mod = _modules.get(name)
+            if mod is None:
+                try:
+                    mod = importlib.import_module(name)
+                except (ImportError, OSError):
+                    # OSError: cairosvg installed but the native cairo library is not
+                    mod = _MISSING
+                _modules[name] = mod
+    return None if mod is _MISSING else mod
+
+
+def pandas():
+    """The pandas module (required dependency)."""
+    mod = _load("pandas")
+    if mod is None:
+        raise ImportError("pandas is required: pip install -r requirements.txt")
+    return mod
+
+
+def openpyxl():
+    """The openpyxl module (Excel engine used by pandas), or None if not installed."""
+    return _load("openpyxl")
+
+
+def cairosvg():
+    """The cairosvg module, or None when it (or the cairo library) is unavailable."""
+    return _load("cairosvg")
+
+
+def boto3():
+    """The boto3 module (S3 blob store, see bms_tool.blobstore), or None if not installed."""
+    return _load("boto3")
+
+
+def warm_up(background=True):
+    """Import WARM_UP_MODULES now (background=False) or once on a daemon thread."""
+    global _warm_up_thread
+
+    def run():
+        for name in WARM_UP_MODULES:
+            _load(name)
+
+    if not background:
+        run()
+        return
+    with _lock:
+        if _warm_up_thread is not None:
+            return
+        _warm_up_thread = threading.Thread(target=run, name="bms-warm-up", daemon=True)
+    _warm_up_thread.start()
@@ -0,0 +1,223 @@
+"""
+Artifact lifecycle for generated files (TEMP_DIR, uploads/output, stored uploads).
+
+Files are grouped by artifact key: "<uuid>.svg" and "<uuid>.xlsx" of one table share the
+key "<uuid>" and are kept or evicted together. A background sweeper removes groups that
+were not used for ttl_seconds, then evicts least-recently-used groups while the total
+size is over quota_bytes. Tables listed in a live session (touched within
+session_ttl_seconds) are never evicted.
+
+"Last used" is the newest file mtime in the group; touch() bumps it, so use by any
+worker process counts, not only use seen by this process. With a catalog
+(bms_tool.catalog), live sessions and their tables are read from it, so every worker
+sees them, and evicted artifacts are removed from it. pinned() may name more keys that are
+never evicted (blobs that saved templates point to, see bms_tool.blobstore).
+"""
+import os
+import threading
+import time
+
+# Files being written (see bms_tool.uploads.SpooledUpload.save_to) are never evicted
+_PARTIAL_SUFFIX = ".part"
+
+
+def artifact_key(filename):
+    """Group key for a file name: the part before the first dot ("<uuid>.svg" -> "<uuid>")."""
+    return filename.split(".", 1)[0]
+
+
+class _Group:
+    __slots__ = ("key", "paths", "size", "last_used")
+
+    def __init__(self, key):
+        self.key = key
+        self.paths = []
+        self.size = 0
+        self.last_used = 0.0
+
+
+class ArtifactManager:
+    """TTL + LRU-under-quota eviction for artifact directories, with session pinning and stats."""
+
+    def __init__(self, roots, quota_bytes, ttl_seconds, session_ttl_seconds, sweep_interval=300, catalog=None,
+                 pinned=None):
+        self.roots = list(roots)
+        self.catalog = catalog
+        self.pinned = pinned
+        self.quota_bytes = quota_bytes
+        self.ttl_seconds = ttl_seconds
+        self.session_ttl_seconds = session_ttl_seconds
+        self.sweep_interval = sweep_interval
+        self._lock = threading.Lock()
+        self._sessions = {}   # session id -> (last seen, set of table ids)
+        self._thread = None
+        self._stop = threading.Event()
+        self._last_sweep = None
+        self._evicted_files = 0
+        self._evicted_bytes = 0
+
+    # ---------- tracking ----------
+    def touch(self, *paths):
+        """Mark artifacts as used now (bumps mtime so every worker sees it)."""
+        now = time.time()
+        for path in paths:
+            try:
+                os.utime(path, (now, now))
+            except OSError:
+                pass
+
+    def touch_session(self, session_id, table_ids):
+        """Session is alive and holds these table ids: pin them until session_ttl_seconds of inactivity."""
+        if not session_id:
+            return
+        if self.catalog is not None:
+            self.catalog.touch_session(session_id)
+            return
+        with self._lock:
+            self._sessions[session_id] = (time.time(), set(table_ids or []))
+
+    def _pinned_keys(self, now):
+        extra = set(self.pinned()) if self.pinned is not None else set()
+        if self.catalog is not None:
+            self.catalog.expire_sessions(now - self.session_ttl_seconds)
+            return self.catalog.pinned_keys(now - self.session_ttl_seconds) | extra
+        with self._lock:
+            for sid, (seen, _ids) in list(self._sessions.items()):
+                if now - seen > self.session_ttl_seconds:
+                    del self._sessions[sid]
+            pinned = extra
+            for _seen, ids in self._sessions.values():
+                pinned.update(ids)
+            return pinned
+
+    # ---------- scanning / eviction ----------
+    def _scan(self):
+        """Return {(root, key): _Group} for all files under the managed roots."""
+        groups = {}
+        for root in self.roots:
+            try:
+                entries = list(os.scandir(root))
+            except OSError:
+                continue
+            for entry in entries:
+                if not entry.is_file(follow_symlinks=False) or entry.name.endswith(_PARTIAL_SUFFIX):
+                    continue
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                gkey = (root, artifact_key(entry.name))
+                grp = groups.get(gkey)
+                if grp is None:
+                    grp = groups[gkey] = _Group(gkey[1])
+                grp.paths.append(entry.path)
+                grp.size += st.st_size
+                grp.last_used = max(grp.last_used, st.st_mtime)
+        return groups
+
+    def _evict(self, grp):
+        freed = removed = 0
+        for path in grp.paths:
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+                freed += size
+                removed += 1
+            except OSError:
+                pass
+        if self.catalog is not None:
+            self.catalog.forget_key(grp.key)
+        return removed, freed
+
+    def sweep(self):
+        """One eviction pass: TTL first, then LRU until under quota. Returns a summary dict."""
+        started = time.time()
+        now = started
+        pinned = self._pinned_keys(now)
+        groups = self._scan()
+        total = sum(g.size for g in groups.values())
+        removed_files = freed_bytes = 0
+        candidates = sorted(
+            (g for g in groups.values() if g.key not in pinned and now - g.last_used > 60),
+            key=lambda g: g.last_used,
+        )
+        kept = []
+        for grp in candidates:
+            if self.ttl_seconds and now - grp.last_used > self.ttl_seconds:
+                n, b = self._evict(grp)
+                removed_files += n
+                freed_bytes += b
+                total -= b
+            else:
+                kept.append(grp)
+        if self.quota_bytes and total > self.quota_bytes:
+            # Evict down to 90% of quota so we do not sweep again right away
+            target = int(self.quota_bytes * 0.9)
+            for grp in kept:
+                if total <= target:
+                    break
+                n, b = self._evict(grp)
+                removed_files += n
+                freed_bytes += b
+                total -= b
+        summary = {
+            "at": started,
+            "seconds": round(time.time() - started, 3),
+            "removed_files": removed_files,
+            "freed_bytes": freed_bytes,
+            "total_bytes_after": total,
+        }
+        with self._lock:
+            self._last_sweep = summary
+            self._evicted_files += removed_files
+            self._evicted_bytes += freed_bytes
+        return summary
+
+    # ---------- stats ----------
+    def stats(self):
+        """Usage per root, quota, live sessions and eviction totals."""
+        now = time.time()
+        pinned = self._pinned_keys(now)
+        groups = self._scan()
+        per_root = {}
+        for (root, _key), grp in groups.items():
+            entry = per_root.setdefault(os.path.basename(root), {"files": 0, "bytes": 0, "artifacts": 0})
+            entry["files"] += len(grp.paths)
+            entry["bytes"] += grp.size
+            entry["artifacts"] += 1
+        with self._lock:
+            live_sessions = len(self._sessions)
+            last_sweep = dict(self._last_sweep) if self._last_sweep else None
+            evicted_files, evicted_bytes = self._evicted_files, self._evicted_bytes
+        if self.catalog is not None:
+            live_sessions = self.catalog.live_sessions(now - self.session_ttl_seconds)
+        return {
+            "total_bytes": sum(g.size for g in groups.values()),
+            "quota_bytes": self.quota_bytes,
+            "ttl_seconds": self.ttl_seconds,
+            "roots": per_root,
+            "live_sessions": live_sessions,
+            "pinned_artifacts": len(pinned),
+            "last_sweep": last_sweep,
+            "evicted_files_total": evicted_files,
+            "evicted_bytes_total": evicted_bytes,
+        }
+
+    # ---------- background sweeper ----------
+    def start(self):
+        """Start the daemon sweeper thread (no-op if already running)."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="bms-artifact-sweeper", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.sweep_interval):
+            try:
+                self.sweep()
+            except Exception:
+                pass
@@ -0,0 +1,409 @@
+"""
+Load test: many simulated users going through the web routes at once.
+
+    python -m bms_tool loadtest --users 8 --rounds 3                       # in-process (Flask test client)
+    python -m bms_tool loadtest --url http://127.0.0.1:5000 --users 16      # a server that is already running
+    python -m bms_tool loadtest --workers 1,2,4 --users 16                  # start gunicorn with 1, 2, 4 workers
+
+Each user keeps its own session and repeats a round: upload a synthetic workbook (/),
+open every table preview (/preview/<pid>), open the table editor (/edit-table/<id>), then
+merge one of the tables into a drawing (/merge-final) --merges times. The drawing is a
+synthetic one uploaded with the merge, or a saved template (--template AHU_1.svg).
+
+The report has, per route and overall, the number of requests, errors, p50/p95/p99 latency
+and throughput, plus the peak memory (RSS) of the server: its master and worker processes
+when the tool started the server (Linux /proc), else of this process.
+"""
+import http.cookiejar
+import io
+import json
+import os
+import re
+import shlex
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+
+# Started servers get this long to answer /health
+SERVER_START_TIMEOUT = 60
+# gunicorn by default; {workers} and {port} are filled in (--server-cmd)
+DEFAULT_SERVER_CMD = "gunicorn app:app --workers {workers} --bind 127.0.0.1:{port} --timeout 300"
+# How often the RSS of the server processes is sampled, in seconds
+_RSS_INTERVAL = 0.2
+_PREVIEW_RE = re.compile(r"/preview/([0-9a-f-]{36})")
+
+_POINTS = [("BO", "24Vac"), ("BO", "0-10V"), ("UI", "NTC"), ("AI", "4-20mA"), ("BI", "DI"), ("AO", "0-10V"),
+           ("DO", "24 VAC"), ("DI", "DI")]
+# 1x1 PNG for the point images of the synthetic drawing
+_PIXEL = ("data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR42mNkYAAAAAYAAjCB0C8AAAAASUVORK5CYII=")
+
+
+# =================================================
+# SYNTHETIC INPUT
+# =================================================
+def synthetic_points(points):
+    """[(point id, signal)] of the synthetic workbook and drawing: BO1, BO2, UI3, ..."""
+    return [("%s%d" % (_POINTS[i % len(_POINTS)][0], i + 1), _POINTS[i % len(_POINTS)][1]) for i in range(points)]
+
+
+def synthetic_workbook(points=12, tables=2):
+    """.xlsx bytes with `tables` schedules of `points` rows each, in the layout step 1 reads."""
+    from bms_tool.lazy import pandas
+    pd = pandas()
+    header = ["Software", "No", "System", "Object", "Description", "Signal"]
+    rows = []
+    for t in range(tables):
+        rows.append(header)
+        for i, (pid, signal) in enumerate(synthetic_points(points)):
+            prefix = re.match(r"[A-Z]+", pid).group(0)
+            rows.append([prefix, int(pid[len(prefix):]), "AHU%d" % (t + 1), "OBJ%d" % i,
+                         "point %d of table %d, a description long enough to wrap" % (i, t + 1), signal])
+        rows += [[None] * len(header)] * 2
+    buf = io.BytesIO()
+    pd.DataFrame(rows).to_excel(buf, header=False, index=False)
+    return buf.getvalue()
+
+
+def synthetic_drawing(points=12):
+    """SVG bytes with one point group per synthetic point (labels data-ui1/data-ui2 and a 24Vac image)."""
+    parts = ['<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" '
+             'viewBox="0 0 800 %d" width="800" height="%d">' % (40 + points * 30, 40 + points * 30)]
+    for i, (pid, _signal) in enumerate(synthetic_points(points)):
+        y = 20 + i * 30
+        parts.append(
+            '<g id="%s" transform="translate(0,%d)">'
+            '<rect x="330" y="0" width="50" height="14" fill="none" stroke="black"/>'
+            '<text x="355" y="12" font-family="Arial" font-size="10" text-anchor="middle">%s</text>'
+            '<line x1="380" y1="7" x2="620" y2="7" stroke="black"/>'
+            '<text id="data-ui1" x="400" y="12" font-family="Arial" font-size="10">-</text>'
+            '<text id="data-ui2" x="310" y="12" font-family="Arial" font-size="10" text-anchor="end">-</text>'
+            '<image id="24Vac" x="630" y="0" width="14" height="14" xlink:href="%s"/>'
+            '</g>' % (pid, y, pid, _PIXEL))
+    parts.append("</svg>")
+    return "".join(parts).encode("utf-8")
+
+
+# =================================================
+# CLIENTS: one per simulated user, each with its own session
+# =================================================
+def _multipart(fields, files):
+    """(body, content type) of a multipart/form-data request; files: {name: (filename, bytes)}."""
+    boundary = "bms-loadtest-" + uuid.uuid4().hex
+    out = io.BytesIO()
+    for name, value in fields.items():
+        out.write(('--%s\r\nContent-Disposition: form-data; name="%s"\r\n\r\n%s\r\n'
+                   % (boundary, name, value)).encode("utf-8"))
+    for name, (filename, data) in files.items():
+        out.write(('--%s\r\nContent-Disposition: form-data; name="%s"; filename="%s"\r\n'
+                   'Content-Type: application/octet-stream\r\n\r\n' % (boundary, name, filename)).encode("utf-8"))
+        out.write(data)
+        out.write(b"\r\n")
+    out.write(("--%s--\r\n" % boundary).encode("utf-8"))
+    return out.getvalue(), "multipart/form-data; boundary=" + boundary
+
+
+class TestClientUser:
+    """Requests through the Flask test client of app.py, in this process."""
+
+    def __init__(self, flask_app):
+        self.client = flask_app.test_client()
+
+    def request(self, method, path, fields=None, files=None):
+        """(status, body bytes)."""
+        data = dict(fields or {})
+        for name, (filename, payload) in (files or {}).items():
+            data[name] = (io.BytesIO(payload), filename)
+        response = self.client.open(path, method=method, data=data or None,
+                                    content_type="multipart/form-data" if files else None)
+        try:
+            return response.status_code, response.get_data()
+        finally:
+            response.close()
+
+
+class HttpUser:
+    """Requests over HTTP to a running server, with a cookie jar for the session."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def request(self, method, path, fields=None, files=None):
+        body = None
+        headers = {}
+        if files:
+            body, headers["Content-Type"] = _multipart(fields or {}, files)
+        elif fields:
+            body = urllib.parse.urlencode(fields).encode("utf-8")
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        req = urllib.request.Request(self.base_url + path, data=body, headers=headers, method=method)
+        try:
+            with self.opener.open(req, timeout=600) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+
+# =================================================
+# SCENARIO
+# =================================================
+class Results:
+    """Latencies per route, shared by the user threads."""
+
+    def __init__(self):
+        self.samples = {}   # route -> [(seconds, ok)]
+        self._lock = threading.Lock()
+
+    def add(self, route, seconds, ok):
+        with self._lock:
+            self.samples.setdefault(route, []).append((seconds, ok))
+
+
+def _timed(results, route, user, method, path, fields=None, files=None, expect=(200,)):
+    started = time.perf_counter()
+    try:
+        status, body = user.request(method, path, fields, files)
+    except (OSError, urllib.error.URLError):
+        status, body = None, b""
+    results.add(route, time.perf_counter() - started, status in expect)
+    return status, body
+
+
+def run_user(user, results, rounds, merges, workbook, drawing, template):
+    """One simulated user: `rounds` times upload, previews, editor, then `merges` merges."""
+    for _ in range(rounds):
+        status, body = _timed(results, "POST /", user, "POST", "/",
+                              {"sheet": "0"}, {"excel": ("schedule.xlsx", workbook)})
+        pids = list(dict.fromkeys(_PREVIEW_RE.findall(body.decode("utf-8", "replace")))) if status == 200 else []
+        if not pids:
+            continue
+        for pid in pids:
+            _timed(results, "GET /preview/<pid>", user, "GET", "/preview/" + pid)
+        _timed(results, "GET /edit-table/<id>", user, "GET", "/edit-table/" + pids[0])
+        for n in range(merges):
+            fields = {"table_source": "selected", "table_id": pids[n % len(pids)], "left_column": "SYSTEM",
+                      "right_column": "OBJECT"}
+            files = None
+            if template:
+                fields.update(svg_source="template", svg_template=template)
+            else:
+                fields["svg_source"] = "upload"
+                files = {"svg_file": ("drawing.svg", drawing)}
+            _timed(results, "POST /merge-final", user, "POST", "/merge-final", fields, files)
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile (p in 0..100) of an ascending list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def summarize(results, seconds):
+    """{route: {requests, errors, p50_ms, p95_ms, p99_ms, per_second}} with an "all" entry."""
+    out = {}
+    everything = []
+    for route, samples in sorted(results.samples.items()):
+        everything.extend(samples)
+        out[route] = _stats(samples, seconds)
+    out["all"] = _stats(everything, seconds)
+    return out
+
+
+def _stats(samples, seconds):
+    latencies = sorted(s for s, _ok in samples)
+    return {
+        "requests": len(samples),
+        "errors": sum(1 for _s, ok in samples if not ok),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "per_second": round(len(samples) / seconds, 2) if seconds else 0.0,
+    }
+
+
+# =================================================
+# MEMORY (RSS)
+# =================================================
+def _rss(pid):
+    """Resident memory of a process in bytes (Linux /proc), or None."""
+    try:
+        with open("/proc/%d/status" % pid, encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _descendants(pid):
+    """Child processes of pid, theirs, and so on (Linux /proc; empty elsewhere)."""
+    parents = {}
+    try:
+        names = os.listdir("/proc")
+    except OSError:
+        return []
+    for name in names:
+        if not name.isdigit():
+            continue
+        try:
+            with open("/proc/%s/stat" % name, encoding="ascii", errors="replace") as f:
+                stat = f.read()
+            # Fields after the command name (which may contain spaces): state, ppid, ...
+            parents.setdefault(int(stat.rsplit(")", 1)[1].split()[1]), []).append(int(name))
+        except (OSError, ValueError, IndexError):
+            continue
+    found = []
+    pending = [pid]
+    while pending:
+        children = parents.get(pending.pop(), [])
+        found.extend(children)
+        pending.extend(children)
+    return found
+
+
+class RssSampler:
+    """Peak RSS of a process and its descendants while running (a thread samples every _RSS_INTERVAL)."""
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.peak_total = 0
+        self.peak_process = 0
+        self.processes = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            pids = [self.pid] + _descendants(self.pid)
+            sizes = [s for s in (_rss(p) for p in pids) if s is not None]
+            if sizes:
+                self.peak_total = max(self.peak_total, sum(sizes))
+                self.peak_process = max(self.peak_process, max(sizes))
+                self.processes = max(self.processes, len(sizes))
+            if self._stop.wait(_RSS_INTERVAL):
+                return
+
+    def report(self):
+        return {"rss_peak_mb": round(self.peak_total / 2 ** 20, 1),
+                "rss_peak_process_mb": round(self.peak_process / 2 ** 20, 1),
+                "processes": self.processes}
+
+
+# =================================================
+# RUNS
+# =================================================
+def run_load(make_user, users=8, rounds=3, merges=1, points=12, tables=2, template=None, rss_pid=None):
+    """
+    Run `users` simulated users at once (make_user() -> client) and return the report:
+    {"users", "seconds", "routes": summarize(), "memory": RSS peaks (rss_pid and children)}.
+    """
+    workbook = synthetic_workbook(points, tables)
+    drawing = synthetic_drawing(points)
+    results = Results()
+    clients = [make_user() for _ in range(users)]
+    threads = [threading.Thread(target=run_user, args=(c, results, rounds, merges, workbook, drawing, template))
+               for c in clients]
+    with RssSampler(rss_pid or os.getpid()) as sampler:
+        started = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        seconds = time.perf_counter() - started
+    return {"users": users, "seconds": round(seconds, 2), "routes": summarize(results, seconds),
+            "memory": sampler.report()}
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_healthy(base_url, process):
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("server exited with code %s" % process.returncode)
+        try:
+            with urllib.request.urlopen(base_url + "/health", timeout=2) as response:
+                if response.status == 200:
+                    return
+        except (OSError, urllib.error.URLError):
+            pass
+        time.sleep(0.3)
+    raise RuntimeError("server did not answer /health within %ds" % SERVER_START_TIMEOUT)
+
+
+def run_with_server(workers, server_cmd=DEFAULT_SERVER_CMD, cwd=None, **load):
+    """Start the server command with `workers` workers on a free port, run_load() against it, stop it."""
+    port = _free_port()
+    argv = shlex.split(server_cmd.format(workers=workers, port=port))
+    process = subprocess.Popen(argv, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = "http://127.0.0.1:%d" % port
+    try:
+        _wait_healthy(base_url, process)
+        report = run_load(lambda: HttpUser(base_url), rss_pid=process.pid, **load)
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    report["workers"] = workers
+    return report
+
+
+def format_report(report):
+    """Text table of one run_load() report."""
+    title = "%d users" % report["users"]
+    if "workers" in report:
+        title = "%d workers, %s" % (report["workers"], title)
+    memory = report["memory"]
+    lines = ["%s: %.2fs, RSS peak %.1f MB (largest process %.1f MB, %d processes)" % (
+        title, report["seconds"], memory["rss_peak_mb"], memory["rss_peak_process_mb"], memory["processes"])]
+    lines.append("  %-22s %8s %6s %9s %9s %9s %8s" % ("route", "requests", "errors", "p50 ms", "p95 ms", "p99 ms", "req/s"))
+    for route, s in report["routes"].items():
+        lines.append("  %-22s %8d %6d %9.1f %9.1f %9.1f %8.2f" % (
+            route, s["requests"], s["errors"], s["p50_ms"], s["p95_ms"], s["p99_ms"], s["per_second"]))
+    return "\n".join(lines)
+
+
+def main(args):
+    """loadtest command of bms_tool.cli."""
+    load = {"users": args.users, "rounds": args.rounds, "merges": args.merges, "points": args.points,
+            "tables": args.tables, "template": args.template}
+    reports = []
+    if args.url:
+        reports.append(run_load(lambda: HttpUser(args.url), **load))
+    elif args.workers:
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        for workers in [int(w) for w in args.workers.split(",") if w.strip()]:
+            reports.append(run_with_server(workers, args.server_cmd or DEFAULT_SERVER_CMD, cwd=root, **load))
+    else:
+        sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        import app as web
+        reports.append(run_load(lambda: TestClientUser(web.app), **load))
+    for report in reports:
+        print(format_report(report))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(reports, f, indent=1)
+    return 1 if any(r["routes"]["all"]["errors"] for r in reports) else 0
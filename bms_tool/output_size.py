@@ -0,0 +1,111 @@
+"""
+Output size: gzip/brotli negotiation for SVG responses, plus running totals of the
+bytes saved by compact serialization and by compression (shown at /output-stats).
+"""
+import gzip
+import os
+import shutil
+import threading
+import uuid
+
+try:
+    import brotli
+    HAS_BROTLI = True
+except ImportError:
+    HAS_BROTLI = False
+
+# Below this size compression is not worth the CPU (and headers eat the gain)
+MIN_COMPRESS_BYTES = 1024
+# Responses compressed in memory per request; larger ones are sent as they are (env: BMS_COMPRESS_MAX_MB)
+MAX_COMPRESS_BYTES = int(float(os.environ.get("BMS_COMPRESS_MAX_MB", "").strip() or 8) * 1024 * 1024)
+_CHUNK_SIZE = 1024 * 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+_lock = threading.Lock()
+_totals = {
+    "compact_outputs": 0,
+    "compact_saved_bytes": 0,
+    "compressed_responses": 0,
+    "compressed_original_bytes": 0,
+    "compressed_sent_bytes": 0,
+}
+
+
+def _accepted(accept_encoding):
+    """{coding: q} from an Accept-Encoding header value."""
+    out = {}
+    for part in (accept_encoding or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        coding, _, params = part.partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        out[coding.strip().lower()] = q
+    return out
+
+
+def choose_encoding(accept_encoding):
+    """Best supported content coding the client accepts: "br", "gzip" or None."""
+    accepted = _accepted(accept_encoding)
+    star = accepted.get("*", 0.0)
+    if HAS_BROTLI and accepted.get("br", star) > 0:
+        return "br"
+    if accepted.get("gzip", star) > 0:
+        return "gzip"
+    return None
+
+
+def compress(data, encoding):
+    """Compress bytes with "br" or "gzip"."""
+    if encoding == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def compress_file(src, dst, encoding):
+    """Compress the file src into dst with "br" or "gzip", in chunks, through a .part file."""
+    tmp = "%s.%s.part" % (dst, uuid.uuid4().hex)
+    try:
+        with open(src, "rb") as f, open(tmp, "wb") as out:
+            if encoding == "br":
+                compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+                for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+                    out.write(compressor.process(chunk))
+                out.write(compressor.finish())
+            else:
+                with gzip.GzipFile(fileobj=out, mode="wb", compresslevel=GZIP_LEVEL, mtime=0) as gz:
+                    shutil.copyfileobj(f, gz, _CHUNK_SIZE)
+        os.replace(tmp, dst)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return dst
+
+
+def record_compact(saved_bytes):
+    with _lock:
+        _totals["compact_outputs"] += 1
+        _totals["compact_saved_bytes"] += saved_bytes
+
+
+def record_compression(original_bytes, sent_bytes):
+    with _lock:
+        _totals["compressed_responses"] += 1
+        _totals["compressed_original_bytes"] += original_bytes
+        _totals["compressed_sent_bytes"] += sent_bytes
+
+
+def stats():
+    """Running totals for this process."""
+    with _lock:
+        out = dict(_totals)
+    out["compression_saved_bytes"] = out["compressed_original_bytes"] - out["compressed_sent_bytes"]
+    out["brotli_available"] = HAS_BROTLI
+    return out
@@ -0,0 +1,189 @@
+"""
+Opt-in request profiling: cProfile plus tracemalloc around one call, saved for later.
+
+    store = ProfileStore("uploads/profiles")
+    with store.capture("merge_final", path="/merge-final") as record:
+        ...                      # record["id"] is None when another capture was running
+    store.list()                 # newest first
+
+Each capture writes <id>.prof (pstats, for snakeviz / python -m pstats),
+<id>.speedscope.json (open at https://www.speedscope.app) and <id>.json with the wall
+time, peak traced memory and the allocation sites still holding the most memory.
+Only one capture runs at a time (the profilers are process-wide); others run unprofiled.
+"""
+import contextlib
+import cProfile
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+import uuid
+
+# Kept per directory; the oldest captures are removed first
+DEFAULT_KEEP = 50
+_TOP_ALLOCATIONS = 10
+# Call-graph depth written to the speedscope file; call paths under this share of the total are dropped
+_MAX_STACK_DEPTH = 64
+_MIN_PATH_SHARE = 0.001
+
+_capture_lock = threading.Lock()
+
+
+def _frame_name(func):
+    filename, line, name = func
+    return name if filename == "~" else "%s (%s:%d)" % (name, os.path.basename(filename), line)
+
+
+def speedscope_profile(stats, name):
+    """
+    speedscope "sampled" document from pstats.Stats: every call path is one sample weighted
+    by its share of self time (spread over callers in proportion to their cumulative time,
+    as flame graphs built from cProfile data do).
+    """
+    raw = stats.stats
+    callees = {}
+    for func, (_cc, _nc, _tt, _ct, callers) in raw.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge[3]))
+    frames = []
+    frame_index = {}
+
+    def index(func):
+        if func not in frame_index:
+            frame_index[func] = len(frames)
+            frames.append({"name": _frame_name(func), "file": func[0], "line": func[1]})
+        return frame_index[func]
+
+    paths = {}
+    roots = [func for func, entry in raw.items() if not entry[4]]
+    min_share = sum(raw[func][3] for func in roots) * _MIN_PATH_SHARE
+
+    def walk(func, share, stack):
+        _cc, _nc, tt, ct, _callers = raw[func]
+        stack.append(index(func))
+        scale = share / ct if ct else 0.0
+        if tt * scale > 0:
+            key = tuple(stack)
+            paths[key] = paths.get(key, 0.0) + tt * scale
+        if len(stack) < _MAX_STACK_DEPTH:
+            for callee, edge_ct in callees.get(func, ()):
+                if callee in raw and frame_index.get(callee) not in stack and edge_ct * scale >= min_share:
+                    walk(callee, edge_ct * scale, stack)
+        stack.pop()
+
+    for func in roots:
+        walk(func, raw[func][3], [])
+    samples = [list(key) for key in paths]
+    weights = list(paths.values())
+    total = sum(weights)
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "exporter": "bms_tool.profiling",
+        "name": name,
+        "activeProfileIndex": 0,
+        "shared": {"frames": frames},
+        "profiles": [{
+            "type": "sampled",
+            "name": name,
+            "unit": "seconds",
+            "startValue": 0,
+            "endValue": total,
+            "samples": samples,
+            "weights": weights,
+        }],
+    }
+
+
+def _top_allocations(snapshot):
+    snapshot = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+    ))
+    out = []
+    for stat in snapshot.statistics("lineno")[:_TOP_ALLOCATIONS]:
+        frame = stat.traceback[0]
+        out.append({"file": frame.filename, "line": frame.lineno, "bytes": stat.size, "blocks": stat.count})
+    return out
+
+
+class ProfileStore:
+    """Directory of captured profiles."""
+
+    def __init__(self, directory, keep=DEFAULT_KEEP):
+        self.directory = directory
+        self.keep = keep
+
+    def path(self, profile_id, kind):
+        """Path of a capture's "prof", "speedscope" or "meta" file, or None for a malformed id."""
+        try:
+            profile_id = str(uuid.UUID(profile_id))
+        except (TypeError, ValueError):
+            return None
+        suffix = {"prof": ".prof", "speedscope": ".speedscope.json", "meta": ".json"}[kind]
+        return os.path.join(self.directory, profile_id + suffix)
+
+    @contextlib.contextmanager
+    def capture(self, name, **meta):
+        """Profile the with-block. Yields the record saved as <id>.json ({"id": None} if not captured)."""
+        if not _capture_lock.acquire(blocking=False):
+            yield {"id": None}
+            return
+        record = {"id": str(uuid.uuid4()), "name": name, "started": time.time()}
+        record.update(meta)
+        started_tracing = not tracemalloc.is_tracing()
+        profiler = cProfile.Profile()
+        try:
+            if started_tracing:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            started = time.perf_counter()
+            profiler.enable()
+            try:
+                yield record
+            finally:
+                profiler.disable()
+                record["seconds"] = round(time.perf_counter() - started, 4)
+                record["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+                record["retained_top"] = _top_allocations(tracemalloc.take_snapshot())
+                if started_tracing:
+                    tracemalloc.stop()
+                self._save(record, profiler)
+        finally:
+            _capture_lock.release()
+
+    def _save(self, record, profiler):
+        os.makedirs(self.directory, exist_ok=True)
+        stats = pstats.Stats(profiler)
+        stats.dump_stats(self.path(record["id"], "prof"))
+        with open(self.path(record["id"], "speedscope"), "w", encoding="utf-8") as f:
+            json.dump(speedscope_profile(stats, "%s %s" % (record["name"], record["id"][:8])), f)
+        record["functions"] = len(stats.stats)
+        with open(self.path(record["id"], "meta"), "w", encoding="utf-8") as f:
+            json.dump(record, f, indent=1)
+        self._prune()
+
+    def list(self):
+        """Saved capture records, newest first."""
+        records = []
+        if not os.path.isdir(self.directory):
+            return records
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json") or name.endswith(".speedscope.json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), encoding="utf-8") as f:
+                    records.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        records.sort(key=lambda r: r.get("started", 0), reverse=True)
+        return records
+
+    def _prune(self):
+        for record in self.list()[self.keep:]:
+            for kind in ("prof", "speedscope", "meta"):
+                try:
+                    os.remove(self.path(record["id"], kind))
+                except OSError:
+                    pass
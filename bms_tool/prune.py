@@ -0,0 +1,176 @@
+"""
+Output pruning: drop what a merged drawing does not show before it is converted and written.
+
+    hidden   subtrees with visibility="hidden" or display="none" (after matching, e.g. 24Vac
+             images of points whose signal does not match). Removed before the Visio fixups,
+             so their embedded SVG is never converted to PNG and their payload is not written.
+    defs     children of <defs> whose id nothing in the drawing references (href="#id",
+             url(#id) in attributes or CSS), and <defs> left empty
+    groups   <g> elements without an id that are left with no content
+
+The output looks the same in Visio: Visio gets hidden elements as display="none", which
+hides the whole subtree. Nothing inside <text> or inside definitions (<defs>, <symbol>,
+<clipPath>, ...) is removed as hidden, and groups with an id (point groups) are kept.
+A pruned output has no hidden images left to show, so a delta merge from it is not possible
+when "hidden" was used.
+"""
+import re
+
+PRUNE_KINDS = ("hidden", "defs", "groups")
+
+# Hidden elements inside these are not removed (referenced content, text runs)
+_SHELTER_TAGS = ("defs", "symbol", "clipPath", "mask", "pattern", "marker", "text")
+# Children of <defs> that apply without being referenced
+_UNREFERENCED_TAGS = ("style", "script")
+_URL_REF_RE = re.compile(r"url\(\s*['\"]?#([^)'\"\s]+)")
+
+
+def _local(el):
+    return el.tag.split("}")[-1]
+
+
+def prune_kinds(value):
+    """
+    Tuple of PRUNE_KINDS from a setting: "hidden,groups", "all", "1" (= hidden), "" / "0"
+    (nothing), or a list of kinds. Unknown names are ignored.
+    """
+    if value is None:
+        return ()
+    if isinstance(value, str):
+        value = value.strip().lower()
+        if value in ("", "0", "false", "no", "none"):
+            return ()
+        if value in ("1", "true", "yes"):
+            return ("hidden",)
+        if value == "all":
+            return PRUNE_KINDS
+        value = value.replace(";", ",").split(",")
+    names = {str(v).strip().lower() for v in value}
+    return tuple(k for k in PRUNE_KINDS if k in names)
+
+
+def new_counts():
+    return {k: 0 for k in PRUNE_KINDS}
+
+
+def is_hidden(el):
+    return el.get("visibility") == "hidden" or el.get("display") == "none"
+
+
+def shelters(el):
+    """True when hidden elements inside el are kept."""
+    return _local(el) in _SHELTER_TAGS
+
+
+def element_refs(el):
+    """ids el refers to: href="#id", url(#id) in any attribute, and url(#id) in <style> text."""
+    refs = set()
+    for k, v in el.attrib.items():
+        if not isinstance(v, str) or "#" not in v or v.lstrip()[:5].lower() == "data:":
+            continue
+        if k.split("}")[-1] == "href" and v.startswith("#"):
+            refs.add(v[1:])
+        if "url(" in v:
+            refs.update(_URL_REF_RE.findall(v))
+    if _local(el) == "style" and el.text and "url(" in el.text:
+        refs.update(_URL_REF_RE.findall(el.text))
+    return refs
+
+
+def definition_id(el, parent):
+    """The id of el when it is a definition that can be pruned (a child of <defs> with an id), else None."""
+    if _local(parent) != "defs" or _local(el) in _UNREFERENCED_TAGS:
+        return None
+    return el.get("id") or None
+
+
+def kept_definitions(outside, owned):
+    """
+    ids of the definitions to keep. outside: ids referenced from outside any definition;
+    owned: {definition id: (id of the definition it is inside or None, ids its subtree references)}.
+    References from a definition count only when that definition is kept.
+    """
+    kept = set()
+    refs = set(outside)
+    changed = True
+    while changed:
+        changed = False
+        for def_id, (parent_id, def_refs) in owned.items():
+            if def_id in kept or def_id not in refs:
+                continue
+            if parent_id is not None and parent_id not in kept:
+                continue
+            kept.add(def_id)
+            refs |= def_refs
+            changed = True
+    return kept
+
+
+def collect_definitions(root):
+    """(outside, owned) of kept_definitions for a whole tree."""
+    outside = set()
+    owned = {}
+
+    def walk(el, owner):
+        refs = element_refs(el)
+        if owner is None:
+            outside.update(refs)
+        else:
+            owned[owner][1].update(refs)
+        for child in el:
+            def_id = definition_id(child, el)
+            if def_id is not None:
+                owned.setdefault(def_id, (owner, set()))
+                walk(child, def_id)
+            else:
+                walk(child, owner)
+
+    walk(root, None)
+    return outside, owned
+
+
+def is_empty(el, kinds):
+    """el has nothing left to show and is a kind of container that is pruned when empty."""
+    if len(el) or (el.text or "").strip():
+        return False
+    tag = _local(el)
+    if tag == "g":
+        return "groups" in kinds and not el.get("id")
+    return tag == "defs" and "defs" in kinds
+
+
+def prune_children(parent, kinds, kept, counts, sheltered=False):
+    """Prune below parent in one pass (kept: kept_definitions, needed for "defs")."""
+    for child in list(parent):
+        def_id = definition_id(child, parent) if "defs" in kinds else None
+        if def_id is not None and def_id not in kept:
+            parent.remove(child)
+            counts["defs"] += 1
+            continue
+        if "hidden" in kinds and not sheltered and is_hidden(child):
+            parent.remove(child)
+            counts["hidden"] += 1
+            continue
+        prune_children(child, kinds, kept, counts, sheltered or shelters(child))
+        if is_empty(child, kinds):
+            parent.remove(child)
+            counts["defs" if _local(child) == "defs" else "groups"] += 1
+
+
+def prune_tree(root, kinds):
+    """
+    Prune a whole document in place (the direct children of root, e.g. the drawing and table
+    groups of a merge, are only pruned inside). Returns {kind: elements removed}.
+    """
+    counts = new_counts()
+    kinds = prune_kinds(kinds)
+    if not kinds:
+        return counts
+    kept = kept_definitions(*collect_definitions(root)) if "defs" in kinds else set()
+    for child in list(root):
+        if "hidden" in kinds and is_hidden(child):
+            root.remove(child)
+            counts["hidden"] += 1
+            continue
+        prune_children(child, kinds, kept, counts, shelters(child))
+    return counts
@@ -0,0 +1,215 @@
+"""
+Regression corpus for merge output: checks that the fast merge paths write what update_svg
+writes, and that a change to the code leaves the output as it was.
+
+    python -m bms_tool regress                        # fast paths against the reference, this tree
+    python -m bms_tool regress --record baseline/     # keep this tree's reference outputs
+    python -m bms_tool regress --check baseline/      # this tree's outputs against a recording
+
+The corpus is every drawing under uploads/ (saved templates, uploaded drawings; generated
+output is left out, and copies are taken once) plus the synthetic drawing of the load test,
+which has point images. Each is merged with a table made from its own point ids (every
+third point left out, so SPARE labels are drawn too, signals cycling through the 24Vac
+variants) and with the tables of every workbook under uploads/, for each option set in
+OPTION_SETS.
+
+Paths:
+
+    reference   update_svg, whole drawing in memory
+    streaming   update_svg(streaming=True), bms_tool.stream
+    compiled    merge_template, bms_tool.compiled (not with prune: it uses update_svg then)
+
+Outputs are compared with bms_tool.svgdiff. Each case prints its time per path and the
+first differences; the exit status is 1 when any case differs.
+"""
+import glob
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+
+from bms_tool.svgdiff import DEFAULT_PLACES, compare, format_difference
+
+OPTION_SETS = {
+    "plain": {},
+    "compact": {"compact": True},
+    "grid": {"table_grid": True},
+    "pruned": {"compact": True, "prune": ("hidden", "defs", "groups")},
+}
+# Label columns of every case (as the dashboard's left / right columns)
+COLUMNS = {"left_column": "SYSTEM", "right_column": "OBJECT"}
+PATHS = ("reference", "streaming", "compiled")
+_DRAWING_DIRS = ("svg_templates", "drawings", "svg")
+_WORKBOOK_PATTERNS = ("**/*.xlsx", "**/*.xls")
+_SIGNALS = ("24Vac", "0-10V", "NTC", "4-20mA", "DI", "24 VAC")
+MANIFEST_NAME = "corpus.json"
+
+
+def _stem(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def _digest(path):
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+# =================================================
+# CORPUS
+# =================================================
+def point_table(points):
+    """Table for a drawing's point ids: every third point left out, signals cycling."""
+    from bms_tool.lazy import pandas
+    from bms_tool.tables import TABLE_COLUMNS
+    rows = [(pid, "AHU1", "OBJ%d" % i, "point %s, a description long enough to wrap" % pid,
+             _SIGNALS[i % len(_SIGNALS)])
+            for i, pid in enumerate(points) if i % 3 != 2]
+    return pandas().DataFrame(rows, columns=TABLE_COLUMNS)
+
+
+def drawings(uploads="uploads", scratch=None):
+    """[(name, path)] of the corpus drawings; the synthetic drawing is written to scratch."""
+    found = []
+    seen = set()
+    for sub in _DRAWING_DIRS:
+        for path in sorted(glob.glob(os.path.join(uploads, sub, "*.svg"))):
+            digest = _digest(path)
+            if digest not in seen:
+                seen.add(digest)
+                found.append(("%s-%s" % (sub, _stem(path)), path))
+    if scratch is not None:
+        from bms_tool.loadtest import synthetic_drawing
+        path = os.path.join(scratch, "synthetic.svg")
+        with open(path, "wb") as f:
+            f.write(synthetic_drawing(24))
+        found.append(("synthetic", path))
+    return found
+
+
+def workbook_tables(uploads="uploads"):
+    """[(name, DataFrame)] of the tables of every workbook under uploads/."""
+    from bms_tool import api
+    tables = []
+    paths = sorted({p for pattern in _WORKBOOK_PATTERNS for p in glob.glob(os.path.join(uploads, pattern),
+                                                                           recursive=True)})
+    for path in paths:
+        for i, df in enumerate(api.extract_tables(path), start=1):
+            tables.append(("%s_t%d" % (_stem(path), i), df))
+    return tables
+
+
+def cases(uploads="uploads", scratch=None):
+    """[(case name, drawing path, table, options)] of the corpus."""
+    from bms_tool.template_index import scan_template
+    out = []
+    extra_tables = workbook_tables(uploads)
+    for name, path in drawings(uploads, scratch):
+        tables = [("points", point_table(scan_template(path)["points"]))] + extra_tables
+        for table_name, df in tables:
+            for option_name, options in OPTION_SETS.items():
+                out.append(("%s__%s__%s" % (name, table_name, option_name), path, df, options))
+    return out
+
+
+# =================================================
+# RUN
+# =================================================
+def merge(path_name, drawing, df, output, options):
+    """Merge through one of PATHS. Returns seconds taken, or None when the path does not apply."""
+    from bms_tool.compiled import merge_template
+    from bms_tool.drawing import update_svg
+    options = dict(COLUMNS, **options)
+    started = time.perf_counter()
+    if path_name == "reference":
+        update_svg(drawing, df, output, streaming=False, **options)
+    elif path_name == "streaming":
+        update_svg(drawing, df, output, streaming=True, **options)
+    elif path_name == "compiled":
+        if options.get("prune"):
+            return None
+        merge_template(drawing, df, output, **options)
+    else:
+        raise ValueError("unknown merge path %r (one of %s)" % (path_name, ", ".join(PATHS)))
+    return time.perf_counter() - started
+
+
+def run(uploads="uploads", paths=PATHS, record=None, check=None, places=DEFAULT_PLACES, only=None, limit=5):
+    """
+    Merge every case through paths and compare: with check, every path against the recorded
+    reference output; else every path against this tree's reference. record keeps this
+    tree's reference outputs. Returns [{"case", "seconds": {path: s}, "differences": {path: [...]}}].
+    """
+    if check is not None and not os.path.isfile(os.path.join(check, MANIFEST_NAME)):
+        raise ValueError("%s is not a recorded corpus (no %s)" % (check, MANIFEST_NAME))
+    results = []
+    with tempfile.TemporaryDirectory(prefix="bms-regress-") as scratch:
+        for case, drawing, df, options in cases(uploads, scratch):
+            if only and not re.search(only, case):
+                continue
+            result = {"case": case, "seconds": {}, "differences": {}}
+            outputs = {}
+            for path_name in dict.fromkeys(("reference",) + tuple(paths)):
+                output = os.path.join(scratch, "%s.%s.svg" % (case, path_name))
+                seconds = merge(path_name, drawing, df, output, options)
+                if seconds is not None:
+                    result["seconds"][path_name] = round(seconds, 4)
+                    outputs[path_name] = output
+            expected = os.path.join(check, case + ".svg") if check is not None else outputs["reference"]
+            for path_name, output in outputs.items():
+                if path_name not in paths or (check is None and path_name == "reference"):
+                    continue
+                if not os.path.isfile(expected):
+                    result["differences"][path_name] = [{"path": os.path.basename(expected), "kind": "not recorded",
+                                                         "reference": None, "candidate": None}]
+                    continue
+                started = time.perf_counter()
+                differences = compare(expected, output, places=places, limit=limit)
+                result["seconds"]["compare"] = round(result["seconds"].get("compare", 0)
+                                                     + time.perf_counter() - started, 4)
+                if differences:
+                    result["differences"][path_name] = differences
+            if record is not None:
+                os.makedirs(record, exist_ok=True)
+                os.replace(outputs["reference"], os.path.join(record, case + ".svg"))
+            results.append(result)
+            for output in outputs.values():
+                if os.path.exists(output):
+                    os.remove(output)
+    if record is not None:
+        with open(os.path.join(record, MANIFEST_NAME), "w", encoding="utf-8") as f:
+            json.dump({"cases": [r["case"] for r in results], "places": places,
+                       "recorded": time.strftime("%Y-%m-%dT%H:%M:%S")}, f, indent=1)
+    return results
+
+
+def main(args):
+    """regress command of bms_tool.cli."""
+    paths = tuple(p.strip() for p in args.paths.split(",") if p.strip())
+    unknown = [p for p in paths if p not in PATHS]
+    if unknown:
+        print("error: unknown merge path %s (one of %s)" % (", ".join(unknown), ", ".join(PATHS)))
+        return 2
+    started = time.perf_counter()
+    try:
+        results = run(args.uploads, paths=paths, record=args.record, check=args.check, places=args.places,
+                      only=args.only)
+    except ValueError as e:
+        print("error: %s" % e)
+        return 2
+    failed = 0
+    for r in results:
+        status = "DIFF" if r["differences"] else "ok"
+        failed += bool(r["differences"])
+        timings = "  ".join("%s %.3fs" % (name, s) for name, s in r["seconds"].items())
+        print("%-4s %s  %s" % (status, r["case"], timings))
+        for path_name, differences in r["differences"].items():
+            for d in differences:
+                print("       %s: %s" % (path_name, format_difference(d)))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=1)
+    print("%d cases, %d differ, %.2fs total%s" % (len(results), failed, time.perf_counter() - started,
+                                                  "; recorded to %s" % args.record if args.record else ""))
+    return 1 if failed else 0
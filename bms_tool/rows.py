@@ -0,0 +1,237 @@
+"""
+Point rows from JSON / CSV (e.g. a database export), without going through Excel.
+
+parse_rows() reads the stream incrementally and returns the same table DataFrame
+(TABLE_COLUMNS, all strings) that normalize_table() builds from a workbook:
+
+    CSV     header row naming the columns (any case, any order; unknown columns ignored)
+    JSON    [{"POINT": "BO1", "SYSTEM": "AHU-1", ...}, ...]   array, parsed element by element
+            {"POINT": ...}\\n{"POINT": ...}                    one object per line (NDJSON)
+            {"rows": [...]}                                     wrapper object
+            rows may also be arrays in TABLE_COLUMNS order
+
+The table model is stored next to the generated files as <table id>.table.json, so
+merges and edits read it directly instead of the .xlsx (see write_table_model).
+"""
+import csv
+import io
+import json
+import os
+import uuid
+
+from bms_tool.lazy import pandas
+from bms_tool.tables import TABLE_COLUMNS
+from bms_tool.uploads import CHUNK_SIZE, UploadTooLarge
+
+FORMATS = ("json", "csv")
+_CONTENT_TYPES = {
+    "application/json": "json",
+    "application/x-ndjson": "json",
+    "application/jsonl": "json",
+    "text/csv": "csv",
+    "application/csv": "csv",
+}
+_EXTENSIONS = {".json": "json", ".ndjson": "json", ".jsonl": "json", ".csv": "csv"}
+
+
+class RowsError(ValueError):
+    """The rows could not be read (bad JSON/CSV or no known columns)."""
+
+
+def detect_format(filename=None, content_type=None):
+    """"json" / "csv" from a file extension or Content-Type, or None."""
+    ext = os.path.splitext(filename or "")[1].lower()
+    if ext in _EXTENSIONS:
+        return _EXTENSIONS[ext]
+    mime = (content_type or "").split(";", 1)[0].strip().lower()
+    return _CONTENT_TYPES.get(mime)
+
+
+class _CappedReader(io.RawIOBase):
+    """Binary stream wrapper that raises UploadTooLarge once more than max_bytes were read."""
+
+    def __init__(self, stream, max_bytes, filename=None):
+        self.stream = stream
+        self.max_bytes = max_bytes
+        self.filename = filename
+        self.size = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        data = self.stream.read(len(buf))
+        if not data:
+            return 0
+        self.size += len(data)
+        if self.max_bytes and self.size > self.max_bytes:
+            raise UploadTooLarge(self.filename, self.max_bytes)
+        buf[:len(data)] = data
+        return len(data)
+
+
+def _cell(value):
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        # 12.0 from a numeric export is point number 12, as in normalize_table
+        return str(int(value))
+    return str(value).strip()
+
+
+def _row_from_dict(obj):
+    """TABLE_COLUMNS values for one row object (keys matched case-insensitively), or None if no key matched."""
+    by_name = {str(k).strip().upper(): v for k, v in obj.items()}
+    if not any(c in by_name for c in TABLE_COLUMNS):
+        return None
+    return [_cell(by_name.get(c)) for c in TABLE_COLUMNS]
+
+
+def _row_from_list(values):
+    values = list(values)[:len(TABLE_COLUMNS)]
+    return [_cell(v) for v in values] + [""] * (len(TABLE_COLUMNS) - len(values))
+
+
+# ---------- JSON ----------
+class _JsonValues:
+    """Top-level JSON values from a text stream; a leading top-level array is yielded element by element."""
+
+    def __init__(self, text):
+        self.text = text
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        chunk = self.text.read(CHUNK_SIZE)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def _peek(self):
+        """Next non-whitespace character (not consumed), or "" at end of input."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def _value(self):
+        self._peek()  # raw_decode does not skip leading whitespace
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError as e:
+                # Value cut off at the end of the buffer: read more and retry
+                if not self.eof and self._fill():
+                    continue
+                raise RowsError("Invalid JSON: %s" % e.msg)
+            if end == len(self.buf) and not self.eof and self.buf[self.pos] not in "[{\"":
+                # A bare number may continue in the next chunk
+                self._fill()
+                continue
+            self.pos = end
+            return value
+
+    def _array(self):
+        self.pos += 1  # "["
+        if self._peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self._value()
+            ch = self._peek()
+            self.pos += 1
+            if ch == "]":
+                return
+            if ch != ",":
+                raise RowsError("Invalid JSON: expected ',' or ']' in array")
+
+    def __iter__(self):
+        # A document that is one array is streamed; later values (NDJSON lines) are decoded whole
+        if self._peek() == "[":
+            yield from self._array()
+        while self._peek():
+            yield self._value()
+
+
+def _json_rows(text):
+    for value in _JsonValues(text):
+        if isinstance(value, dict) and isinstance(value.get("rows"), list):
+            items = value["rows"]
+        else:
+            items = [value]
+        for item in items:
+            if isinstance(item, dict):
+                row = _row_from_dict(item)
+                if row is None:
+                    raise RowsError("Row has none of the columns %s." % ", ".join(TABLE_COLUMNS))
+                yield row
+            elif isinstance(item, list):
+                yield _row_from_list(item)
+            else:
+                raise RowsError("Rows must be JSON objects or arrays.")
+
+
+# ---------- CSV ----------
+def _csv_rows(text):
+    reader = csv.reader(text)
+    try:
+        header = next(reader)
+    except StopIteration:
+        return
+    except csv.Error as e:
+        raise RowsError("Invalid CSV: %s" % e)
+    names = [h.strip().upper() for h in header]
+    if not any(c in names for c in TABLE_COLUMNS):
+        raise RowsError("CSV header has none of the columns %s." % ", ".join(TABLE_COLUMNS))
+    index = [names.index(c) if c in names else None for c in TABLE_COLUMNS]
+    try:
+        for record in reader:
+            yield [_cell(record[i]) if i is not None and i < len(record) else "" for i in index]
+    except csv.Error as e:
+        raise RowsError("Invalid CSV (line %d): %s" % (reader.line_num, e))
+
+
+def parse_rows(stream, fmt, max_bytes=None, filename=None):
+    """
+    Table DataFrame (TABLE_COLUMNS) from a binary stream of JSON or CSV rows.
+    Blank rows are dropped. Raises RowsError for bad input and UploadTooLarge past max_bytes.
+    """
+    if fmt not in FORMATS:
+        raise RowsError("Unknown rows format %r (use json or csv)." % fmt)
+    raw = io.BufferedReader(_CappedReader(stream, max_bytes, filename), CHUNK_SIZE)
+    # utf-8-sig: Excel "CSV UTF-8" exports start with a BOM
+    text = io.TextIOWrapper(raw, encoding="utf-8-sig", errors="replace", newline="" if fmt == "csv" else None)
+    rows = [r for r in (_csv_rows(text) if fmt == "csv" else _json_rows(text)) if any(r)]
+    return pandas().DataFrame(rows, columns=TABLE_COLUMNS)
+
+
+# ---------- stored table model ----------
+def write_table_model(df, path):
+    """Store a table DataFrame (all columns, as strings) as JSON at path, atomically."""
+    isna = pandas().isna
+    data = {
+        "columns": [str(c) for c in df.columns],
+        # Cell by cell: same strings as astype(str) with blanks for missing values, without
+        # the per-frame overhead of where() and two astype() calls on small tables
+        "rows": [["" if isna(v) else str(v) for v in row] for row in df.astype(object).values.tolist()],
+    }
+    tmp = "%s.%s.part" % (path, uuid.uuid4().hex)
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp, path)
+    return path
+
+
+def read_table_model(path):
+    """Table DataFrame stored by write_table_model."""
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    return pandas().DataFrame(data["rows"], columns=data["columns"])
@@ -0,0 +1,437 @@
+"""
+Streaming merge for very large drawings: the same output as update_svg, without
+loading the whole drawing into memory.
+
+Two passes over the file with ET.iterparse:
+
+    scan     CSS of the first <style>, whether xlink / Visio names are used, and (compact
+             output) which image payloads repeat, so <svg> and <defs> can be written first
+    rewrite  elements are written as soon as their end tag is read and then dropped.
+             A <g id> is held until its end tag (it may be a point group whose labels depend
+             on its whole subtree), and let go as soon as a point group child shows it is
+             only a container; images, <style> and <script> are also held whole.
+
+Memory is bounded by the largest held subtree (normally one point group), not the drawing.
+update_svg switches to stream_update_svg for drawings of STREAMING_MIN_BYTES or more.
+"""
+import hashlib
+import os
+import uuid
+import xml.etree.ElementTree as ET
+
+from bms_tool.drawing import (
+    DRAWING_TRANSFORM,
+    POINT_PATTERN,
+    _fill_point_labels,
+    _is_group,
+    _group_has_data_ui,
+    _is_point_image,
+    _is_point_label_group,
+    _normalize_point_id,
+    _point_maps,
+    _set_point_image,
+    append_full_excel_table,
+)
+from bms_tool.guard import iterparse_svg
+from bms_tool.prune import (
+    definition_id,
+    element_refs,
+    is_empty,
+    is_hidden,
+    kept_definitions,
+    new_counts,
+    prune_children,
+    prune_kinds,
+    shelters,
+)
+from bms_tool.svg import svg_tag
+from bms_tool.visio import (
+    XML_DECLARATION,
+    SHARED_IMAGE_ID_PREFIX,
+    apply_visio_fixups,
+    declare_namespaces,
+    image_dedupe_key,
+    image_use,
+    new_defs,
+    normalize_image_href,
+    prepare_visio_root,
+    shared_image,
+    size_report,
+    style_element_css,
+    uses_visio,
+    uses_xlink,
+    write_element,
+    write_end,
+    write_start,
+    write_tail,
+)
+
+# Drawings at least this large are merged by stream_update_svg (env: BMS_STREAMING_MIN_MB)
+STREAMING_MIN_BYTES = int(float(os.environ.get("BMS_STREAMING_MIN_MB", "").strip() or 8) * 1024 * 1024)
+
+# Held until their end tag and written whole (besides <g id>)
+_WHOLE_TAGS = ("image", "use", "style", "script")
+
+
+def _local(el):
+    return el.tag.split("}")[-1]
+
+
+def _image_digest(el):
+    """Digest of what image_dedupe_key compares, taken before any svg -> PNG conversion."""
+    href = next((v for k, v in el.attrib.items() if k.split("}")[-1] == "href"), "")
+    h = hashlib.sha1(href.encode("utf-8"))
+    h.update(repr((el.get("width"), el.get("height"), el.get("preserveAspectRatio"))).encode("utf-8"))
+    return h.digest()
+
+
+def _point_id(el):
+    """Normalized point id when el is a <g> whose id matches POINT_PATTERN, else None."""
+    if el.tag != svg_tag("g"):
+        return None
+    gid = (el.get("id") or "").strip().upper()
+    if not gid or not POINT_PATTERN.match(gid):
+        return None
+    return _normalize_point_id(gid)
+
+
+# =================================================
+# PASS 1: scan
+# =================================================
+class _Scan:
+    def __init__(self):
+        self.css_map = {}
+        self.has_xlink = False
+        self.has_visio = False
+        self.shared = {}          # image digest -> shared image id
+        self.shared_images = []   # (probe image, href attribute names, id) for <defs>
+        self.kept = set()         # definitions kept when pruning "defs"
+
+
+def _hidden_at_start(el, point):
+    """el is pruned as hidden whatever the merge does (a point image's visibility is set by the merge)."""
+    if el.get("display") == "none":
+        return True
+    return el.get("visibility") == "hidden" and not (point is not None and _is_point_image(el))
+
+
+def _scan(svg_path, compact, png_cache, maps=None, prune=()):
+    scan = _Scan()
+    found_style = False
+    counter = 0
+    # [preorder index, children seen, point id, sheltered, pruned, definition] of open elements
+    stack = []
+    images = []       # (digest, (parent, index), definition) of images that will be written
+    counts = {}
+    samples = {}      # image digest -> probe of a repeated payload
+    outside = set()   # ids referenced outside any definition (pruning "defs")
+    owned = {}
+    parents = []
+    for event, el in iterparse_svg(svg_path, ("start", "end")):
+        if event == "start":
+            entry = [counter, 0, None, False, False, None]
+            if stack:
+                # The root's own attributes are dropped by update_svg
+                scan.has_xlink = scan.has_xlink or uses_xlink(el)
+                scan.has_visio = scan.has_visio or uses_visio(el)
+                parent = stack[-1]
+                position = (parent[0], parent[1])
+                parent[1] += 1
+                point = (_point_id(el) or parent[2]) if compact or prune else None
+                def_id = definition_id(el, parents[-1]) if "defs" in prune else None
+                if def_id is not None:
+                    owned.setdefault(def_id, (parent[5], set()))
+                pruned = parent[4] or ("hidden" in prune and not parent[3] and _hidden_at_start(el, point))
+                entry = [counter, 0, point, parent[3] or shelters(el), pruned, def_id or parent[5]]
+                if compact and not pruned and _local(el) == "image":
+                    probe = ET.Element(el.tag, dict(el.attrib))
+                    if point is not None:
+                        _set_point_image(probe, point, maps)
+                    if not ("hidden" in prune and not parent[3] and is_hidden(probe)):
+                        apply_visio_fixups(probe, {}, convert=False)
+                        digest = _image_digest(probe)
+                        images.append((digest, position, entry[5]))
+                        counts[digest] = counts.get(digest, 0) + 1
+                        if counts[digest] == 2:
+                            samples[digest] = probe
+            stack.append(entry)
+            parents.append(el)
+            counter += 1
+            continue
+        entry = stack.pop()
+        parents.pop()
+        if not found_style and _local(el) == "style":
+            scan.css_map = style_element_css(el)
+            found_style = True
+        if parents:
+            if "defs" in prune:
+                refs = element_refs(el)
+                if entry[5] is None:
+                    outside.update(refs)
+                else:
+                    owned[entry[5]][1].update(refs)
+            parents[-1].remove(el)
+
+    if "defs" in prune:
+        scan.kept = kept_definitions(outside, owned)
+    first_seen = {}   # image digest -> (parent, index) of its first written copy, in _dedupe_images order
+    counts = {}
+    for digest, position, def_id in images:
+        if def_id is None or def_id in scan.kept or "defs" not in prune:
+            first_seen[digest] = min(first_seen.get(digest, position), position)
+            counts[digest] = counts.get(digest, 0) + 1
+    for digest in sorted((d for d in samples if counts.get(d, 0) > 1), key=first_seen.get):
+        probe = samples[digest]
+        normalize_image_href(probe, png_cache)
+        found = image_dedupe_key(probe)
+        if found is None:
+            continue
+        ref_id = f"{SHARED_IMAGE_ID_PREFIX}{len(scan.shared_images) + 1}"
+        scan.shared[digest] = ref_id
+        scan.shared_images.append((probe, found[1], ref_id))
+    return scan
+
+
+# =================================================
+# PASS 2: rewrite
+# =================================================
+class _Frame:
+    """An element whose start tag was read: written as its children arrive, or held whole."""
+    __slots__ = ("el", "out", "indent", "point", "whole", "sheltered", "drop", "tag", "pending")
+
+    def __init__(self, el, out, indent, point, whole, sheltered=False, drop=False):
+        self.el = el
+        self.out = out          # element written for el (the drawing group for the root)
+        self.indent = indent
+        self.point = point      # innermost point group id, for image visibility
+        self.whole = whole
+        self.sheltered = sheltered  # inside <defs>, <text>, ...: hidden elements are kept
+        self.drop = drop        # pruned: held whole and never written
+        self.tag = None         # set once the start tag is written
+        self.pending = None     # last written child; its tail is written before the next one
+
+
+class _Rewriter:
+    def __init__(self, f, df, maps, scan, compact, png_cache, table_grid=False, prune=()):
+        self.f = f
+        self.df = df
+        self.table_grid = table_grid
+        self.maps = maps
+        self.scan = scan
+        self.stats = {"whitespace": 0, "numbers": 0, "images": 0} if compact else None
+        self.prune = prune
+        self.pruned = new_counts() if prune else None
+        self.png_cache = png_cache
+        self.frames = []
+        self.depth = 0
+        self.whole = None       # frame held whole; no frames are opened inside it
+        self.whole_depth = 0
+        self.root_tag = None
+
+    # ---------- events ----------
+    def start(self, el):
+        self.depth += 1
+        if self.whole is not None:
+            return
+        if not self.frames:
+            self._write_head()
+            drawing_group = ET.Element(svg_tag("g"), {"transform": DRAWING_TRANSFORM})
+            self.frames.append(_Frame(el, drawing_group, 1, None, False))
+            return
+        parent = self.frames[-1]
+        point = _point_id(el) or parent.point
+        drop = self._pruned_at_start(el, parent, point)
+        whole = drop or bool(_is_group(el) and el.get("id")) or _local(el) in _WHOLE_TAGS
+        frame = _Frame(el, el, parent.indent + 1, point, whole, parent.sheltered or shelters(el), drop)
+        self.frames.append(frame)
+        if whole:
+            self.whole = frame
+            self.whole_depth = self.depth
+
+    def end(self, el):
+        whole = self.whole
+        if whole is not None and el is not whole.el:
+            if whole.drop:
+                el.clear()
+            elif (self.depth == self.whole_depth + 1 and _is_group(whole.el)
+                    and _is_group(el) and el.get("id") and _group_has_data_ui(el)):
+                # A point group child: the held <g> is a container, not a point group
+                self._release(el)
+            self.depth -= 1
+            return
+        self.depth -= 1
+        frame = self.frames[-1]
+        if len(self.frames) == 1:
+            self._write_rest(frame)
+            self.frames.pop()
+            return
+        parent = self.frames[-2]
+        written = True
+        if frame.whole:
+            self.whole = None
+            out = None if frame.drop else self._prepare(el, parent.point, parent.sheltered)
+            if out is None:
+                written = False
+            else:
+                self._settle(len(self.frames) - 2)
+                write_element(out, self.f, frame.indent, self.stats)
+        elif frame.tag is not None:
+            self._settle(len(self.frames) - 1)
+            write_end(frame.tag, self.f, frame.indent, self.stats)
+        elif self.prune and is_empty(el, self.prune):
+            self.pruned["defs" if _local(el) == "defs" else "groups"] += 1
+            written = False
+        else:
+            self._settle(len(self.frames) - 2)
+            apply_visio_fixups(el, self.scan.css_map, self.png_cache)
+            write_element(el, self.f, frame.indent, self.stats)
+        self.frames.pop()
+        if written:
+            parent.pending = el
+        else:
+            parent.el.remove(el)
+
+    def _pruned_at_start(self, el, parent, point):
+        """True (and counted) when el is pruned as soon as its start tag is read."""
+        if not self.prune:
+            return False
+        def_id = definition_id(el, parent.el) if "defs" in self.prune else None
+        if def_id is not None and def_id not in self.scan.kept:
+            self.pruned["defs"] += 1
+            return True
+        if "hidden" in self.prune and not parent.sheltered and _hidden_at_start(el, point):
+            self.pruned["hidden"] += 1
+            return True
+        return False
+
+    # ---------- writing ----------
+    def _write_head(self):
+        root = ET.Element(svg_tag("svg"))
+        prepare_visio_root(root)
+        declare_namespaces(root, self.scan.has_xlink, self.scan.has_visio)
+        self.f.write(XML_DECLARATION)
+        self.root_tag = write_start(root, self.f, 0, is_root=True, compact=self.stats)
+        if self.scan.shared_images:
+            defs = new_defs(self.stats)
+            for probe, href_keys, ref_id in self.scan.shared_images:
+                defs.append(shared_image(probe, href_keys, ref_id, self.stats))
+            write_element(defs, self.f, 1, self.stats)
+
+    def _settle(self, index):
+        """
+        Before writing a child of self.frames[index]: its start tag if not yet written (after
+        its parents'), then the tail of its previous child. Start tags wait for a child to be
+        written, so a group whose children are all pruned can still be pruned.
+        """
+        frame = self.frames[index]
+        if frame.tag is None:
+            if index:
+                self._settle(index - 1)
+            if frame.out is frame.el:
+                apply_visio_fixups(frame.el, self.scan.css_map, self.png_cache)
+            frame.tag = write_start(frame.out, self.f, frame.indent, compact=self.stats)
+        if frame.pending is not None:
+            write_tail(frame.pending, self.f, frame.indent, self.stats)
+            frame.el.remove(frame.pending)
+            frame.pending = None
+
+    def _release(self, last_child):
+        """Stop holding self.whole: write its children up to last_child (its start tag with the first one)."""
+        frame = self.whole
+        self.whole = None
+        frame.whole = False
+        done = []
+        for child in frame.el:
+            done.append(child)
+            if child is last_child:
+                break
+        for child in done:
+            out = self._prepare(child, frame.point, frame.sheltered)
+            if out is None:
+                frame.el.remove(child)
+                continue
+            self._settle(len(self.frames) - 1)
+            write_element(out, self.f, frame.indent + 1, self.stats)
+            frame.pending = child
+
+    def _prepare(self, el, point, sheltered):
+        """
+        A finished subtree: point labels, image visibility, pruning, Visio fixups.
+        Returns what to write (el or its <use>), or None when el itself was pruned.
+        """
+        maps = self.maps
+        for g in el.iter():
+            if _is_group(g) and _is_point_label_group(g):
+                _fill_point_labels(g, _normalize_point_id(g.get("id").strip().upper()), maps)
+        self._show_images(el, point)
+        if self.prune:
+            holder = ET.Element(svg_tag("g"))
+            holder.append(el)
+            prune_children(holder, self.prune, self.scan.kept, self.pruned, sheltered)
+            if not len(holder):
+                return None
+        return self._fixups(el)
+
+    def _show_images(self, el, point):
+        point = _point_id(el) or point
+        if point is not None and _is_point_image(el):
+            _set_point_image(el, point, self.maps)
+        for child in el:
+            self._show_images(child, point)
+
+    def _fixups(self, el):
+        """Visio fixups for every element of el; repeated images become <use>. Returns el or its <use>."""
+        uses = {}
+        for node in el.iter():
+            apply_visio_fixups(node, self.scan.css_map, self.png_cache, convert=False)
+            if _local(node) != "image":
+                continue
+            ref_id = self.scan.shared.get(_image_digest(node)) if self.scan.shared else None
+            normalize_image_href(node, self.png_cache)
+            found = image_dedupe_key(node) if ref_id is not None else None
+            if found is not None:
+                uses[id(node)] = image_use(node, found[1], ref_id, self.stats)
+        if not uses:
+            return el
+        for parent in list(el.iter()):
+            for index, child in enumerate(parent):
+                if id(child) in uses:
+                    parent[index] = uses[id(child)]
+        return uses.get(id(el), el)
+
+    def _write_rest(self, frame):
+        """End of the drawing: close the drawing group, write the table and close <svg>."""
+        if frame.tag is not None:
+            self._settle(0)
+            write_end(frame.tag, self.f, frame.indent, self.stats)
+        else:
+            write_element(frame.out, self.f, frame.indent, self.stats)
+        table = append_full_excel_table(ET.Element(svg_tag("svg")), self.df, grid=self.table_grid)
+        out = self._prepare(table, None, False) if table is not None else None
+        if out is not None:
+            write_element(out, self.f, 1, self.stats)
+        write_end(self.root_tag, self.f, 0, self.stats)
+
+
+def stream_update_svg(svg_path, df, output_svg, point_column="POINT", display_column=None,
+                      left_column=None, right_column=None, compact=False, table_grid=False, prune=()):
+    """update_svg for drawings too large to hold in memory; same output and size report."""
+    prune = prune_kinds(prune)
+    maps = _point_maps(df, point_column, display_column, left_column, right_column)
+    png_cache = {}
+    scan = _scan(svg_path, compact, png_cache, maps, prune)
+    tmp = "%s.%s.part" % (output_svg, uuid.uuid4().hex)
+    try:
+        with open(tmp, "wb") as f:
+            writer = _Rewriter(f, df, maps, scan, compact, png_cache, table_grid, prune)
+            for event, el in iterparse_svg(svg_path, ("start", "end")):
+                if event == "start":
+                    writer.start(el)
+                else:
+                    writer.end(el)
+            size = f.tell()
+        os.replace(tmp, output_svg)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return size_report(size, writer.stats, writer.pruned)
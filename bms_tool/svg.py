@@ -0,0 +1,22 @@
+"""SVG namespaces and small element helpers shared by the table, drawing and Visio modules."""
+import xml.etree.ElementTree as ET
+
+# =================================================
+# SVG NAMESPACE
+# =================================================
+SVG_NS = "http://www.w3.org/2000/svg"
+XLINK_NS = "http://www.w3.org/1999/xlink"
+VISIO_NS = "http://schemas.microsoft.com/visio/2003/SVGExtensions/"
+ET.register_namespace("", SVG_NS)
+
+
+def svg_tag(tag):
+    return f"{{{SVG_NS}}}{tag}"
+
+def get_viewbox(svg_root):
+    vb = svg_root.attrib.get("viewBox")
+    if vb:
+        p = vb.replace(",", " ").split()
+        if len(p) == 4:
+            return float(p[2]), float(p[3])
+    return 800, 600
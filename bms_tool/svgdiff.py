@@ -0,0 +1,196 @@
+"""
+Semantic SVG comparison: do two drawings say the same thing, however they are written?
+
+    differences = compare("reference.svg", "candidate.svg")   # [] when equivalent
+    python -m bms_tool svgdiff reference.svg candidate.svg
+
+Before comparing, both files are normalized:
+
+    namespaces   elements and attributes are compared by namespace URI, so ns0:, v: and a
+                 default namespace are the same; xmlns declarations are not compared
+    attributes   order does not matter; style="a:1;b:2" is compared as a set of declarations
+    whitespace   indentation is dropped; runs of whitespace (and commas between values) in
+                 attributes and text count as one space; data: URIs lose all whitespace
+    numbers      numbers in attribute values are rounded to `places` decimals (default 3, the
+                 precision of compact output), so 1.50, 1.5 and 1.5000001 are equal; id,
+                 class and href values are compared as written
+
+A difference is {"path", "kind", "reference", "candidate"}. path is like
+/svg/g[1]/g[@id='UI1']/text[2]; kind is one of tag, attribute, text, missing, extra.
+Children are paired in order; where they do not line up (an element added or dropped) they
+are matched by tag and id, so one extra element is one difference, not one per sibling.
+Identical files are recognized from their bytes without parsing.
+"""
+import difflib
+import hashlib
+import re
+import xml.etree.ElementTree as ET
+
+DEFAULT_PLACES = 3
+DEFAULT_LIMIT = 50
+# Compared as written (no number rounding)
+_EXACT_ATTRS = ("id", "class", "href")
+_NUMBER_RE = re.compile(r"(?<![\w.#])[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?(?![\w.])")
+_SEPARATOR_RE = re.compile(r"\s*,\s*|\s+")
+
+
+# =================================================
+# NORMALIZATION
+# =================================================
+def _local(name):
+    return name.rsplit("}", 1)[-1]
+
+
+def _text(s):
+    """Element text or tail with whitespace collapsed; indentation becomes ""."""
+    return " ".join(s.split()) if s else ""
+
+
+def _number(m, places):
+    s = ("%.*f" % (places, float(m.group(0)))).rstrip("0").rstrip(".")
+    return "0" if s in ("", "-0") else s
+
+
+def _value(name, value, places):
+    """Attribute value as compared."""
+    value = value.strip()
+    if value[:5].lower() == "data:":
+        return "".join(value.split())
+    local = _local(name)
+    if local in _EXACT_ATTRS:
+        return value
+    if local == "style":
+        declarations = (d.split(":", 1) for d in value.split(";") if ":" in d)
+        return ";".join(sorted("%s:%s" % (k.strip(), _value("", v, places)) for k, v in declarations))
+    value = _NUMBER_RE.sub(lambda m: _number(m, places), value)
+    return _SEPARATOR_RE.sub(" ", value).strip()
+
+
+def _attributes(el, places):
+    return {name: _value(name, value, places) for name, value in el.attrib.items()}
+
+
+def _shown(value):
+    """A value for a difference report (data: URIs as their size and digest)."""
+    if value is None or value[:5].lower() != "data:":
+        return value
+    return "data: URI, %d bytes, sha1 %s" % (len(value), hashlib.sha1(value.encode("utf-8")).hexdigest()[:12])
+
+
+def _key(el):
+    """What pairs children that do not line up by position."""
+    return el.tag, el.get("id")
+
+
+def _step(el, position):
+    gid = el.get("id")
+    return "%s[@id='%s']" % (_local(el.tag), gid) if gid else "%s[%d]" % (_local(el.tag), position)
+
+
+# =================================================
+# COMPARISON
+# =================================================
+class _Report:
+    def __init__(self, limit):
+        self.limit = limit
+        self.items = []
+
+    @property
+    def full(self):
+        return self.limit and len(self.items) >= self.limit
+
+    def add(self, path, kind, reference=None, candidate=None):
+        if not self.full:
+            self.items.append({"path": path, "kind": kind, "reference": _shown(reference),
+                               "candidate": _shown(candidate)})
+
+
+def _compare_element(a, b, path, places, report):
+    if a.tag != b.tag:
+        report.add(path, "tag", a.tag, b.tag)
+        return
+    # Normalized only when the values as parsed differ
+    if a.attrib != b.attrib:
+        attrs_a, attrs_b = _attributes(a, places), _attributes(b, places)
+        for name in sorted(set(attrs_a) | set(attrs_b)):
+            if attrs_a.get(name) != attrs_b.get(name):
+                report.add("%s/@%s" % (path, _local(name)), "attribute", attrs_a.get(name), attrs_b.get(name))
+    if a.text != b.text and _text(a.text) != _text(b.text):
+        report.add(path + "/text()", "text", _text(a.text), _text(b.text))
+    if len(a) or len(b):
+        _compare_children(list(a), list(b), path, places, report)
+
+
+def _compare_child(a, b, path, position, places, report):
+    child_path = "%s/%s" % (path, _step(a, position))
+    _compare_element(a, b, child_path, places, report)
+    if a.tail != b.tail and _text(a.tail) != _text(b.tail):
+        report.add(child_path + "/following-text()", "text", _text(a.tail), _text(b.tail))
+
+
+def _compare_children(kids_a, kids_b, path, places, report):
+    keys_a = [_key(el) for el in kids_a]
+    keys_b = [_key(el) for el in kids_b]
+    if keys_a == keys_b:
+        for i, (a, b) in enumerate(zip(kids_a, kids_b), start=1):
+            if report.full:
+                return
+            _compare_child(a, b, path, i, places, report)
+        return
+    matcher = difflib.SequenceMatcher(None, keys_a, keys_b, autojunk=False)
+    for op, i1, i2, j1, j2 in matcher.get_opcodes():
+        if report.full:
+            return
+        if op == "equal" or (op == "replace" and i2 - i1 == j2 - j1):
+            for offset in range(i2 - i1):
+                _compare_child(kids_a[i1 + offset], kids_b[j1 + offset], path, i1 + offset + 1, places, report)
+            continue
+        for i in range(i1, i2):
+            report.add("%s/%s" % (path, _step(kids_a[i], i + 1)), "missing", _local(kids_a[i].tag), None)
+        for j in range(j1, j2):
+            report.add("%s/%s" % (path, _step(kids_b[j], j + 1)), "extra", None, _local(kids_b[j].tag))
+
+
+def _read(source):
+    if isinstance(source, bytes):
+        return source
+    with open(source, "rb") as f:
+        return f.read()
+
+
+def compare(reference, candidate, places=DEFAULT_PLACES, limit=DEFAULT_LIMIT):
+    """
+    Differences between two SVG documents (paths or bytes) after normalization, at most
+    limit of them (0 = all). [] when they are equivalent.
+    """
+    data_a, data_b = _read(reference), _read(candidate)
+    if data_a == data_b:
+        return []
+    root_a, root_b = ET.fromstring(data_a), ET.fromstring(data_b)
+    report = _Report(limit)
+    _compare_element(root_a, root_b, "/" + _local(root_a.tag), places, report)
+    return report.items
+
+
+def format_difference(d):
+    """One line for a difference from compare()."""
+    if d["kind"] == "missing":
+        return "%s: only in the reference" % d["path"]
+    if d["kind"] == "extra":
+        return "%s: only in the candidate" % d["path"]
+    if d["reference"] is None and d["candidate"] is None:
+        return "%s: %s" % (d["path"], d["kind"])
+    return "%s: %s %r != %r" % (d["path"], d["kind"], d["reference"], d["candidate"])
+
+
+def main(args):
+    """svgdiff command of bms_tool.cli."""
+    differences = compare(args.reference, args.candidate, places=args.places, limit=args.limit)
+    for d in differences:
+        print(format_difference(d))
+    if differences:
+        more = " (first %d shown)" % args.limit if args.limit and len(differences) >= args.limit else ""
+        print("%d differences%s" % (len(differences), more))
+        return 1
+    print("equivalent")
+    return 0
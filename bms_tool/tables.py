@@ -0,0 +1,347 @@
+"""
+Excel point schedules -> tables: find the tables on a sheet, normalize them to
+POINT / SYSTEM / OBJECT / DESCRIPTION / SIGNAL, and draw a table as SVG.
+
+A table starts after a header row (one whose cells contain every HEADER_KEYWORDS word) and
+ends at the next header or at two blank rows. The columns of a table are found from the
+labels of its header row through COLUMN_SCHEMA, so the columns may be in any order.
+BMS_TABLE_SCHEMA (JSON, or the path of a JSON file) changes the labels:
+
+    {"header": ["software", "system", "object", "description"],
+     "columns": {"number": ["no", "pt no"], "SIGNAL": ["signal", "signal type"]}}
+
+A column whose label matches none keeps its position in the standard layout
+(Software | No | System | Object | Description | Signal) if that column is not taken.
+"""
+import json
+import os
+import re
+
+from bms_tool.lazy import pandas
+from bms_tool.svg import SVG_NS
+
+# =================================================
+# XML SAFE
+# =================================================
+def xml_escape(val):
+    if val is None:
+        return ""
+    return (
+        str(val)
+        .replace("&", "&amp;")
+        .replace("<", "&lt;")
+        .replace(">", "&gt;")
+        .replace('"', "&quot;")
+        .replace("'", "&apos;")
+    )
+
+# =================================================
+# COLUMN SCHEMA
+# =================================================
+# Field -> (header labels, position in the standard layout). "prefix" + "number" make POINT.
+_DEFAULT_SCHEMA = {
+    "prefix": (("software",), 0),
+    "number": (("no", "no.", "nr", "number", "#"), 1),
+    "SYSTEM": (("system",), 2),
+    "OBJECT": (("object",), 3),
+    "DESCRIPTION": (("description",), 4),
+    "SIGNAL": (("signal",), 5),
+}
+_DEFAULT_HEADER_KEYWORDS = ("software", "system", "object", "description")
+
+
+def load_schema(value):
+    """(header keywords, column schema) from BMS_TABLE_SCHEMA: JSON text or a JSON file path; "" = defaults."""
+    schema = dict(_DEFAULT_SCHEMA)
+    keywords = _DEFAULT_HEADER_KEYWORDS
+    value = (value or "").strip()
+    if not value:
+        return keywords, schema
+    if not value.startswith("{"):
+        with open(value, encoding="utf-8") as f:
+            value = f.read()
+    data = json.loads(value)
+    for field, labels in (data.get("columns") or {}).items():
+        if field not in schema:
+            raise ValueError("BMS_TABLE_SCHEMA: unknown column %r (one of %s)" % (field, ", ".join(schema)))
+        schema[field] = (tuple(_label(l) for l in labels), schema[field][1])
+    if data.get("header"):
+        keywords = tuple(_label(k) for k in data["header"])
+    return keywords, schema
+
+
+def _label(value):
+    """Header cell text as compared with the schema: lower case, single spaces, no trailing ':'."""
+    return re.sub(r"\s+", " ", str(value)).strip().lower().rstrip(":").strip()
+
+
+HEADER_KEYWORDS, COLUMN_SCHEMA = load_schema(os.environ.get("BMS_TABLE_SCHEMA", ""))
+
+
+def column_positions(header, schema=None):
+    """
+    {field: column position or None} for a table whose header row has these cells (None = the
+    standard layout). Exact label matches first, then labels found as words in a cell
+    ("Point No." for "no"), then the field's standard position if no other field took it.
+    """
+    schema = schema or COLUMN_SCHEMA
+    if header is None:
+        return {field: position for field, (_labels, position) in schema.items()}
+    cells = [_label(c) if c is not None else "" for c in header]
+    found = {}
+    taken = set()
+    for exact in (True, False):
+        for field, (labels, _position) in schema.items():
+            if field in found:
+                continue
+            for i, cell in enumerate(cells):
+                if i in taken or not cell:
+                    continue
+                if any(cell == l if exact else re.search(r"(?<!\w)%s(?!\w)" % re.escape(l), cell) for l in labels):
+                    found[field] = i
+                    taken.add(i)
+                    break
+    for field, (_labels, position) in schema.items():
+        if field not in found:
+            found[field] = position if position < len(cells) and position not in taken else None
+            taken.add(found[field])
+    return found
+
+# =================================================
+# HEADER DETECTION
+# =================================================
+def is_table_header(row):
+    pd = pandas()
+    text = " ".join(str(v).lower() for v in row if pd.notna(v))
+    return all(k in text for k in HEADER_KEYWORDS)
+
+
+def _string_cells(values):
+    """values.str, or None for a column without text (numbers, dates, all blank)."""
+    if not pandas().api.types.is_string_dtype(values.dtype):
+        return None
+    try:
+        return values.str
+    except AttributeError:
+        return None
+
+
+def _header_rows(df, keywords):
+    """Positions of the rows with every keyword in their text (later keywords only on rows that had the earlier ones)."""
+    import numpy as np
+    rows = np.arange(len(df))
+    for keyword in keywords:
+        part = df if len(rows) == len(df) else df.iloc[rows]
+        hit = np.zeros(len(rows), dtype=bool)
+        for col in part.columns:
+            text = _string_cells(part[col])
+            if text is not None:
+                hit |= text.contains(keyword, case=False, regex=False, na=False).to_numpy()
+        rows = rows[hit]
+        if not len(rows):
+            break
+    return rows
+
+
+def _blank_rows(df):
+    """Boolean array: rows whose cells are all missing or whitespace."""
+    import numpy as np
+    blank = np.ones(len(df), dtype=bool)
+    for col in df.columns:
+        values = df[col]
+        empty = values.isna().to_numpy()
+        text = _string_cells(values)
+        if text is not None:
+            empty = empty | text.strip().eq("").to_numpy()
+        blank &= empty
+    return blank
+
+# =================================================
+# READ TABLES
+# =================================================
+def read_all_tables(df):
+    """
+    Raw tables (rows below each header, original cells) of a sheet read with header=None.
+    Header and blank rows are found column by column for the whole sheet; each table keeps
+    its header cells in .attrs["header"] for normalize_table.
+    """
+    import numpy as np
+    headers = _header_rows(df, HEADER_KEYWORDS)
+    blank = _blank_rows(df)
+    # i where rows i and i+1 are both blank: a table ends after row i
+    double_blank = np.flatnonzero(blank[:-1] & blank[1:])
+    tables = []
+    for n, h in enumerate(headers):
+        stop = headers[n + 1] if n + 1 < len(headers) else len(df)
+        k = np.searchsorted(double_blank, h + 1)
+        if k < len(double_blank) and double_blank[k] < stop:
+            stop = double_blank[k] + 1
+        if stop > h + 1:
+            # Column types as if the table had been read on its own (ints in a text column stay ints)
+            table = df.iloc[h + 1:stop].infer_objects()
+            table.attrs["header"] = [None if pandas().isna(v) else str(v) for v in df.iloc[h]]
+            tables.append(table)
+    return tables
+
+# =================================================
+# SAFE COLUMN
+# =================================================
+def safe_col(df, idx):
+    pd = pandas()
+    if idx is not None and idx < df.shape[1]:
+        return df.iloc[:, idx]
+    return pd.Series([""] * len(df), index=df.index)
+
+# =================================================
+# TEXT WRAP
+# =================================================
+def wrap_text(text, max_chars):
+    words = str(text).split()
+    lines, line = [], ""
+    for w in words:
+        if len(line + w) <= max_chars:
+            line += w + " "
+        else:
+            lines.append(line.strip())
+            line = w + " "
+    if line:
+        lines.append(line.strip())
+    return lines
+
+# =================================================
+# BUILD SVG TABLE
+# =================================================
+def _grid_table_body(headers, rows, col_x, col_w, start_y, font_size, line_h, padding):
+    """
+    build_table_svg(grid=True) body: one fill per band, all cell borders in one <path>,
+    one <text> per column with a <tspan> per line. Looks the same as the per-cell rects.
+    """
+    left, right = col_x[0], col_x[-1] + col_w[-1]
+    body_y = start_y + 28
+    bottom = body_y + sum(rh for _, rh in rows)
+    d = [f"M{left} {start_y}H{right}", f"M{left} {body_y}H{right}"]
+    y = body_y
+    for _, rh in rows:
+        y += rh
+        d.append(f"M{left} {y}H{right}")
+    d.extend(f"M{x} {start_y}V{bottom}" for x in list(col_x) + [right])
+    out = [
+        f'<rect x="{left}" y="{start_y}" width="{right - left}" height="28" fill="#e5e7eb"/>',
+        f'<rect x="{left}" y="{body_y}" width="{right - left}" height="{bottom - body_y}" fill="white"/>',
+        f'<path d="{" ".join(d)}" fill="none" stroke="black"/>',
+        f'<text font-size="{font_size}" font-weight="bold">' + "".join(
+            f'<tspan x="{col_x[i]+padding}" y="{start_y+18}">{h}</tspan>' for i, h in enumerate(headers)
+        ) + "</text>",
+    ]
+    for i in range(len(col_x)):
+        spans = []
+        y = body_y
+        for cells, rh in rows:
+            ty = y + padding + font_size
+            for line in cells[i]:
+                if line:
+                    spans.append(f'<tspan x="{col_x[i]+padding}" y="{ty}">{xml_escape(line)}</tspan>')
+                ty += line_h
+            y += rh
+        if spans:
+            out.append(f'<text font-size="{font_size}">' + "".join(spans) + "</text>")
+    return out
+
+
+def build_table_svg(df, grid=False):
+    """
+    Table SVG for the preview / classic merge. grid=True draws the borders as one <path> and
+    the text as one <text> per column (far fewer elements for large tables, same look).
+    """
+    font_size = 10
+    line_h = 14
+    padding = 6
+    start_y = 30
+
+    col_x = [20, 110, 270, 430, 690]
+    col_w = [90, 160, 160, 260, 160]
+    wrap_limits = [8, 18, 16, 28, 14]
+
+    rows = []
+    for _, r in df.iterrows():
+        cells = [
+            wrap_text(r["POINT"], wrap_limits[0]),
+            wrap_text(r["SYSTEM"], wrap_limits[1]),
+            wrap_text(r["OBJECT"], wrap_limits[2]),
+            wrap_text(r["DESCRIPTION"], wrap_limits[3]),
+            wrap_text(r["SIGNAL"], wrap_limits[4]),
+        ]
+        max_lines = max(len(c) for c in cells)
+        rows.append((cells, max_lines * line_h + padding * 2))
+
+    height = start_y + sum(rh for _, rh in rows) + 40
+    width = max(col_x) + max(col_w) + 20
+
+    svg = [
+        f'<svg xmlns="{SVG_NS}" width="{width}" height="{height}">',
+        '<style>text{font-family:Arial;}</style>'
+    ]
+
+    headers = ["POINT", "SYSTEM", "OBJECT", "DESCRIPTION", "SIGNAL"]
+    if grid:
+        svg.extend(_grid_table_body(headers, rows, col_x, col_w, start_y, font_size, line_h, padding))
+        svg.append("</svg>")
+        return "\n".join(svg)
+    y = start_y
+
+    for i, h in enumerate(headers):
+        svg.append(
+            f'<rect x="{col_x[i]}" y="{y}" width="{col_w[i]}" height="28" fill="#e5e7eb" stroke="black"/>'
+        )
+        svg.append(
+            f'<text x="{col_x[i]+padding}" y="{y+18}" font-size="{font_size}" font-weight="bold">{h}</text>'
+        )
+
+    y += 28
+
+    for cells, rh in rows:
+        for i, cell in enumerate(cells):
+            svg.append(
+                f'<rect x="{col_x[i]}" y="{y}" width="{col_w[i]}" height="{rh}" fill="white" stroke="black"/>'
+            )
+            ty = y + padding + font_size
+            for line in cell:
+                svg.append(
+                    f'<text x="{col_x[i]+padding}" y="{ty}" font-size="{font_size}">{xml_escape(line)}</text>'
+                )
+                ty += line_h
+        y += rh
+
+    svg.append("</svg>")
+    return "\n".join(svg)
+
+# =================================================
+# NORMALIZE TABLE (POINT = prefix + number)
+# =================================================
+TABLE_COLUMNS = ["POINT", "SYSTEM", "OBJECT", "DESCRIPTION", "SIGNAL"]
+
+
+def normalize_table(tdf, schema=None):
+    """
+    Raw table from read_all_tables -> DataFrame with TABLE_COLUMNS (POINT = prefix + number
+    column). Columns are found from the table's header cells (see column_positions).
+    """
+    pd = pandas()
+    at = column_positions(tdf.attrs.get("header"), schema)
+    prefix = safe_col(tdf, at["prefix"]).astype(str).str.strip()
+    numbers = pd.to_numeric(safe_col(tdf, at["number"]), errors="coerce")
+
+    clean_numbers = numbers.apply(
+        lambda x: str(int(x)) if pd.notna(x) and float(x).is_integer()
+        else (str(x) if pd.notna(x) else "")
+    )
+
+    point_col = prefix + clean_numbers
+
+    return pd.DataFrame({
+        "POINT": point_col,
+        "SYSTEM": safe_col(tdf, at["SYSTEM"]).astype(str),
+        "OBJECT": safe_col(tdf, at["OBJECT"]).astype(str),
+        "DESCRIPTION": safe_col(tdf, at["DESCRIPTION"]).astype(str),
+        "SIGNAL": safe_col(tdf, at["SIGNAL"]).astype(str),
+    }).fillna("").replace("nan", "")
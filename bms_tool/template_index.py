@@ -0,0 +1,203 @@
+"""
+Index of saved drawing templates: the point groups, size and image ids of each one,
+stored in <templates dir>/.index.json and rescanned only for templates that changed.
+
+    index = TemplateIndex(SVG_TEMPLATES_DIR)
+    index.templates()              # [(filename, display name)] for the dashboard
+    index.rank(point_ids)          # templates sharing points with a table, best first
+    index.update("AHU_1.svg")      # after a template is saved
+
+rank() goes through an inverted index (point id -> templates), so it costs one lookup
+per table point however many drawings there are. rank_templates() does the same for
+any set of entries, e.g. the drawings of a bulk run (see the CLI's --pair points).
+"""
+import json
+import os
+import threading
+import uuid
+import xml.etree.ElementTree as ET
+
+from bms_tool.drawing import POINT_PATTERN, _normalize_point_id
+
+INDEX_FILENAME = ".index.json"
+INDEX_VERSION = 1
+
+
+def _size(value):
+    try:
+        return float(str(value).strip().replace("px", ""))
+    except (TypeError, ValueError):
+        return None
+
+
+def scan_template(path):
+    """
+    Index entry for one drawing: {"bytes", "mtime_ns", "width", "height", "points", "images"}.
+    points are normalized point group ids in document order; a drawing that does not parse
+    gets an "error" and no points.
+    """
+    st = os.stat(path)
+    entry = {"bytes": st.st_size, "mtime_ns": st.st_mtime_ns, "width": None, "height": None,
+             "points": [], "images": []}
+    seen = set()
+    images = set()
+    root = None
+    try:
+        for event, el in ET.iterparse(path, events=("start", "end")):
+            if event == "start":
+                if root is None:
+                    root = el
+                    vb = (el.get("viewBox") or "").replace(",", " ").split()
+                    if len(vb) == 4:
+                        entry["width"], entry["height"] = _size(vb[2]), _size(vb[3])
+                    else:
+                        entry["width"], entry["height"] = _size(el.get("width")), _size(el.get("height"))
+                continue
+            tag = el.tag.split("}")[-1]
+            if tag == "g":
+                gid = (el.get("id") or "").strip().upper()
+                if gid and POINT_PATTERN.match(gid):
+                    pid = _normalize_point_id(gid)
+                    if pid not in seen:
+                        seen.add(pid)
+                        entry["points"].append(pid)
+            elif tag == "image" and el.get("id"):
+                images.add(el.get("id").strip())
+            if el is not root:
+                el.clear()
+    except ET.ParseError as e:
+        entry["error"] = str(e)
+        entry["points"] = []
+    entry["images"] = sorted(images)
+    return entry
+
+
+def invert(entries):
+    """point id -> [template names] for {name: entry}."""
+    inverted = {}
+    for name, entry in entries.items():
+        for pid in entry.get("points", ()):
+            inverted.setdefault(pid, []).append(name)
+    return inverted
+
+
+def rank_templates(entries, inverted, point_ids):
+    """
+    Templates sharing points with point_ids, best first: most matched points, then the
+    larger share of the template's own points matched, then name. Each item is
+    {"template", "matched", "table_points", "template_points", "coverage"}.
+    """
+    counts = {}
+    for pid in point_ids:
+        for name in inverted.get(pid, ()):
+            counts[name] = counts.get(name, 0) + 1
+    ranked = []
+    for name, matched in counts.items():
+        template_points = len(entries[name]["points"])
+        ranked.append({
+            "template": name,
+            "matched": matched,
+            "table_points": len(point_ids),
+            "template_points": template_points,
+            "coverage": round(matched / float(len(point_ids)), 3),
+        })
+    ranked.sort(key=lambda r: (-r["matched"], -r["matched"] / float(r["template_points"]), r["template"]))
+    return ranked
+
+
+class TemplateIndex:
+    """The persisted index of one templates directory (safe to share between threads)."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, INDEX_FILENAME)
+        self._lock = threading.Lock()
+        self._entries = None
+        self._inverted = {}
+        self._dir_mtime = None
+        self._file_mtime = None
+
+    def _read(self):
+        """Load the index file if another process rewrote it. True when loaded."""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return False
+        if mtime == self._file_mtime:
+            return False
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if data.get("version") != INDEX_VERSION:
+            return False
+        self._set(data.get("templates") or {}, data.get("dir_mtime_ns"))
+        self._file_mtime = mtime
+        return True
+
+    def _set(self, entries, dir_mtime):
+        self._entries = entries
+        self._inverted = invert(entries)
+        self._dir_mtime = dir_mtime
+
+    def _write(self):
+        data = {"version": INDEX_VERSION, "dir_mtime_ns": self._dir_mtime, "templates": self._entries}
+        tmp = "%s.%s.part" % (self.path, uuid.uuid4().hex)
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp, self.path)
+        self._file_mtime = os.stat(self.path).st_mtime_ns
+
+    def _rescan(self, dir_mtime):
+        """Stat every template; scan only new or changed ones."""
+        old = self._entries or {}
+        entries = {}
+        for item in os.scandir(self.directory):
+            if not item.name.endswith(".svg") or not item.is_file():
+                continue
+            st = item.stat()
+            entry = old.get(item.name)
+            if entry is None or entry.get("bytes") != st.st_size or entry.get("mtime_ns") != st.st_mtime_ns:
+                entry = scan_template(item.path)
+            entries[item.name] = entry
+        self._set(entries, dir_mtime)
+        self._write()
+
+    def refresh(self, force=False):
+        """Bring the index up to date. Costs two stats when nothing was added or removed; force=True re-stats every template."""
+        if not os.path.isdir(self.directory):
+            self._set({}, None)
+            return
+        with self._lock:
+            self._read()
+            dir_mtime = os.stat(self.directory).st_mtime_ns
+            if force or self._entries is None or dir_mtime != self._dir_mtime:
+                self._rescan(dir_mtime)
+
+    def update(self, filename):
+        """Index a template that was just saved (or removed)."""
+        with self._lock:
+            self._read()
+            entries = dict(self._entries or {})
+            path = os.path.join(self.directory, filename)
+            if os.path.isfile(path):
+                entries[filename] = scan_template(path)
+            else:
+                entries.pop(filename, None)
+            self._entries = entries
+            self._rescan(os.stat(self.directory).st_mtime_ns)
+
+    def entries(self):
+        """{filename: entry} for every template."""
+        self.refresh()
+        return self._entries
+
+    def templates(self):
+        """[(filename, display name)] sorted by filename."""
+        return [(f, os.path.splitext(f)[0].replace("_", " ")) for f in sorted(self.entries())]
+
+    def rank(self, point_ids):
+        """rank_templates() over the templates in this directory."""
+        self.refresh()
+        return rank_templates(self._entries, self._inverted, point_ids)
@@ -0,0 +1,93 @@
+"""
+Upload handling: stream an uploaded file into a spooled temp file with a size cap,
+hashing the bytes while reading so identical re-uploads can be recognised.
+"""
+import hashlib
+import os
+import tempfile
+import uuid
+
+CHUNK_SIZE = 64 * 1024
+# Uploads up to this size stay in memory; larger ones spill to a temp file on disk
+SPOOL_MAX_BYTES = 1024 * 1024
+
+
+class UploadTooLarge(Exception):
+    """Raised when an upload is bigger than its configured size cap."""
+
+    def __init__(self, filename, limit):
+        self.filename = filename
+        self.limit = limit
+        super().__init__("%s is larger than the %s MB limit." % (filename or "Upload", limit // (1024 * 1024)))
+
+
+class SpooledUpload:
+    """One received upload: spooled file (rewound), sha256 hex digest, size and client filename."""
+
+    def __init__(self, filename, fileobj, digest, size):
+        self.filename = filename
+        self.file = fileobj
+        self.digest = digest
+        self.size = size
+
+    def open(self):
+        """Return the spooled file rewound to the start (pass it to pd.read_excel / ET.parse)."""
+        self.file.seek(0)
+        return self.file
+
+    def save_to(self, path):
+        """
+        Write the bytes to path unless a file with the same size is already there
+        (paths are content-addressed by digest, so same name + size = same bytes).
+        Writes to a temp name first so readers never see a partial file. Returns path.
+        """
+        if os.path.isfile(path) and os.path.getsize(path) == self.size:
+            os.utime(path)  # counts as a fresh use for the artifact sweeper
+            return path
+        tmp = "%s.%s.part" % (path, uuid.uuid4().hex)
+        src = self.open()
+        with open(tmp, "wb") as out:
+            while True:
+                chunk = src.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                out.write(chunk)
+        os.replace(tmp, path)
+        return path
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def receive_upload(storage, max_bytes, spool_max=SPOOL_MAX_BYTES):
+    """
+    Read a werkzeug FileStorage (or any object with .stream / .filename) chunk by chunk
+    into a SpooledTemporaryFile, hashing as it goes. Raises UploadTooLarge as soon as
+    more than max_bytes have been read (max_bytes 0/None = no cap).
+    """
+    filename = getattr(storage, "filename", None) or ""
+    stream = getattr(storage, "stream", storage)
+    spooled = tempfile.SpooledTemporaryFile(max_size=spool_max)
+    hasher = hashlib.sha256()
+    size = 0
+    try:
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if max_bytes and size > max_bytes:
+                raise UploadTooLarge(filename, max_bytes)
+            hasher.update(chunk)
+            spooled.write(chunk)
+    except BaseException:
+        spooled.close()
+        raise
+    spooled.seek(0)
+    return SpooledUpload(filename, spooled, hasher.hexdigest(), size)
@@ -0,0 +1,573 @@
+"""
+Visio-compatible SVG output: inline CSS, keep xlink/Visio namespaces, turn embedded
+SVG images into PNG, and serialize without ns0: prefixes (indented or compact).
+"""
+import base64
+import re
+import xml.etree.ElementTree as ET
+
+from bms_tool.lazy import cairosvg
+from bms_tool.prune import prune_tree
+from bms_tool.svg import SVG_NS, XLINK_NS, VISIO_NS, svg_tag
+
+XML_DECLARATION = b'<?xml version="1.0" encoding="UTF-8"?>\n'
+
+
+class DataUri(bytes):
+    """
+    A data: URI attribute value, normalized once by normalize_image_href and kept as its
+    escaped UTF-8 bytes. The serializer writes it straight to the output, so a large
+    embedded image is not stripped, escaped and re-encoded on every write.
+    """
+
+    @classmethod
+    def from_text(cls, val):
+        return cls(_escape_text(val).encode("utf-8"))
+
+# =================================================
+# CONVERT SVG TO VISIO-COMPATIBLE FORMAT
+# =================================================
+def _data_uri_svg_xml_to_png(data_uri):
+    """Convert data:image/svg+xml;base64,... to data:image/png;base64,... so Visio can show it."""
+    cs = cairosvg()
+    if cs is None:
+        return None
+    s = data_uri.strip()
+    if not s.lower().startswith("data:image/svg+xml;base64,"):
+        return None
+    try:
+        b64 = s.split(",", 1)[1]
+        b64_clean = "".join(b64.split())
+        svg_bytes = base64.b64decode(b64_clean)
+    except Exception:
+        return None
+    try:
+        png_bytes = cs.svg2png(bytestring=svg_bytes)
+        new_b64 = base64.b64encode(png_bytes).decode("ascii")
+        return "data:image/png;base64," + new_b64
+    except Exception:
+        return None
+
+
+def _parse_svg_css(style_text):
+    """Parse CSS from <style> content: return dict class_name -> rule string."""
+    if not style_text or not style_text.strip():
+        return {}
+    out = {}
+    for m in re.finditer(r"\.([\w-]+)\s*\{([^{}]*)\}", style_text, re.DOTALL):
+        name, body = m.group(1), m.group(2)
+        out[name.strip()] = " ".join(body.split()).strip()
+    return out
+
+
+def _inline_css_on_element(el, css_map):
+    """Set style attribute on an element that has class= so Visio shows same as browser."""
+    if not css_map:
+        return
+    cls = el.get("class")
+    if not cls:
+        return
+    parts = [p.strip() for p in str(cls).split() if p.strip()]
+    rules = [css_map[p] for p in parts if p in css_map]
+    if not rules:
+        return
+    combined = "; ".join(r for r in rules if r)
+    existing = (el.get("style") or "").strip()
+    if existing:
+        el.set("style", existing.rstrip(";") + "; " + combined)
+    else:
+        el.set("style", combined)
+
+
+def style_element_css(style_el):
+    """class name -> rule string from a <style> element (text plus any child text/tails)."""
+    raw = style_el.text or ""
+    for child in style_el:
+        if child.text:
+            raw += child.text
+        if child.tail:
+            raw += child.tail
+    return _parse_svg_css(raw)
+
+
+def _local_tag(el):
+    return el.tag.split("}")[-1] if "}" in el.tag else el.tag
+
+
+def prepare_visio_root(root):
+    """Root-level fixups: xmlns/version, px units on width/height, clean viewBox."""
+    root.set("xmlns", SVG_NS)
+    root.set("version", "1.1")
+
+    # Visio expects width/height with units (px) when present
+    w = root.get("width")
+    h = root.get("height")
+    if w and re.match(r"^\d*\.?\d+$", str(w).strip()):
+        root.set("width", str(w).strip() + "px")
+    if h and re.match(r"^\d*\.?\d+$", str(h).strip()):
+        root.set("height", str(h).strip() + "px")
+
+    # viewBox: keep as-is but ensure clean format (no scientific notation)
+    vb = root.get("viewBox")
+    if vb:
+        parts = vb.replace(",", " ").split()
+        if len(parts) == 4:
+            try:
+                nums = [float(x) for x in parts]
+                root.set("viewBox", " ".join(str(int(x) if x == int(x) else x) for x in nums))
+            except (ValueError, TypeError):
+                pass
+
+
+def normalize_image_href(el, png_cache=None, convert=True):
+    """
+    <image> with a data: URI: drop whitespace in it, convert image/svg+xml to PNG so Visio can
+    show it, and store it as a DataUri. png_cache (optional dict) reuses conversions of the same
+    payload. convert=False only drops the whitespace (to compare payloads before converting).
+    """
+    if _local_tag(el) != "image":
+        return
+    href_key = None
+    for k in el.attrib:
+        if k.startswith("{") and "1999/xlink" in k and "href" in k:
+            href_key = k
+            break
+    if href_key is None:
+        return
+    val = el.attrib[href_key]
+    if not isinstance(val, str) or not val.strip().lower().startswith("data:"):
+        return
+    val = "".join(val.split())
+    if convert and val.lower().startswith("data:image/svg+xml;base64,"):
+        if png_cache is not None and val in png_cache:
+            png_uri = png_cache[val]
+        else:
+            png_uri = _data_uri_svg_xml_to_png(val)
+            if png_cache is not None:
+                png_cache[val] = png_uri
+        if png_uri is not None:
+            val = png_uri
+    if convert:
+        val = DataUri.from_text(val)
+    el.set("href", val)
+    el.attrib[href_key] = val
+
+
+def apply_visio_fixups(el, css_map, png_cache=None, convert=True):
+    """
+    All per-element Visio fixups, in the order convert_to_visio_svg applies them: hidden ->
+    display:none, class CSS inlined, default stroke on wires, unknown namespace attributes
+    dropped, embedded SVG images turned into PNG.
+    """
+    hidden_to_display(el)
+    # Inline CSS so Visio shows same styles as browser (Visio often ignores <style> block)
+    _inline_css_on_element(el, css_map)
+    # Ensure path/line (wires) have stroke so they print properly
+    ensure_stroke(el)
+    # Remove only unknown namespace attributes (keep w3.org, xlink, Visio)
+    to_drop = [
+        k for k in el.attrib
+        if k.startswith("{")
+        and "w3.org" not in k
+        and "schemas.microsoft.com" not in k
+    ]
+    for k in to_drop:
+        del el.attrib[k]
+    normalize_image_href(el, png_cache, convert)
+
+
+def convert_to_visio_svg(input_path, output_path, compact=False, prune=()):
+    """
+    Make SVG valid for Microsoft Visio: same drawing as browser, editable.
+    Inline CSS onto elements so Visio shows styles; keep xlink, defs, images.
+    compact=True: no indentation, numbers trimmed to NUMBER_PRECISION decimals, repeated
+    <image> payloads stored once in <defs> and referenced with <use>.
+    prune: kinds of bms_tool.prune to remove first (hidden images are then never converted).
+    Returns {"bytes": output size, "compact": bool, "saved_bytes": int, "saved": {...}, "pruned": {...}}.
+    """
+    tree = ET.parse(input_path)
+    root = tree.getroot()
+    prepare_visio_root(root)
+
+    # CSS of the first <style> in the document applies to every element
+    css_map = {}
+    for style_el in root.iter():
+        if _local_tag(style_el) == "style":
+            css_map = style_element_css(style_el)
+            break
+
+    namespaces = _used_namespaces(root)
+    pruned = prune_tree(root, prune) if prune else None
+    for el in root.iter():
+        apply_visio_fixups(el, css_map)
+
+    return _write_visio_svg(root, output_path, compact, namespaces, pruned)
+
+
+def hidden_to_display(el):
+    """visibility="hidden" -> display="none" (Visio ignores visibility)."""
+    if el.get("visibility") == "hidden":
+        el.set("display", "none")
+        del el.attrib["visibility"]
+
+
+def ensure_stroke(el):
+    """Give an unstyled <path>/<line> (wire) an explicit stroke so it prints in Visio."""
+    tag = _local_tag(el)
+    if tag not in ("path", "line"):
+        return
+    if el.get("style") or el.get("class"):
+        return
+    el.set("style", "stroke:#000000;stroke-width:1;fill:none")
+
+
+def uses_xlink(el):
+    return any(k.startswith("{") and "1999/xlink" in k for k in el.attrib)
+
+
+def uses_visio(el):
+    return (
+        (el.tag.startswith("{") and "schemas.microsoft.com" in el.tag)
+        or any(k.startswith("{") and "schemas.microsoft.com" in k for k in el.attrib)
+    )
+
+
+def declare_namespaces(root, has_xlink, has_visio):
+    """Declare xlink and Visio on root so styles and drawing stay correct in Visio."""
+    if has_xlink:
+        root.set("xmlns:xlink", XLINK_NS)
+    if has_visio:
+        root.set("xmlns:v", VISIO_NS)
+
+
+def size_report(size, stats, pruned=None):
+    """
+    The report convert_to_visio_svg returns for an output of size bytes (stats: compact
+    counters or None; pruned: elements removed per prune kind, or None).
+    """
+    return {
+        "bytes": size,
+        "compact": stats is not None,
+        "saved_bytes": sum(stats.values()) if stats else 0,
+        "saved": stats or {},
+        "pruned": pruned or {},
+    }
+
+
+def _used_namespaces(root):
+    # Decided before pruning: the streaming merge declares them before it reaches any element
+    return (
+        any(uses_xlink(el) for el in root.iter()),
+        any(uses_visio(el) for el in root.iter()),
+    )
+
+
+def write_visio_svg(root, output_path, compact=False, prune=()):
+    """
+    Serialize a tree that already had the Visio fixups applied (convert_to_visio_svg, or
+    a delta merge of such an output), pruning it first. Returns the size report of convert_to_visio_svg.
+    """
+    namespaces = _used_namespaces(root)
+    pruned = prune_tree(root, prune) if prune else None
+    return _write_visio_svg(root, output_path, compact, namespaces, pruned)
+
+
+def _write_visio_svg(root, output_path, compact, namespaces, pruned):
+    declare_namespaces(root, *namespaces)
+
+    stats = None
+    if compact:
+        stats = {"whitespace": 0, "numbers": 0, "images": 0}
+        _dedupe_images(root, stats)
+
+    # Write with default namespace so output is clean SVG (no ns0: prefix)
+    with open(output_path, "wb") as f:
+        f.write(XML_DECLARATION)
+        _serialize_visio_svg(root, f, is_root=True, compact=stats)
+        size = f.tell()
+    return size_report(size, stats, pruned)
+
+
+# =================================================
+# COMPACT OUTPUT (numbers, repeated images)
+# =================================================
+NUMBER_PRECISION = 3
+_LONG_DECIMAL_RE = re.compile(r"-?\d*\.\d{%d,}" % (NUMBER_PRECISION + 1))
+# Attribute values that are names, not geometry: never trimmed
+_EXACT_ATTRS = ("id", "class", "href")
+# Only images with a payload at least this long are worth moving into <defs>
+_DEDUPE_MIN_HREF = 256
+# ids of the shared <image> elements in <defs> (bms-img-1, bms-img-2, ...)
+SHARED_IMAGE_ID_PREFIX = "bms-img-"
+
+
+def _trim_number(m):
+    s = ("%.*f" % (NUMBER_PRECISION, float(m.group(0)))).rstrip("0").rstrip(".")
+    return "0" if s in ("", "-0") else s
+
+
+def _compact_attr_value(k, s, stats):
+    """Round long decimals in geometry attributes; count the characters saved."""
+    if k.split("}")[-1] in _EXACT_ATTRS or "schemas.microsoft.com" in k:
+        return s
+    trimmed = _LONG_DECIMAL_RE.sub(_trim_number, s)
+    stats["numbers"] += len(s) - len(trimmed)
+    return trimmed
+
+
+class _ByteCounter:
+    """File-like sink that only counts bytes (size of a serialization without writing it)."""
+
+    def __init__(self):
+        self.n = 0
+
+    def write(self, b):
+        self.n += len(b)
+
+
+def _compact_size(el):
+    counter = _ByteCounter()
+    _serialize_visio_svg(el, counter, compact={"whitespace": 0, "numbers": 0, "images": 0})
+    return counter.n
+
+
+def image_dedupe_key(el):
+    """(key, href attribute names) for an <image> whose payload is worth sharing via <defs>, else None."""
+    if _local_tag(el) != "image":
+        return None
+    href_keys = [k for k in el.attrib if k.split("}")[-1] == "href"]
+    href = next((el.attrib[k] for k in href_keys), "")
+    if len(href) < _DEDUPE_MIN_HREF:
+        return None
+    return (href, el.get("width"), el.get("height"), el.get("preserveAspectRatio")), href_keys
+
+
+def new_defs(stats):
+    """Empty <defs> for shared images; its size is counted against the saving in stats."""
+    defs = ET.Element(svg_tag("defs"))
+    stats["images"] -= _compact_size(defs)
+    return defs
+
+
+def shared_image(first, href_keys, ref_id, stats):
+    """The <image id=ref_id> stored once in <defs> for all copies of first (its size counted in stats)."""
+    shared = ET.Element(svg_tag("image"), {"id": ref_id})
+    for k in ("width", "height", "preserveAspectRatio"):
+        if first.get(k) is not None:
+            shared.set(k, first.get(k))
+    for k in href_keys:
+        shared.set(k, first.attrib[k])
+    stats["images"] -= _compact_size(shared)
+    return shared
+
+
+def image_use(el, href_keys, ref_id, stats):
+    """<use> that replaces the image el (keeps its other attributes, e.g. id and display); saving counted in stats."""
+    use = ET.Element(svg_tag("use"), {
+        k: v for k, v in el.attrib.items()
+        if k not in href_keys and k not in ("width", "height", "preserveAspectRatio")
+    })
+    use.set(f"{{{XLINK_NS}}}href", "#" + ref_id)
+    use.tail = el.tail
+    stats["images"] += _compact_size(el) - _compact_size(use)
+    return use
+
+
+def repeated_images(root):
+    """
+    Images whose payload repeats, one list per payload in the order _dedupe_images numbers
+    them; each item is (parent, index, image, href attribute names).
+    """
+    groups = {}
+    for parent in root.iter():
+        for index, el in enumerate(parent):
+            found = image_dedupe_key(el)
+            if found is None:
+                continue
+            key, href_keys = found
+            groups.setdefault(key, []).append((parent, index, el, href_keys))
+    return [items for items in groups.values() if len(items) > 1]
+
+
+def _dedupe_images(root, stats):
+    """Store each repeated <image> payload once in <defs>; replace every copy with <use> at the same spot."""
+    repeated = repeated_images(root)
+    if not repeated:
+        return
+    defs = None
+    for child in root:
+        if child.tag == svg_tag("defs"):
+            defs = child
+            break
+    if defs is None:
+        defs = new_defs(stats)
+        root.insert(0, defs)
+    for n, items in enumerate(repeated):
+        ref_id = f"{SHARED_IMAGE_ID_PREFIX}{n + 1}"
+        defs.append(shared_image(items[0][2], items[0][3], ref_id, stats))
+        for parent, index, el, href_keys in items:
+            parent[index] = image_use(el, href_keys, ref_id, stats)
+
+
+def _escape_text(s):
+    if not s:
+        return ""
+    return s.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace('"', "&quot;")
+
+
+def _attr_value_for_serialize(k, v, compact=None):
+    """Escape attribute value; collapse whitespace in data: URIs so base64 images work in Visio."""
+    s = str(v)
+    if s.lstrip()[:5].lower() == "data:":
+        s = "".join(s.split())
+    elif compact is not None:
+        s = _compact_attr_value(k, s, compact)
+    return _escape_text(s)
+
+
+_BLANK_EDGES_RE = re.compile(r"^\s*\n|\n\s*$")
+
+
+def _attr_name(k):
+    """Serialized attribute name, or None for a namespaced attribute that is not written."""
+    if not k.startswith("{"):
+        return k
+    ns_uri = k[1:].split("}", 1)[0]
+    local = k.split("}")[-1]
+    if "1999/xlink" in ns_uri:
+        return f"xlink:{local}"
+    if "schemas.microsoft.com" in ns_uri:
+        return f"v:{local}"
+    if "w3.org" in ns_uri and "XML" in ns_uri:
+        return f"xml:{local}"
+    return None
+
+
+def _open_tag(el, is_root=False, compact=None):
+    """
+    (serialized tag name, serialized attributes as a list of byte strings) of an element.
+    DataUri values are their own items, so their bytes are written without being copied.
+    """
+    if "}" in el.tag:
+        ns_uri, local = el.tag[1:].split("}", 1)
+        tag = f"v:{local}" if "schemas.microsoft.com" in ns_uri else local
+    else:
+        tag = el.tag
+    root_svg = is_root and tag == "svg"
+    chunks = []
+    attrs = [f' xmlns="{SVG_NS}"'] if root_svg else []
+    for k, v in el.attrib.items():
+        blob = isinstance(v, DataUri)
+        val_esc = None if blob else _attr_value_for_serialize(k, v, compact)
+        name = _attr_name(k)
+        if name is None or (root_svg and k in ("xmlns", "version")):
+            continue
+        if blob:
+            attrs.append(f' {name}="')
+            chunks.append("".join(attrs).encode("utf-8"))
+            chunks.append(v)
+            attrs = ['"']
+        else:
+            attrs.append(f' {name}="{val_esc}"')
+    if root_svg:
+        # xmlns:xlink and xmlns:v are already on root.attrib from convert_to_visio_svg
+        attrs.append(' version="1.1"')
+    chunks.append("".join(attrs).encode("utf-8"))
+    return tag, chunks
+
+
+def _write_open_tag(f, prefix, tag, chunks, close):
+    """Write prefix + <tag attributes + close."""
+    head = f"{prefix}<{tag}".encode("utf-8")
+    if len(chunks) == 1:
+        f.write(head + chunks[0] + close.encode("utf-8"))
+        return
+    f.write(head)
+    for chunk in chunks:
+        f.write(chunk)
+    f.write(close.encode("utf-8"))
+
+
+def _ws(s, compact):
+    # Indentation/newlines: written in normal mode, dropped (and counted) in compact mode
+    if compact is None:
+        return s
+    compact["whitespace"] += len(s)
+    return ""
+
+
+def _write_text_head(el, f, indent, compact):
+    """After the start tag of an element with children: its text, then the newline before the first child."""
+    if (el.text or "").strip():
+        f.write((_ws("\n" + "  " * (indent + 1), compact) + _escape_text(el.text)).encode("utf-8"))
+    f.write(_ws("\n", compact).encode("utf-8"))
+
+
+def write_start(el, f, indent=0, is_root=False, compact=None):
+    """
+    Start tag and text of an element whose children are written separately (write_element /
+    write_tail per child, then write_end). Returns the tag name to pass to write_end.
+    """
+    tag, chunks = _open_tag(el, is_root, compact)
+    _write_open_tag(f, _ws("  " * indent, compact), tag, chunks, ">")
+    _write_text_head(el, f, indent, compact)
+    return tag
+
+
+def write_tail(child, f, indent=0, compact=None):
+    """Text after child, inside the element at indent written with write_start."""
+    if child.tail and child.tail.strip():
+        f.write((_ws("  " * (indent + 1), compact) + _escape_text(child.tail.strip()) + _ws("\n", compact)).encode("utf-8"))
+
+
+def write_end(tag, f, indent=0, compact=None):
+    f.write((_ws("  " * indent, compact) + f"</{tag}>" + _ws("\n", compact)).encode("utf-8"))
+
+
+def write_element(el, f, indent=0, compact=None):
+    """One element with its children, as it appears inside the output document."""
+    _serialize_visio_svg(el, f, indent, compact=compact)
+
+
+def _serialize_visio_svg(el, f, indent=0, is_root=False, compact=None):
+    """
+    Write one element and children; preserve SVG, xlink, and Visio (v:) so styles and images work.
+    compact: None = indented output; a stats dict = compact output, counting bytes saved into it.
+    """
+    def ws(s):
+        return _ws(s, compact)
+
+    space = ws("  " * indent)
+    tag, chunks = _open_tag(el, is_root, compact)
+    has_children = len(el) > 0
+    text = (el.text or "").strip()
+    # Style/script: output content as CDATA so CSS and special chars are preserved for Visio
+    is_style_or_script = tag in ("style", "script")
+    if not has_children and not text and not is_style_or_script:
+        _write_open_tag(f, space, tag, chunks, "/>" + ws("\n"))
+        return
+    _write_open_tag(f, space, tag, chunks, ">")
+    if is_style_or_script and (text or (has_children and el.text)):
+        content = el.text or ""
+        for c in el:
+            if c.text:
+                content += c.text
+            if c.tail:
+                content += c.tail
+        # Blank lines around the CSS are dropped, so re-serializing an output (delta merge) does not grow it
+        content = _BLANK_EDGES_RE.sub("", content)
+        if content.strip():
+            f.write((ws("\n") + "<![CDATA[" + ws("\n")).encode("utf-8"))
+            f.write(content.encode("utf-8"))
+            f.write((ws("\n") + "]]>" + ws("\n")).encode("utf-8"))
+        f.write((ws("  " * indent) + f"</{tag}>" + ws("\n")).encode("utf-8"))
+        return
+    if text and not has_children:
+        f.write(_escape_text(el.text).encode("utf-8"))
+        f.write((f"</{tag}>" + ws("\n")).encode("utf-8"))
+        return
+    _write_text_head(el, f, indent, compact)
+    for child in el:
+        _serialize_visio_svg(child, f, indent + 1, is_root=False, compact=compact)
+        write_tail(child, f, indent, compact)
+    write_end(tag, f, indent, compact)
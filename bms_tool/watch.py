@@ -0,0 +1,278 @@
+"""
+Hot folder: process schedules and drawings dropped into an inbox, without the web server.
+
+    python -m bms_tool watch inbox -o outbox --jobs 4 --left-column SYSTEM
+    python -m bms_tool watch inbox -o outbox --templates uploads/svg_templates --once
+
+Each workbook (.xlsx/.xls) is one job. Its tables are written to outbox/<stem>/
+(<stem>_t<N>.svg and .xlsx), then merged into the drawing with the same stem (AHU1.xlsx +
+AHU1.svg). Without such a drawing and with --templates, each table is merged into the saved
+template that shares the most points with it. A drawing that arrives after its workbook
+is merged with the workbook from inbox/processed/.
+
+The inbox is polled every --interval seconds. A file is taken once its size and modification
+time have not changed for --settle seconds, so copies that arrive in pieces are not read
+half-written. Office lock files (~$*) and temporary names (.part, .tmp, .crdownload) are
+ignored. Processed inputs move to inbox/processed/, inputs of failed jobs to inbox/failed/.
+Every job adds one line to outbox/manifest.jsonl:
+
+    {"job", "workbook", "drawing", "status": "ok"/"failed", "error", "tables", "outputs",
+     "merged": [{"table", "drawing", "output", "bytes"}], "seconds", "finished"}
+
+Jobs run on --jobs processes; at most twice that many are queued, so a large drop is read
+as workers free up. --once processes what is in the inbox and exits.
+"""
+import json
+import os
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+WORKBOOK_EXTENSIONS = (".xlsx", ".xls")
+DRAWING_EXTENSIONS = (".svg",)
+_IGNORED_PREFIXES = ("~$", ".")
+_IGNORED_SUFFIXES = (".part", ".tmp", ".crdownload")
+PROCESSED_DIR = "processed"
+FAILED_DIR = "failed"
+MANIFEST_NAME = "manifest.jsonl"
+
+
+def _stem(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def _is_input(name):
+    lower = name.lower()
+    if lower.startswith(_IGNORED_PREFIXES) or lower.endswith(_IGNORED_SUFFIXES):
+        return False
+    return lower.endswith(WORKBOOK_EXTENSIONS + DRAWING_EXTENSIONS)
+
+
+# =================================================
+# JOB (module level so it pickles for the process pool)
+# =================================================
+_indexes = {}   # templates directory -> TemplateIndex, kept for the life of the pool process
+
+
+def _template_index(directory):
+    from bms_tool.template_index import TemplateIndex
+    index = _indexes.get(directory)
+    if index is None:
+        index = _indexes[directory] = TemplateIndex(directory)
+    return index
+
+
+def run_job(workbook, drawing, out_dir, templates=None, sheet=0, grid=False, options=None):
+    """
+    Extract the tables of workbook into out_dir/<stem>/ and merge them (into drawing, else
+    into the best template of the templates directory). Returns the manifest fields.
+    """
+    from bms_tool import api
+    from bms_tool.compiled import merge_template
+    from bms_tool.drawing import table_point_ids
+    options = dict(options or {})
+    stem = _stem(workbook)
+    job_dir = os.path.join(out_dir, stem)
+    tables = api.extract_tables(workbook, sheet=sheet)
+    outputs = []
+    merged = []
+    index = _template_index(templates) if templates and not drawing else None
+    for i, df in enumerate(tables, start=1):
+        table_stem = "%s_t%d" % (stem, i)
+        outputs.extend(api.write_table(df, job_dir, table_stem, grid=grid))
+        if drawing:
+            name = stem if len(tables) == 1 else "%s__%s" % (_stem(drawing), table_stem)
+            output = os.path.join(job_dir, name + ".svg")
+            report = api.merge(drawing, df, output, **options)
+            merged.append({"table": table_stem, "drawing": os.path.basename(drawing), "output": output,
+                           "bytes": report["bytes"]})
+            outputs.append(output)
+        elif index is not None:
+            ranked = index.rank(table_point_ids(df, options.get("point_column") or "POINT"))
+            if not ranked:
+                continue
+            template = ranked[0]["template"]
+            output = os.path.join(job_dir, "%s__%s.svg" % (table_stem, _stem(template)))
+            # Saved templates stay compiled in the pool process between jobs (bms_tool.compiled)
+            report = merge_template(os.path.join(templates, template), df, output, **options)
+            merged.append({"table": table_stem, "drawing": template, "output": output, "bytes": report["bytes"],
+                           "matched_points": ranked[0]["matched"]})
+            outputs.append(output)
+    return {"tables": len(tables), "outputs": outputs, "merged": merged}
+
+
+# =================================================
+# INBOX
+# =================================================
+class Inbox:
+    """Files of the inbox that have settled (same size and mtime for settle seconds)."""
+
+    def __init__(self, directory, settle=2.0):
+        self.directory = directory
+        self.settle = settle
+        self._seen = {}   # path -> ((size, mtime_ns), monotonic time that stat was first seen)
+
+    def poll(self):
+        """(settled paths, paths still changing)."""
+        now = time.monotonic()
+        settled = []
+        changing = []
+        current = {}
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError:
+            entries = []
+        for entry in entries:
+            if not _is_input(entry.name):
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+                st = entry.stat()
+            except OSError:
+                continue
+            stamp = (st.st_size, st.st_mtime_ns)
+            previous = self._seen.get(entry.path)
+            since = previous[1] if previous and previous[0] == stamp else now
+            current[entry.path] = (stamp, since)
+            (settled if now - since >= self.settle else changing).append(entry.path)
+        self._seen = current
+        return sorted(settled), sorted(changing)
+
+
+def _ignore_interrupt():
+    # Ctrl+C stops the watcher; the pool processes finish their job instead of dying mid-write
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _move(path, directory):
+    os.makedirs(directory, exist_ok=True)
+    target = os.path.join(directory, os.path.basename(path))
+    os.replace(path, target)
+    return target
+
+
+class Watcher:
+    """The polling loop: pairs settled inputs into jobs, runs them on the pool, writes the manifest."""
+
+    def __init__(self, inbox, out_dir, templates=None, sheet=0, grid=False, options=None, jobs=1,
+                 settle=2.0, interval=2.0):
+        self.inbox = Inbox(inbox, settle)
+        self.out_dir = out_dir
+        self.templates = templates
+        self.sheet = sheet
+        self.grid = grid
+        self.options = options or {}
+        self.jobs = max(1, jobs)
+        self.interval = interval
+        self.processed_dir = os.path.join(inbox, PROCESSED_DIR)
+        self.failed_dir = os.path.join(inbox, FAILED_DIR)
+        self.manifest = os.path.join(out_dir, MANIFEST_NAME)
+        self._busy = set()     # inputs of queued or running jobs
+        self._futures = {}     # future -> (workbook, drawing, started)
+        self.done = 0
+        self.failed = 0
+
+    def _jobs(self, settled, changing):
+        """(workbook, drawing) pairs ready to run."""
+        by_stem = {}
+        for path in settled:
+            kind = "drawing" if path.lower().endswith(DRAWING_EXTENSIONS) else "workbook"
+            by_stem.setdefault(_stem(path).lower(), {})[kind] = path
+        changing_stems = {_stem(p).lower() for p in changing}
+        ready = []
+        for stem, found in sorted(by_stem.items()):
+            if stem in changing_stems or any(p in self._busy for p in found.values()):
+                continue   # wait for the other half of the pair, or for the running job
+            workbook, drawing = found.get("workbook"), found.get("drawing")
+            if workbook is None:
+                # A drawing for a workbook processed earlier
+                earlier = [os.path.join(self.processed_dir, _stem(drawing) + ext) for ext in WORKBOOK_EXTENSIONS]
+                workbook = next((p for p in earlier if os.path.isfile(p)), None)
+                if workbook is None:
+                    continue
+            ready.append((workbook, drawing))
+        return ready
+
+    def _submit(self, pool, workbook, drawing):
+        future = pool.submit(run_job, workbook, drawing, self.out_dir, self.templates, self.sheet, self.grid,
+                             self.options)
+        self._futures[future] = (workbook, drawing, time.time())
+        self._busy.update(p for p in (workbook, drawing) if p)
+
+    def _finish(self, future):
+        workbook, drawing, started = self._futures.pop(future)
+        self._busy.difference_update((workbook, drawing))
+        record = {"job": _stem(workbook), "workbook": os.path.basename(workbook),
+                  "drawing": os.path.basename(drawing) if drawing else None}
+        try:
+            record.update(future.result())
+            record["status"] = "ok"
+            target = self.processed_dir
+            self.done += 1
+        except Exception as e:
+            record.update(status="failed", error="%s: %s" % (type(e).__name__, e))
+            target = self.failed_dir
+            self.failed += 1
+        record["seconds"] = round(time.time() - started, 2)
+        record["finished"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+        for path in (workbook, drawing):
+            if path and os.path.dirname(path) != self.processed_dir:
+                try:
+                    _move(path, target)
+                except OSError:
+                    pass
+        os.makedirs(self.out_dir, exist_ok=True)
+        with open(self.manifest, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+        print("%8.2fs  %-6s %s%s" % (record["seconds"], record["status"], record["workbook"],
+                                     " + " + record["drawing"] if record["drawing"] else ""))
+
+    def run(self, once=False):
+        """Poll until interrupted (once=True: until the inbox has nothing left to run). Returns failed jobs."""
+        with ProcessPoolExecutor(max_workers=self.jobs, initializer=_ignore_interrupt) as pool:
+            try:
+                while True:
+                    settled, changing = self.inbox.poll()
+                    ready = self._jobs(settled, changing)
+                    for workbook, drawing in ready:
+                        if len(self._futures) >= 2 * self.jobs:
+                            break
+                        self._submit(pool, workbook, drawing)
+                    if once and not self._futures and not ready and not changing:
+                        break
+                    if self._futures:
+                        done, _pending = wait(list(self._futures), timeout=self.interval, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            self._finish(future)
+                    else:
+                        time.sleep(self.interval)
+            except KeyboardInterrupt:
+                for future in list(self._futures):
+                    future.cancel()
+        return self.failed
+
+
+def main(args):
+    """watch command of bms_tool.cli."""
+    from bms_tool.prune import prune_kinds
+    if not os.path.isdir(args.inbox):
+        print("error: no such directory %s" % args.inbox)
+        return 2
+    options = {
+        "point_column": args.point_column,
+        "display_column": args.display_column,
+        "left_column": args.left_column,
+        "right_column": args.right_column,
+        "compact": args.compact,
+        "table_grid": args.table_grid,
+        "prune": prune_kinds(args.prune),
+    }
+    sheet = int(args.sheet) if str(args.sheet).isdigit() else args.sheet
+    watcher = Watcher(args.inbox, args.output, templates=args.templates, sheet=sheet, grid=args.table_grid,
+                      options=options, jobs=args.jobs, settle=args.settle, interval=args.interval)
+    print("watching %s -> %s (%d jobs at a time)%s" % (args.inbox, args.output, watcher.jobs,
+                                                       "" if not args.once else ", once"))
+    failed = watcher.run(once=args.once)
+    print("%d jobs, %d failed" % (watcher.done + watcher.failed, failed))
+    return 1 if failed else 0
@@ -0,0 +1,25 @@
+"""
+gunicorn settings, read automatically by `gunicorn app:app` (Procfile, render.yaml) and
+`gunicorn asgi:app -k uvicorn.workers.UvicornWorker` when started from this folder.
+
+The app is loaded once in the master (preload_app) and warmed up there before the workers
+are forked (app.preload): heavy imports, the template index and the compiled saved
+templates. Workers share that memory copy-on-write instead of each building their own,
+and their first request does not pay for it. Under uvicorn workers (asgi.py) merges run
+in a spawned heavy worker pool, which does not share this memory: each heavy worker
+compiles the saved templates itself when the pool starts. BMS_PRELOAD=0 loads the app in each worker
+instead (needed for `gunicorn --reload`).
+"""
+import os
+
+preload_app = os.environ.get("BMS_PRELOAD", "1").strip().lower() not in ("0", "false", "no")
+
+
+def when_ready(server):
+    """Master is up, workers not forked yet."""
+    if not preload_app:
+        return
+    import app
+    report = app.preload()
+    server.log.info("Preloaded %(compiled)d of %(templates)d templates, %(frozen_objects)d objects frozen "
+                    "(%(seconds).2fs)" % report)
@@ -0,0 +1,13 @@
+import os
+import sys
+import tempfile
+
+# Tests import app and bms_tool from the repository root
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Before app is imported: its catalog goes to a scratch folder and the artifact sweeper never
+# starts (it would evict from uploads/, which holds tracked sample files)
+_SCRATCH = tempfile.mkdtemp(prefix="bms-tests-")
+os.environ.setdefault("BMS_CATALOG_PATH", os.path.join(_SCRATCH, "catalog.sqlite3"))
+os.environ.setdefault("BMS_STORAGE_SWEEPER", "0")
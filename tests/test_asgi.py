@@ -0,0 +1,115 @@
+"""ASGI mode (asgi.py): bodies received on the event loop, the size cap, and the heavy process pool."""
+import asyncio
+import json
+import os
+
+import pytest
+
+import app as flask_module
+import asgi
+from bms_tool import guard
+from bms_tool.guard import ParseLimitExceeded
+from bms_tool.template_index import scan_template
+
+CSV = b"POINT,SYSTEM,OBJECT,DESCRIPTION,SIGNAL\n" + b"".join(
+    b"UI%d,AHU-1,OBJ%d,supply temperature %d,NTC\n" % (i, i, i) for i in range(1, 41))
+BOMB = (b'<?xml version="1.0"?>\n<!DOCTYPE svg [\n<!ENTITY a "lol">\n<!ENTITY b "&a;&a;&a;&a;">\n]>\n'
+        b'<svg xmlns="http://www.w3.org/2000/svg"><text>&b;</text></svg>')
+
+
+def _request(adapter, method, path, chunks, query=b"", headers=()):
+    """Send one request through the adapter, the body in chunks; returns (status, headers, body)."""
+    messages = [{"type": "http.request", "body": chunk, "more_body": i < len(chunks) - 1}
+                for i, chunk in enumerate(chunks)] or [{"type": "http.request", "body": b""}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": method, "path": path, "query_string": query, "root_path": "",
+             "http_version": "1.1", "scheme": "http", "server": ("testserver", 80), "client": ("127.0.0.1", 5000),
+             "headers": [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers]}
+    asyncio.run(adapter(scope, receive, send))
+    start = next(m for m in sent if m["type"] == "http.response.start")
+    body = b"".join(m.get("body", b"") for m in sent if m["type"] == "http.response.body")
+    return start["status"], dict(start["headers"]), body
+
+
+@pytest.fixture
+def adapter(monkeypatch):
+    # Threads: these tests are about the body path, not the process pool
+    monkeypatch.setenv("BMS_HEAVY_EXECUTOR", "thread")
+    adapter = asgi.AsgiAdapter(flask_module.app)
+    yield adapter
+    adapter._stop_heavy_pool()
+    adapter.request_pool.shutdown(wait=True)
+
+
+def test_upload_passes_through_in_chunks(adapter, monkeypatch):
+    # Spilled to disk after 64 bytes, so most chunks are written on the request pool
+    monkeypatch.setattr(asgi, "SPOOL_MAX_BYTES", 64)
+    chunks = [CSV[i:i + 100] for i in range(0, len(CSV), 100)]
+    status, headers, body = _request(adapter, "POST", "/ingest-rows", chunks, query=b"format=csv",
+                                     headers=[("Content-Type", "text/csv"), ("Content-Length", str(len(CSV)))])
+    assert status == 201, body
+    assert headers[b"content-type"].startswith(b"application/json")
+    reply = json.loads(body)
+    assert reply["rows"] == 40
+    df = flask_module._load_table(reply["table_id"])
+    assert df["POINT"].tolist() == ["UI%d" % i for i in range(1, 41)]
+
+
+def test_oversized_body_is_refused(adapter, monkeypatch):
+    monkeypatch.setitem(flask_module.app.config, "MAX_CONTENT_LENGTH", 1000)
+    chunks = [CSV[:600], CSV[600:1200], CSV[1200:]]
+    status, _headers, body = _request(adapter, "POST", "/ingest-rows", chunks, query=b"format=csv",
+                                      headers=[("Content-Type", "text/csv")])
+    assert (status, body) == (413, b"Upload too large.")
+
+
+def test_lifespan_starts_and_stops_the_heavy_pool(adapter):
+    events = [{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}]
+    sent = []
+
+    async def receive():
+        return events.pop(0)
+
+    async def send(message):
+        sent.append(message["type"])
+        if message["type"] == "lifespan.startup.complete":
+            assert flask_module._HEAVY_EXECUTOR is adapter.heavy_pool is not None
+
+    asyncio.run(adapter({"type": "lifespan"}, receive, send))
+    assert sent == ["lifespan.startup.complete", "lifespan.shutdown.complete"]
+    assert flask_module._HEAVY_EXECUTOR is None
+
+
+def test_health(adapter):
+    status, _headers, _body = _request(adapter, "GET", "/health", [])
+    assert status == 200
+
+
+@pytest.fixture(scope="module")
+def process_pool():
+    pool = asgi._make_heavy_executor()
+    flask_module.set_heavy_executor(pool)
+    yield pool
+    flask_module.set_heavy_executor(None)
+    pool.shutdown(wait=True)
+
+
+def test_heavy_process_pool_returns_results(process_pool):
+    template = os.path.join(flask_module.SVG_TEMPLATES_DIR, "CGE09090.svg")
+    assert flask_module.run_heavy(scan_template, template) == scan_template(template)
+
+
+def test_heavy_process_pool_raises_parse_limits_intact(process_pool, tmp_path):
+    bomb = tmp_path / "bomb.svg"
+    bomb.write_bytes(BOMB)
+    with pytest.raises(ParseLimitExceeded) as raised:
+        flask_module.run_heavy(guard.parse_svg, str(bomb))
+    assert (raised.value.filename, raised.value.limit) == ("bomb.svg", "entities")
+    assert "bomb.svg has entity declarations" in str(raised.value)
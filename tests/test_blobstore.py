@@ -0,0 +1,170 @@
+"""S3BlobStore against an in-memory stand-in for the boto3 client (passed as client=)."""
+import hashlib
+import io
+import os
+
+import pytest
+
+from bms_tool.blobstore import S3BlobStore, file_digest
+from bms_tool.uploads import SpooledUpload
+
+
+class ClientError(Exception):
+    """As botocore's: the error code in response["Error"]["Code"]."""
+
+    def __init__(self, code):
+        super().__init__(code)
+        self.response = {"Error": {"Code": code}}
+
+
+class FakeS3:
+    """The boto3 S3 client calls S3BlobStore makes, on a dict; calls are counted."""
+
+    def __init__(self):
+        self.objects = {}   # (bucket, key) -> bytes
+        self.calls = {}
+
+    def _count(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def _body(self, bucket, key, code):
+        try:
+            return self.objects[(bucket, key)]
+        except KeyError:
+            raise ClientError(code)
+
+    def head_object(self, Bucket, Key):
+        self._count("head_object")
+        self._body(Bucket, Key, "404")
+        return {}
+
+    def upload_file(self, Filename, Bucket, Key):
+        self._count("upload_file")
+        with open(Filename, "rb") as f:
+            self.objects[(Bucket, Key)] = f.read()
+
+    def download_file(self, Bucket, Key, Filename):
+        self._count("download_file")
+        body = self._body(Bucket, Key, "404")
+        with open(Filename, "wb") as f:
+            f.write(body)
+
+    def put_object(self, Bucket, Key, Body):
+        self._count("put_object")
+        self.objects[(Bucket, Key)] = Body
+
+    def get_object(self, Bucket, Key):
+        self._count("get_object")
+        return {"Body": io.BytesIO(self._body(Bucket, Key, "NoSuchKey"))}
+
+    def delete_object(self, Bucket, Key):
+        self._count("delete_object")
+        self.objects.pop((Bucket, Key), None)
+
+    def get_paginator(self, name):
+        assert name == "list_objects_v2"
+        objects = self.objects
+
+        class Paginator:
+            def paginate(self, Bucket, Prefix):
+                yield {"Contents": [{"Key": key, "ETag": '"%s"' % hashlib.md5(body).hexdigest()}
+                                    for (bucket, key), body in sorted(objects.items())
+                                    if bucket == Bucket and key.startswith(Prefix)]}
+
+        return Paginator()
+
+
+@pytest.fixture
+def s3():
+    return FakeS3()
+
+
+def _store(s3, tmp_path, name="a"):
+    return S3BlobStore("bucket", "bms", cache_dir=str(tmp_path / ("cache-" + name)), client=s3)
+
+
+def _file(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_identical_files_are_uploaded_once(s3, tmp_path):
+    store = _store(s3, tmp_path)
+    first = store.put_file(_file(tmp_path, "one.svg", b"<svg/>"))
+    second = store.put_file(_file(tmp_path, "two.svg", b"<svg/>"), move=True)
+    assert first == second == hashlib.sha256(b"<svg/>").hexdigest()
+    assert not os.path.exists(tmp_path / "two.svg")
+    assert s3.calls["upload_file"] == 1
+    assert store.stats()["deduplicated"] == 1
+    assert ("bucket", "bms/blobs/" + first) in s3.objects
+
+
+def test_put_upload(s3, tmp_path):
+    data = b"workbook bytes"
+    upload = SpooledUpload("book.xlsx", io.BytesIO(data), hashlib.sha256(data).hexdigest(), len(data))
+    store = _store(s3, tmp_path)
+    digest = store.put_upload(upload)
+    assert file_digest(store.local_path(digest)) == digest
+    assert s3.objects[("bucket", "bms/blobs/" + digest)] == data
+
+
+def test_another_instance_downloads_through_its_cache(s3, tmp_path):
+    digest = _store(s3, tmp_path, "a").put_file(_file(tmp_path, "out.svg", b"<svg>merged</svg>"))
+    other = _store(s3, tmp_path, "b")
+    path = other.local_path(digest)
+    assert path == str(tmp_path / "cache-b" / digest)
+    with open(path, "rb") as f:
+        assert f.read() == b"<svg>merged</svg>"
+    assert other.local_path(digest) == path
+    stats = other.stats()
+    assert (stats["cache_misses"], stats["cache_hits"], s3.calls["download_file"]) == (1, 1, 1)
+
+
+def test_missing_blob_is_not_found(s3, tmp_path):
+    store = _store(s3, tmp_path)
+    digest = hashlib.sha256(b"never stored").hexdigest()
+    assert not store.exists(digest)
+    with pytest.raises(FileNotFoundError):
+        store.local_path(digest)
+    assert os.listdir(tmp_path / "cache-a") == []
+
+
+def test_tampered_download_is_rejected(s3, tmp_path):
+    digest = _store(s3, tmp_path, "a").put_file(_file(tmp_path, "out.svg", b"<svg/>"))
+    s3.objects[("bucket", "bms/blobs/" + digest)] = b"<svg>changed</svg>"
+    with pytest.raises(IOError):
+        _store(s3, tmp_path, "b").local_path(digest)
+    assert os.listdir(tmp_path / "cache-b") == []
+
+
+def test_refs(s3, tmp_path):
+    store = _store(s3, tmp_path)
+    ahu = store.put_file(_file(tmp_path, "AHU_1.svg", b"<svg>ahu</svg>"))
+    fcu = store.put_file(_file(tmp_path, "FCU_1.svg", b"<svg>fcu</svg>"))
+    store.set_ref("templates", "AHU_1.svg", ahu)
+    store.set_ref("templates", "FCU_1.svg", fcu)
+    other = _store(s3, tmp_path, "b")
+    assert other.refs("templates") == {"AHU_1.svg": ahu, "FCU_1.svg": fcu}
+    assert other.refs("outputs") == {}
+
+    store.set_ref("templates", "AHU_1.svg", fcu)
+    store.delete_ref("templates", "FCU_1.svg")
+    store.delete_ref("templates", "FCU_1.svg")   # already gone
+    assert other.refs("templates") == {"AHU_1.svg": fcu}
+    with pytest.raises(ValueError):
+        store.set_ref("templates", "../escape", ahu)
+
+
+def test_refs_fetch_only_changed_bodies(s3, tmp_path):
+    store = _store(s3, tmp_path)
+    digests = [store.put_file(_file(tmp_path, "t%d.svg" % i, b"<svg>%d</svg>" % i)) for i in range(3)]
+    for i, digest in enumerate(digests):
+        store.set_ref("templates", "t%d.svg" % i, digest)
+    store.refs("templates")
+    assert s3.calls["get_object"] == 3
+    store.refs("templates")
+    assert s3.calls["get_object"] == 3
+    store.set_ref("templates", "t0.svg", digests[1])
+    assert store.refs("templates")["t0.svg"] == digests[1]
+    assert s3.calls["get_object"] == 4
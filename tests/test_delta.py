@@ -0,0 +1,67 @@
+"""Delta merges (update_svg_delta) write what a full merge of the revised table writes."""
+import glob
+import os
+
+import pytest
+
+from bms_tool.drawing import update_svg, update_svg_delta
+from bms_tool.guard import ParseLimitExceeded
+from bms_tool.regress import COLUMNS, point_table
+from bms_tool.svgdiff import compare
+from bms_tool.template_index import scan_template
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEMPLATES = sorted(glob.glob(os.path.join(ROOT, "uploads", "svg_templates", "*.svg")))
+OPTIONS = {"plain": {}, "compact": {"compact": True}, "grid": {"table_grid": True}}
+
+
+def _revised(df):
+    """df with one point changed, one removed and one added (a point of the drawing left out before)."""
+    new = df.copy()
+    new.loc[new.index[0], "DESCRIPTION"] = "changed description"
+    new.loc[new.index[1], "SIGNAL"] = "0-10V" if new.loc[new.index[1], "SIGNAL"] != "0-10V" else "DI"
+    return new.drop(new.index[2]).reset_index(drop=True)
+
+
+def _tables(drawing):
+    points = scan_template(drawing)["points"]
+    old = point_table(points)
+    new = _revised(old)
+    left_out = [p for p in points if p not in set(old["POINT"])]
+    new.loc[len(new)] = [left_out[0], "AHU1", "NEW", "added point", "NTC"]
+    return old, new
+
+
+@pytest.mark.parametrize("option_name", sorted(OPTIONS))
+@pytest.mark.parametrize("drawing", TEMPLATES, ids=os.path.basename)
+def test_delta_matches_full_merge(drawing, option_name, tmp_path):
+    options = dict(COLUMNS, **OPTIONS[option_name])
+    old, new = _tables(drawing)
+    previous = str(tmp_path / "previous.svg")
+    update_svg(drawing, old, previous, **options)
+    delta, full = str(tmp_path / "delta.svg"), str(tmp_path / "full.svg")
+    report = update_svg_delta(previous, old, new, delta, **options)
+    update_svg(drawing, new, full, **options)
+    assert compare(full, delta) == []
+    changes = report["changes"]
+    assert [len(changes[k]) for k in ("added", "removed", "changed")] == [1, 1, 2]
+    assert report["table_updated"]
+
+
+def test_unchanged_table_rewrites_nothing(tmp_path):
+    drawing = TEMPLATES[0]
+    old, _new = _tables(drawing)
+    previous, delta = str(tmp_path / "previous.svg"), str(tmp_path / "delta.svg")
+    update_svg(drawing, old, previous, **COLUMNS)
+    report = update_svg_delta(previous, old, old.copy(), delta, **COLUMNS)
+    assert (report["groups_updated"], report["images_updated"], report["table_updated"]) == (0, 0, False)
+    assert compare(previous, delta) == []
+
+
+def test_previous_drawing_is_parsed_within_budgets(tmp_path):
+    old, new = _tables(TEMPLATES[0])
+    bomb = tmp_path / "previous.svg"
+    bomb.write_bytes(b'<!DOCTYPE svg [<!ENTITY a "x"><!ENTITY b "&a;&a;">]>'
+                     b'<svg xmlns="http://www.w3.org/2000/svg">&b;</svg>')
+    with pytest.raises(ParseLimitExceeded):
+        update_svg_delta(str(bomb), old, new, str(tmp_path / "out.svg"))
@@ -0,0 +1,136 @@
+"""Parsing budgets (bms_tool.guard): every budget refuses with ParseLimitExceeded."""
+import io
+import pickle
+
+import pytest
+
+import app
+from bms_tool import guard
+from bms_tool.guard import ParseLimitExceeded, check_svg, parse_svg, read_excel
+from bms_tool.lazy import pandas
+
+SVG_NS = 'xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink"'
+# "Billion laughs": each entity is ten of the previous one, lol9 a billion "lol"s
+LAUGHS = ('<?xml version="1.0"?>\n<!DOCTYPE svg [\n<!ENTITY lol0 "lol">\n'
+          + "".join('<!ENTITY lol%d "%s">\n' % (i, "&lol%d;" % (i - 1) * 10) for i in range(1, 10))
+          + ']>\n<svg %s><text>&lol9;</text></svg>' % SVG_NS).encode("ascii")
+
+
+def _svg(body, prolog=""):
+    return io.BytesIO(('%s<svg %s>%s</svg>' % (prolog, SVG_NS, body)).encode("utf-8"))
+
+
+def _refused(limit, parse, source, name="drawing.svg"):
+    before = guard.stats()["refused"].get(limit, 0)
+    with pytest.raises(ParseLimitExceeded) as raised:
+        parse(source, name=name)
+    assert (raised.value.limit, raised.value.filename) == (limit, name)
+    assert guard.stats()["refused"][limit] == before + 1
+    return raised.value
+
+
+@pytest.fixture
+def limits(monkeypatch):
+    def set_limit(name, value):
+        monkeypatch.setitem(guard.LIMITS, name, value)
+    return set_limit
+
+
+def test_within_budgets():
+    tree = parse_svg(_svg("<g><rect/></g>", prolog='<!DOCTYPE svg [<!ENTITY ns "http://example.com/ns">]>'),
+                     name="ok.svg")
+    assert tree.getroot().tag.endswith("svg")
+
+
+@pytest.mark.parametrize("prolog", [
+    '<!DOCTYPE svg [<!ENTITY a "x"><!ENTITY b "&a;&a;">]>',
+    '<!DOCTYPE svg [<!ENTITY ext SYSTEM "file:///etc/passwd">]>',
+    '<!DOCTYPE svg [<!ENTITY % p "x">]>',
+])
+def test_entities(prolog):
+    error = _refused("entities", parse_svg, _svg("<text/>", prolog))
+    assert "drawing.svg has entity declarations" in str(error)
+
+
+def test_entity_expansion_is_refused_before_expanding():
+    _refused("entities", check_svg, io.BytesIO(LAUGHS), name="laughs.svg")
+
+
+def test_svg_bytes(limits):
+    limits("svg_bytes", 100)
+    error = _refused("svg_bytes", parse_svg, _svg("<rect/>" * 50))
+    assert "BMS_MAX_SVG_BYTES" in str(error) and error.budget == 100
+
+
+def test_svg_elements(limits):
+    limits("svg_elements", 10)
+    assert _refused("svg_elements", check_svg, _svg("<rect/>" * 10)).value == 11
+    check_svg(_svg("<rect/>" * 9))
+
+
+def test_svg_depth(limits):
+    limits("svg_depth", 5)
+    _refused("svg_depth", parse_svg, _svg("<g>" * 5 + "</g>" * 5))
+    parse_svg(_svg("<g>" * 4 + "</g>" * 4))
+
+
+def test_image_bytes(limits):
+    limits("image_bytes", 64)
+    image = '<image xlink:href="data:image/png;base64,%s"/>' % ("A" * 100)
+    _refused("image_bytes", parse_svg, _svg(image))
+    _refused("image_bytes", parse_svg, _svg(image.replace("xlink:href", "href")))
+
+
+def test_parse_seconds(limits):
+    limits("parse_seconds", 1e-9)
+    _refused("parse_seconds", check_svg, _svg("<rect/>" * (guard._CLOCK_EVERY * 2)))
+
+
+def _workbook(rows, columns):
+    buf = io.BytesIO()
+    pandas().DataFrame([["v"] * columns for _ in range(rows)]).to_excel(buf, index=False, header=False)
+    buf.seek(0)
+    return buf
+
+
+def test_excel_within_budgets(limits):
+    limits("sheet_rows", 5)
+    limits("sheet_columns", 3)
+    assert read_excel(_workbook(5, 3), name="book.xlsx", header=None).shape == (5, 3)
+
+
+def test_excel_bytes(limits):
+    limits("excel_bytes", 100)
+    _refused("excel_bytes", read_excel, _workbook(2, 2), name="book.xlsx")
+
+
+def test_xlsx_unpacked_bytes(limits):
+    limits("xlsx_unpacked_bytes", 1000)
+    _refused("xlsx_unpacked_bytes", read_excel, _workbook(50, 20), name="book.xlsx")
+
+
+def test_sheet_rows(limits):
+    limits("sheet_rows", 5)
+    _refused("sheet_rows", lambda s, name: read_excel(s, name=name, header=None), _workbook(6, 2), name="book.xlsx")
+
+
+def test_sheet_columns(limits):
+    limits("sheet_columns", 3)
+    _refused("sheet_columns", lambda s, name: read_excel(s, name=name, header=None), _workbook(2, 4),
+             name="book.xlsx")
+
+
+def test_error_pickles_with_its_fields():
+    error = pickle.loads(pickle.dumps(ParseLimitExceeded("a.svg", "svg_depth", 300, 256)))
+    assert (error.filename, error.limit, error.value, error.budget) == ("a.svg", "svg_depth", 300, 256)
+    assert str(error) == "a.svg has more than 256 levels of nesting (BMS_MAX_SVG_DEPTH)."
+
+
+def test_merge_delta_checks_the_uploaded_previous_drawing():
+    reply = app.app.test_client().post("/ingest-rows?format=json", data=b'[{"POINT": "UI1"}]',
+                                       content_type="application/json")
+    table_id = reply.get_json()["table_id"]
+    reply = app.app.test_client().post("/merge-delta", content_type="multipart/form-data", data={
+        "previous_svg": (io.BytesIO(LAUGHS), "previous.svg"), "old_table_id": table_id, "table_id": table_id})
+    assert reply.status_code == 413
+    assert reply.get_data(as_text=True).startswith("previous.svg has entity declarations")
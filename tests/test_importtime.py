@@ -0,0 +1,21 @@
+"""`import app` stays within the worker boot budget of bms_tool.importtime."""
+import os
+
+from bms_tool import importtime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _best_of(runs):
+    return min((importtime.measure("app", cwd=ROOT) for _ in range(runs)), key=lambda m: m[0])
+
+
+def test_app_import_within_budget():
+    total_us, _rows = _best_of(3)
+    assert total_us / 1000.0 <= importtime.BUDGET_MS
+
+
+def test_app_import_leaves_heavy_modules_lazy():
+    _total_us, rows = importtime.measure("app", cwd=ROOT)
+    imported = {name.split(".")[0] for _, _, name in rows}
+    assert not imported & set(importtime.HEAVY_MODULES)
@@ -0,0 +1,106 @@
+"""Point rows from JSON / CSV (bms_tool.rows)."""
+import io
+
+import pytest
+
+from bms_tool import rows
+from bms_tool.rows import RowsError, detect_format, parse_rows, read_table_model, write_table_model
+from bms_tool.tables import TABLE_COLUMNS
+from bms_tool.uploads import UploadTooLarge
+
+
+def _parse(data, fmt, **kwargs):
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return parse_rows(io.BytesIO(data), fmt, **kwargs)
+
+
+def _records(df):
+    return df.values.tolist()
+
+
+@pytest.mark.parametrize("filename, content_type, expected", [
+    ("points.CSV", None, "csv"),
+    ("points.jsonl", None, "json"),
+    (None, "application/json; charset=utf-8", "json"),
+    (None, "application/x-ndjson", "json"),
+    ("points.txt", "text/csv", "csv"),
+    ("points.txt", "text/plain", None),
+])
+def test_detect_format(filename, content_type, expected):
+    assert detect_format(filename, content_type) == expected
+
+
+def test_json_array_objects_any_key_case():
+    df = _parse('[{"point": "BO1", "System": "AHU-1", "SIGNAL": "24Vac", "extra": 1}, {"POINT": 12.0}]', "json")
+    assert list(df.columns) == TABLE_COLUMNS
+    assert _records(df) == [["BO1", "AHU-1", "", "", "24Vac"], ["12", "", "", "", ""]]
+
+
+def test_json_wrapper_ndjson_and_arrays():
+    assert _records(_parse('{"rows": [{"POINT": "UI1"}, ["UI2", "AHU-1"]]}', "json")) == [
+        ["UI1", "", "", "", ""], ["UI2", "AHU-1", "", "", ""]]
+    assert _records(_parse('{"POINT": "UI1"}\n\n{"POINT": "UI2"}\n', "json"))[1][0] == "UI2"
+    # Arrays longer than the table columns are cut
+    assert _records(_parse('[["UI1", "a", "b", "c", "d", "e"]]', "json")) == [["UI1", "a", "b", "c", "d"]]
+
+
+def test_json_empty_and_blank_rows():
+    assert _parse("[]", "json").empty
+    assert _parse("", "json").empty
+    assert _records(_parse('[{"POINT": ""}, {"POINT": "BO1"}, {"POINT": null}]', "json")) == [["BO1", "", "", "", ""]]
+
+
+def test_json_values_across_read_chunks(monkeypatch):
+    # Values and bare numbers cut at a chunk boundary are read on
+    monkeypatch.setattr(rows, "CHUNK_SIZE", 7)
+    data = '[{"POINT": "UI1", "DESCRIPTION": "%s"}, [123456789, "AHU"]]' % ("x" * 50)
+    assert _records(_parse(data, "json")) == [["UI1", "", "", "x" * 50, ""], ["123456789", "AHU", "", "", ""]]
+
+
+@pytest.mark.parametrize("data, message", [
+    ('[{"POINT": "UI1"}', "Invalid JSON"),
+    ('[{"POINT": "UI1"} {"POINT": "UI2"}]', "expected ','"),
+    ('[{"NAME": "UI1"}]', "none of the columns"),
+    ('["UI1", "UI2"]', "objects or arrays"),
+])
+def test_bad_json(data, message):
+    with pytest.raises(RowsError, match=message):
+        _parse(data, "json")
+
+
+def test_csv_header_order_case_bom_and_short_rows():
+    data = "\ufeffsignal,Point,IGNORED,system\r\n24Vac,BO1,x,AHU-1\r\nNTC,UI2\r\n,,,\r\n"
+    assert _records(_parse(data, "csv")) == [["BO1", "AHU-1", "", "", "24Vac"], ["UI2", "", "", "", "NTC"]]
+
+
+def test_csv_quoted_newlines_and_commas():
+    data = 'POINT,DESCRIPTION\nUI1,"supply air, after coil\nsecond line"\n'
+    assert _records(_parse(data, "csv")) == [["UI1", "", "", "supply air, after coil\nsecond line", ""]]
+
+
+def test_csv_without_known_columns_or_rows():
+    with pytest.raises(RowsError, match="none of the columns"):
+        _parse("NAME,VALUE\nUI1,1\n", "csv")
+    assert _parse("", "csv").empty
+    assert _parse("POINT,SYSTEM\n", "csv").empty
+
+
+def test_unknown_format():
+    with pytest.raises(RowsError, match="Unknown rows format"):
+        _parse("POINT\nUI1\n", "xml")
+
+
+def test_size_cap():
+    data = "POINT\n" + "UI1\n" * 1000
+    with pytest.raises(UploadTooLarge):
+        _parse(data, "csv", max_bytes=1000, filename="rows.csv")
+    assert len(_parse(data, "csv", max_bytes=len(data))) == 1000
+
+
+def test_table_model_round_trip(tmp_path):
+    df = _parse('[{"POINT": "UI1", "DESCRIPTION": "héat, \\"quoted\\""}, {"POINT": "UI2"}]', "json")
+    path = write_table_model(df, str(tmp_path / "t.table.json"))
+    back = read_table_model(path)
+    assert list(back.columns) == TABLE_COLUMNS
+    assert _records(back) == _records(df)